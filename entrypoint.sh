@@ -28,6 +28,13 @@ log_error() {
 # 设置默认环境变量
 export TIMEZONE=${TIMEZONE:-"Asia/Shanghai"}
 export LOG_LEVEL=${LOG_LEVEL:-"INFO"}
+# 定时任务执行方式: python(常驻调度器执行，cron兜底) / cron(仅使用cron)
+export SCHEDULER_MODE=${SCHEDULER_MODE:-"python"}
+# 后台服务监管方式: python(service_supervisor.py 直接管理服务进程) / bash(task_monitor.sh 定时轮询)
+export SUPERVISOR_MODE=${SUPERVISOR_MODE:-"python"}
+if [[ "$SUPERVISOR_MODE" == "python" && ! -f "/app/scripts/service_supervisor.py" ]]; then
+    export SUPERVISOR_MODE="bash"
+fi
 
 log_info "容器启动中..."
 log_info "时区设置: $TIMEZONE"
@@ -47,6 +54,36 @@ SYSTEM_LOG_DIR="$LOGS_DIR/system"
 PROJECTS_LOG_DIR="$LOGS_DIR/projects"
 REGISTRATION_LOG="$SYSTEM_LOG_DIR/registration.log"
 SERVICES_CONF="$SYSTEM_LOG_DIR/services.conf"
+SCHEDULER_LOG="$SYSTEM_LOG_DIR/job_scheduler.log"
+SCHEDULER_PID_FILE="$SYSTEM_LOG_DIR/job_scheduler.pid"
+SUPERVISOR_LOG="$SYSTEM_LOG_DIR/service_supervisor.log"
+SUPERVISOR_PID_FILE="$SYSTEM_LOG_DIR/service_supervisor.pid"
+STATUS_SERVER_LOG="$SYSTEM_LOG_DIR/status_server.log"
+STATUS_SERVER_PID_FILE="$SYSTEM_LOG_DIR/status_server.pid"
+
+# 启动状态服务，脚本不存在时退回到只返回 Healthy 的 nc 监听
+start_status_server() {
+    if [[ -f "/app/scripts/status_server.py" ]]; then
+        nohup python3 /app/scripts/status_server.py --port 8080 >> "$STATUS_SERVER_LOG" 2>&1 &
+        echo $! > "$STATUS_SERVER_PID_FILE"
+        log_info "状态服务已启动，PID: $!"
+    else
+        nohup bash -c 'while true; do echo -e "HTTP/1.1 200 OK\n\nHealthy" | nc -l -p 8080 -q 1; done' &
+    fi
+}
+
+# 启动常驻任务调度器
+start_job_scheduler() {
+    if [[ "$SCHEDULER_MODE" != "python" ]]; then
+        return 0
+    fi
+    if [[ ! -f "/app/scripts/job_scheduler.py" ]]; then
+        log_warn "任务调度器脚本不存在，定时任务将由cron执行"
+        return 0
+    fi
+    nohup python3 /app/scripts/job_scheduler.py daemon >> "$SCHEDULER_LOG" 2>&1 &
+    log_info "任务调度器已启动，PID: $!"
+}
 
 # 创建必要的目录
 create_directories() {
@@ -76,7 +113,12 @@ SHELL=/bin/bash
 PATH=/usr/local/bin:/usr/bin:/bin:/sbin:/usr/sbin
 HOME=/root
 PYTHONUNBUFFERED=1
+# cron 执行的任务不继承容器环境变量，job_runner.py/run_history.py 使用的配置需要写在这里
+MAX_HEAVY_JOBS=${MAX_HEAVY_JOBS:-2}
+RUN_HISTORY_WEBHOOK_URL=${RUN_HISTORY_WEBHOOK_URL:-}
 # =============================
+# 轮转超时的项目日志并清理过期归档
+0 * * * * [ -f /app/scripts/log_store.py ] && python3 /app/scripts/log_store.py rotate >> /app/logs/system/log_store.log 2>&1
 
 EOF
 
@@ -142,15 +184,24 @@ fi
 
 # 显示当前注册的任务
 log_info "当前已注册的定时任务:"
-crontab -l 2>/dev/null | grep -v "^#" | grep -v "^$" | grep -v "^SHELL\|^PATH\|^HOME\|^PYTHON" || log_info "  (无定时任务)"
+crontab -l 2>/dev/null | grep -v "^#" | grep -v "^$" | grep -v "^SHELL\|^PATH\|^HOME\|^PYTHON\|^MAX_HEAVY_JOBS\|^RUN_HISTORY" || log_info "  (无定时任务)"
+
+# 启动常驻任务调度器（存活期间由其执行定时任务，cron仅作兜底）
+log_info "定时任务执行方式: $SCHEDULER_MODE"
+start_job_scheduler
 
-# 创建健康检查监听
+# 启动状态/健康检查服务（/health、/status、/metrics）
 log_info "启动健康检查监听..."
-nohup bash -c 'while true; do echo -e "HTTP/1.1 200 OK\n\nHealthy" | nc -l -p 8080 -q 1; done' &
+start_status_server
 
+# 启动服务监管进程（启动并监管 services.conf 中登记的后台服务）
+if [[ "$SUPERVISOR_MODE" == "python" ]]; then
+    log_info "启动服务监管进程..."
+    nohup python3 /app/scripts/service_supervisor.py daemon >> "$SUPERVISOR_LOG" 2>&1 &
+    log_info "服务监管进程已启动，PID: $!"
 # 启动任务监控器（用于监控后台服务）
-log_info "启动任务监控器..."
-if [[ -f "/app/scripts/task_monitor.sh" ]]; then
+elif [[ -f "/app/scripts/task_monitor.sh" ]]; then
+    log_info "启动任务监控器..."
     chmod +x /app/scripts/task_monitor.sh
     nohup /app/scripts/task_monitor.sh daemon >> /app/logs/system/task_monitor.log 2>&1 &
     MONITOR_PID=$!
@@ -185,8 +236,15 @@ while true; do
         fi
     fi
     
+    # 检查服务监管进程是否还在运行（重启后接管仍在运行的服务）
+    if [[ "$SUPERVISOR_MODE" == "python" ]]; then
+        if ! kill -0 "$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)" 2>/dev/null; then
+            log_warn "服务监管进程已停止，尝试重启..."
+            nohup python3 /app/scripts/service_supervisor.py daemon >> "$SUPERVISOR_LOG" 2>&1 &
+            log_info "服务监管进程已重启，新PID: $!"
+        fi
     # 检查任务监控器是否还在运行
-    if [ -f "/app/logs/system/monitor.pid" ]; then
+    elif [ -f "/app/logs/system/monitor.pid" ]; then
         MONITOR_PID=$(cat /app/logs/system/monitor.pid)
         if ! kill -0 $MONITOR_PID 2>/dev/null; then
             log_warn "任务监控器已停止，尝试重启..."
@@ -198,6 +256,20 @@ while true; do
             fi
         fi
     fi
+
+    # 检查状态服务是否还在运行
+    if [[ -f "$STATUS_SERVER_PID_FILE" ]] && ! kill -0 "$(cat "$STATUS_SERVER_PID_FILE" 2>/dev/null)" 2>/dev/null; then
+        log_warn "状态服务已停止，尝试重启..."
+        start_status_server
+    fi
+
+    # 检查任务调度器是否还在运行（停止期间由cron兜底执行定时任务）
+    if [[ "$SCHEDULER_MODE" == "python" && -f "/app/scripts/job_scheduler.py" ]]; then
+        if ! kill -0 "$(cat "$SCHEDULER_PID_FILE" 2>/dev/null)" 2>/dev/null; then
+            log_warn "任务调度器已停止，尝试重启..."
+            start_job_scheduler
+        fi
+    fi
     
     # 每30秒检查一次
     sleep 30
@@ -40,6 +40,8 @@ show_usage() {
     echo "选项:"
     echo -e "  ${GREEN}-f, --follow${NC}   实时跟踪日志"
     echo -e "  ${GREEN}-n, --lines${NC}    显示最后N行 (默认50)"
+    echo -e "  ${GREEN}-s, --since${NC}    按时间查询的开始时间 (如 \"2025-09-01 08:00\" 或 2h)"
+    echo -e "  ${GREEN}-u, --until${NC}    按时间查询的结束时间 (默认当前)"
     echo -e "  ${GREEN}-h, --help${NC}     显示帮助信息"
     echo ""
     echo "示例:"
@@ -47,12 +49,15 @@ show_usage() {
     echo "  $0 -f task2        # 实时跟踪任务2日志"
     echo "  $0 -n 100 task3    # 查看任务3最后100行日志"
     echo "  $0 all             # 查看所有日志摘要"
+    echo "  $0 -s 2h task1     # 查看任务1最近2小时的日志 (含已轮转日志)"
 }
 
 # 参数解析
 FOLLOW=false
 LINES=50
 TASK=""
+SINCE=""
+UNTIL=""
 
 while [[ $# -gt 0 ]]; do
     case $1 in
@@ -64,6 +69,14 @@ while [[ $# -gt 0 ]]; do
             LINES="$2"
             shift 2
             ;;
+        -s|--since)
+            SINCE="$2"
+            shift 2
+            ;;
+        -u|--until)
+            UNTIL="$2"
+            shift 2
+            ;;
         -h|--help)
             show_usage
             exit 0
@@ -135,6 +148,23 @@ show_all_logs() {
     fi
 }
 
+# 按时间范围查询日志：在容器内通过日志存储的时间索引定位，不扫描整个文件
+query_task_log() {
+    local task=$1
+    
+    if ! docker ps --filter "name=cron-tasks" --filter "status=running" | grep -q cron-tasks; then
+        log_error "容器未运行"
+        exit 1
+    fi
+    
+    local args=(query "$task" --since "$SINCE")
+    if [ -n "$UNTIL" ]; then
+        args+=(--until "$UNTIL")
+    fi
+    log_info "$task 日志 ($SINCE ~ ${UNTIL:-现在}):"
+    docker exec cron-tasks python3 /app/scripts/log_store.py "${args[@]}"
+}
+
 # 查看单个日志
 view_single_log() {
     local task=$1
@@ -214,6 +244,10 @@ case $TASK in
         show_all_logs
         ;;
     *)
-        view_single_log "$TASK"
+        if [ -n "$SINCE" ]; then
+            query_task_log "$TASK"
+        else
+            view_single_log "$TASK"
+        fi
         ;;
 esac
\ No newline at end of file
@@ -114,6 +114,19 @@ check_recent_logs "/app/logs/task1.log" "任务1"
 check_recent_logs "/app/logs/task2.log" "任务2" 
 check_recent_logs "/app/logs/task3.log" "任务3"
 
+# 执行记录中最近一次执行失败或明显慢于历史耗时的任务
+if [ -f "/app/scripts/run_history.py" ]; then
+    if RUN_PROBLEMS=$(python3 /app/scripts/run_history.py check); then
+        log_health "${GREEN}✓${NC} 最近的任务执行均正常"
+    else
+        while IFS= read -r problem; do
+            [ -n "$problem" ] || continue
+            log_health "${YELLOW}⚠${NC} $problem"
+            ISSUES+=("$problem")
+        done <<< "$RUN_PROBLEMS"
+    fi
+fi
+
 # =================================
 # 7. 检查任务脚本文件存在性
 # =================================
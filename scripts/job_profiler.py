@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定时任务性能分析
+
+在项目 setup.sh 中设置 PROFILE 后，job_runner.py / job_scheduler.py 执行任务时自动采集，不需要修改任务代码：
+    cpu     cProfile（所有线程），保存 .pstats 和按累计耗时排序的 .txt
+    mem     tracemalloc，保存快照 .snapshot 和按分配位置排序的 .txt（含峰值）
+    sample  每 PROFILE_SAMPLE_INTERVAL 秒读取任务进程组的 /proc，保存 CPU、RSS、IO 的 .csv
+cpu/mem 只适用于 "cd <目录> && python3 <脚本>" 形式的命令，其他命令改用 sample。
+结果保存在 logs/projects/<项目>/profile-<时间>-<PID>.<模式>.*，超过 PROFILE_RETENTION_DAYS 天的自动删除。
+
+离线分析示例:
+    python3 -m pstats logs/projects/task1/profile-20250901-080000-123.cpu.pstats
+
+用法（job_runner.py 改写后的命令）:
+    python3 job_profiler.py run <项目名> <cpu|mem> <脚本> [参数...]
+"""
+import contextlib
+import cProfile
+import csv
+import glob
+import io
+import logging
+import os
+import pstats
+import runpy
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+LOGS_DIR = os.environ.get('LOGS_DIR', '/app/logs')
+PROJECTS_LOG_DIR = os.path.join(LOGS_DIR, 'projects')
+
+PROFILE_MODES = ('cpu', 'mem', 'sample')
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 1))
+PROFILE_RETENTION_DAYS = int(os.environ.get('PROFILE_RETENTION_DAYS', 14))
+# 文本报告中保留的条目数
+PROFILE_REPORT_LIMIT = 50
+# tracemalloc 记录的调用栈深度
+PROFILE_TRACEBACK_LIMIT = 10
+
+JOB_PROFILER_SCRIPT = os.path.abspath(__file__)
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# 作为脚本执行时 __name__ 为 '__main__'，与 runpy 执行的任务脚本相同，使用固定名称
+logger = logging.getLogger('job_profiler')
+
+
+def artifact_prefix(name, mode):
+    """
+    :return: 本次分析结果的路径前缀 logs/projects/<项目>/profile-<时间>-<PID>.<模式>
+    """
+    directory = os.path.join(PROJECTS_LOG_DIR, name)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.{mode}")
+
+
+def remove_expired_artifacts(name):
+    deadline = time.time() - PROFILE_RETENTION_DAYS * 86400
+    for path in glob.glob(os.path.join(PROJECTS_LOG_DIR, name, 'profile-*')):
+        try:
+            if os.path.getmtime(path) < deadline:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def read_process_group(pgid, exclude_pid=None):
+    """
+    读取进程组内所有进程的 /proc 信息
+
+    :return: (进程数, 线程数, CPU 秒数, RSS 字节数, 读取字节数, 写入字节数)
+    """
+    processes = threads = ticks = rss_pages = read_bytes = write_bytes = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) == exclude_pid:
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                # 进程名可能包含空格，从最后一个 ')' 之后按字段解析
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            processes += 1
+            ticks += int(fields[11]) + int(fields[12])
+            threads += int(fields[17])
+            rss_pages += int(fields[21])
+            with open(f'/proc/{entry}/io', 'r') as f:
+                counters = dict(line.split(': ') for line in f.read().splitlines())
+            read_bytes += int(counters.get('read_bytes', 0))
+            write_bytes += int(counters.get('write_bytes', 0))
+        except (OSError, IndexError, ValueError):
+            # 进程已退出或没有权限读取 io
+            continue
+    return processes, threads, ticks / CLOCK_TICKS, rss_pages * PAGE_SIZE, read_bytes, write_bytes
+
+
+class ProcessSampler(threading.Thread):
+    """
+    按固定间隔采样进程组的 CPU、RSS 和 IO，结果写入 CSV
+    """
+
+    def __init__(self, path, pgid, exclude_pid=None, interval=PROFILE_SAMPLE_INTERVAL):
+        super().__init__(name='job-profiler-sampler', daemon=True)
+        self.path = path
+        self.pgid = pgid
+        self.exclude_pid = exclude_pid
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['timestamp', 'processes', 'threads', 'cpu_percent', 'cpu_seconds', 'rss_mb',
+                             'read_mb', 'write_mb'])
+            last_time, last_cpu = time.time(), None
+            while True:
+                processes, threads, cpu, rss, read_bytes, write_bytes = read_process_group(self.pgid, self.exclude_pid)
+                now = time.time()
+                cpu_percent = '' if last_cpu is None else round((cpu - last_cpu) * 100 / max(now - last_time, 1e-6), 1)
+                writer.writerow([datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'), processes, threads,
+                                 cpu_percent, round(cpu, 2), round(rss / 1048576, 1), round(read_bytes / 1048576, 1),
+                                 round(write_bytes / 1048576, 1)])
+                f.flush()
+                last_time, last_cpu = now, cpu
+                if self.stopped.wait(self.interval):
+                    return
+
+    def stop(self):
+        self.stopped.set()
+        self.join(timeout=self.interval + 5)
+
+
+def start_cpu_profile():
+    """
+    :return: [cProfile.Profile, ...]，Python 3.12 起一个 Profile 即覆盖所有线程，之前的版本为每个新线程单独创建
+    """
+    profiles = [cProfile.Profile()]
+    if sys.version_info < (3, 12):
+        def profile_thread(*args):
+            sys.setprofile(None)
+            profile = cProfile.Profile()
+            profiles.append(profile)
+            profile.enable()
+        threading.setprofile(profile_thread)
+    profiles[0].enable()
+    return profiles
+
+
+def save_cpu_profile(profiles, prefix):
+    profiles[0].disable()
+    threading.setprofile(None)
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    stats.dump_stats(prefix + '.pstats')
+    report = io.StringIO()
+    pstats.Stats(prefix + '.pstats', stream=report).sort_stats('cumulative').print_stats(PROFILE_REPORT_LIMIT)
+    with open(prefix + '.txt', 'w', encoding='utf-8') as f:
+        f.write(report.getvalue())
+
+
+def save_memory_profile(prefix):
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    snapshot.dump(prefix + '.snapshot')
+    with open(prefix + '.txt', 'w', encoding='utf-8') as f:
+        f.write(f"当前分配 {current / 1048576:.1f} MB，峰值 {peak / 1048576:.1f} MB\n\n")
+        f.write(f"按分配位置排序（前 {PROFILE_REPORT_LIMIT} 项）:\n")
+        for stat in snapshot.statistics('lineno')[:PROFILE_REPORT_LIMIT]:
+            f.write(f"{stat}\n")
+        f.write(f"\n最大的分配调用栈（前 10 项）:\n")
+        for stat in snapshot.statistics('traceback')[:10]:
+            f.write(f"\n{stat.size / 1048576:.1f} MB, {stat.count} 个对象\n")
+            for line in stat.traceback.format():
+                f.write(f"{line}\n")
+
+
+@contextlib.contextmanager
+def profile_job(name, mode, exclude_pid=None):
+    """
+    在 with 块执行期间按 mode 采集，结束后（包括异常和 sys.exit）保存结果
+
+    :param mode: cpu / mem / sample，为空时不采集
+    :param exclude_pid: sample 模式下不统计的进程（如 job_runner.py 自身）
+    """
+    if not mode:
+        yield
+        return
+    prefix = artifact_prefix(name, mode)
+    remove_expired_artifacts(name)
+    if mode == 'cpu':
+        profiles = start_cpu_profile()
+    elif mode == 'mem':
+        tracemalloc.start(PROFILE_TRACEBACK_LIMIT)
+    else:
+        sampler = ProcessSampler(prefix + '.csv', os.getpgid(0), exclude_pid)
+        sampler.start()
+    try:
+        yield
+    finally:
+        try:
+            if mode == 'cpu':
+                save_cpu_profile(profiles, prefix)
+            elif mode == 'mem':
+                save_memory_profile(prefix)
+            else:
+                sampler.stop()
+            logger.info(f"任务 {name} 的 {mode} 分析结果已保存: {prefix}.*")
+        except Exception as e:
+            logger.error(f"保存任务 {name} 的 {mode} 分析结果失败: {str(e)}")
+
+
+def run_script(name, mode, script, args):
+    """
+    与 python3 <script> <args> 相同的方式执行脚本，同时按 mode 采集
+    """
+    script_path = os.path.abspath(script)
+    sys.argv = [script_path] + list(args)
+    sys.path.insert(0, os.path.dirname(script_path))
+    with profile_job(name, mode):
+        runpy.run_path(script_path, run_name='__main__')
+
+
+def main():
+    # 任务脚本在本进程中执行，不能配置 root logger，否则任务自己的 logging.basicConfig 不生效
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if len(sys.argv) < 5 or sys.argv[1] != 'run' or sys.argv[3] not in ('cpu', 'mem'):
+        print(f"用法: {sys.argv[0]} run <项目名> <cpu|mem> <脚本> [参数...]")
+        sys.exit(2)
+    run_script(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定时任务执行包装：防止重叠执行并限制资源
+
+每个任务持有 logs/system/locks/<项目>.lock 的文件锁，上一次执行未结束时按 setup.sh 中的 OVERLAP_POLICY 处理：
+    skip      跳过本次执行（默认）
+    queue     等待上一次结束后执行（最多排队一次，已有排队时跳过）
+    kill-old  结束上一次执行（整个进程组，先 SIGTERM，超时后 SIGKILL）后执行
+
+JOB_HEAVY="true" 的任务需要先取得全局的重任务名额（最多 MAX_HEAVY_JOBS 个同时执行），否则等待；
+JOB_MEMORY_LIMIT_MB / JOB_CPU_LIMIT_SECONDS / JOB_NICE 通过 setrlimit/nice 限制任务的内存、CPU 时间和优先级。
+锁通过文件锁实现，cron 和 job_scheduler.py 触发的执行互相可见，进程退出后自动释放。
+每次执行的开始/结束时间、退出码、耗时和峰值内存写入 run_history.py 的执行记录。
+setup.sh 中设置 PROFILE=cpu|mem|sample 时由 job_profiler.py 采集性能数据。
+
+用法（simple_register.sh 生成的 crontab 条目）:
+    python3 job_runner.py <项目名> [--overlap skip|queue|kill-old] [--heavy] [--memory-mb N] [--cpu-seconds N]
+                          [--nice N] [--profile cpu|mem|sample] [--source cron|scheduler|manual] -- <命令>
+"""
+import argparse
+import fcntl
+import logging
+import os
+import re
+import resource
+import shlex
+import signal
+import subprocess
+import sys
+import time
+
+import job_profiler
+import run_history
+
+LOGS_DIR = os.environ.get('LOGS_DIR', '/app/logs')
+JOB_LOCK_DIR = os.path.join(LOGS_DIR, 'system', 'locks')
+
+OVERLAP_POLICIES = ('skip', 'queue', 'kill-old')
+MAX_HEAVY_JOBS = int(os.environ.get('MAX_HEAVY_JOBS', 2))
+# kill-old 策略等待旧进程退出的时间（秒），超时后 SIGKILL
+KILL_OLD_TIMEOUT = float(os.environ.get('KILL_OLD_TIMEOUT', 30))
+# 等待重任务名额时的检查间隔（秒）
+HEAVY_SLOT_POLL_INTERVAL = 1
+
+# 可以在 Python 进程内执行的命令：cd <目录> && python3 <脚本.py> [参数]
+PYTHON_COMMAND_PATTERN = re.compile(r'^\s*cd\s+(\S+)\s*&&\s*(?:exec\s+)?python3?\s+([\w./-]+\.py)((?:\s+[^;&|<>`$]+)?)\s*$')
+
+# 任务因重叠被跳过时的退出码（EX_TEMPFAIL），调度器据此区分跳过和失败
+SKIPPED_EXIT_CODE = 75
+
+JOB_RUNNER_SCRIPT = os.path.abspath(__file__)
+
+logger = logging.getLogger(__name__)
+
+
+class JobOptions:
+    def __init__(self, name, overlap_policy='skip', heavy=False, memory_limit_mb=None, cpu_limit_seconds=None,
+                 nice=None, profile=None):
+        if overlap_policy not in OVERLAP_POLICIES:
+            raise ValueError(f"未知的 OVERLAP_POLICY: {overlap_policy}，可选 {', '.join(OVERLAP_POLICIES)}")
+        if profile and profile not in job_profiler.PROFILE_MODES:
+            raise ValueError(f"未知的 PROFILE: {profile}，可选 {', '.join(job_profiler.PROFILE_MODES)}")
+        self.name = name
+        self.overlap_policy = overlap_policy
+        self.heavy = heavy
+        self.memory_limit_mb = memory_limit_mb
+        self.cpu_limit_seconds = cpu_limit_seconds
+        self.nice = nice
+        self.profile = profile or None
+
+    @classmethod
+    def from_config(cls, name, config):
+        """
+        :param config: setup.sh 中的变量 {变量名: 值}，空字符串表示未设置
+        """
+        def to_int(key):
+            return int(config[key]) if config.get(key) else None
+
+        return cls(name, config.get('OVERLAP_POLICY') or 'skip',
+                   (config.get('JOB_HEAVY') or '').lower() in ('true', '1', 'yes'),
+                   to_int('JOB_MEMORY_LIMIT_MB'), to_int('JOB_CPU_LIMIT_SECONDS'), to_int('JOB_NICE'),
+                   config.get('PROFILE'))
+
+    def to_args(self):
+        args = [self.name, '--overlap', self.overlap_policy]
+        if self.heavy:
+            args.append('--heavy')
+        if self.memory_limit_mb:
+            args += ['--memory-mb', str(self.memory_limit_mb)]
+        if self.cpu_limit_seconds:
+            args += ['--cpu-seconds', str(self.cpu_limit_seconds)]
+        if self.nice is not None:
+            args += ['--nice', str(self.nice)]
+        if self.profile:
+            args += ['--profile', self.profile]
+        return args
+
+
+def parse_python_command(command):
+    """
+    :return: (工作目录, 脚本, [参数])，不是 "cd <目录> && python3 <脚本.py>" 形式时返回 None
+    """
+    match = PYTHON_COMMAND_PATTERN.match(command)
+    if not match:
+        return None
+    return match.group(1), match.group(2), shlex.split(match.group(3) or '')
+
+
+def profiled_command(options, command):
+    """
+    cpu/mem 分析需要在任务的 Python 进程内进行：把 Python 命令改为经 job_profiler.py 执行，其他命令改用 sample
+
+    :return: (要执行的命令, 由本进程负责的 sample 分析模式或 None)
+    """
+    if options.profile not in ('cpu', 'mem'):
+        return command, options.profile
+    parsed = parse_python_command(command)
+    if parsed is None:
+        logger.warning(f"任务 {options.name} 的命令不是 Python 脚本，PROFILE={options.profile} 改为 sample")
+        return command, 'sample'
+    work_dir, script, args = parsed
+    return (f"cd {shlex.quote(work_dir)} && "
+            + ' '.join(['python3', shlex.quote(job_profiler.JOB_PROFILER_SCRIPT), 'run', shlex.quote(options.name),
+                        options.profile, shlex.quote(script)] + [shlex.quote(arg) for arg in args]), None)
+
+
+def runner_command(options, command, source='cron'):
+    """
+    :param source: 写入执行记录的触发来源
+    :return: 经 job_runner.py 执行 command 的 shell 命令
+    """
+    return ' '.join(['python3', shlex.quote(JOB_RUNNER_SCRIPT)] + [shlex.quote(arg) for arg in options.to_args()]
+                    + ['--source', source, '--', shlex.quote(command)])
+
+
+def open_lock(file_name):
+    os.makedirs(JOB_LOCK_DIR, exist_ok=True)
+    return os.open(os.path.join(JOB_LOCK_DIR, file_name), os.O_RDWR | os.O_CREAT, 0o666)
+
+
+def try_lock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def read_holder(fd):
+    os.lseek(fd, 0, os.SEEK_SET)
+    try:
+        return int(os.read(fd, 32).decode().strip() or 0) or None
+    except ValueError:
+        return None
+
+
+def kill_holder(fd, name):
+    """
+    结束持有任务锁的上一次执行（任务以独立进程组运行，进程组号即锁文件中记录的 PID）
+    """
+    holder = read_holder(fd)
+    if holder is None:
+        logger.warning(f"任务 {name} 的锁文件中没有 PID，等待上一次执行结束")
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    logger.warning(f"任务 {name} 上一次执行 (PID: {holder}) 未结束，按 kill-old 策略结束")
+    for signum, timeout in ((signal.SIGTERM, KILL_OLD_TIMEOUT), (signal.SIGKILL, 10)):
+        try:
+            os.killpg(holder, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if try_lock(fd):
+                return
+            time.sleep(0.2)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def acquire_job_lock(options):
+    """
+    按重叠策略取得任务锁
+
+    :return: 锁的文件描述符，需要跳过本次执行时返回 None
+    """
+    fd = open_lock(f'{options.name}.lock')
+    if not try_lock(fd):
+        if options.overlap_policy == 'skip':
+            logger.warning(f"任务 {options.name} 上一次执行 (PID: {read_holder(fd)}) 未结束，跳过本次执行")
+            os.close(fd)
+            return None
+        if options.overlap_policy == 'queue':
+            queue_fd = open_lock(f'{options.name}.queue')
+            if not try_lock(queue_fd):
+                logger.warning(f"任务 {options.name} 已有一次执行在排队，跳过本次执行")
+                os.close(queue_fd)
+                os.close(fd)
+                return None
+            logger.info(f"任务 {options.name} 上一次执行未结束，排队等待")
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            os.close(queue_fd)
+        else:
+            kill_holder(fd, options.name)
+
+    os.ftruncate(fd, 0)
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.write(fd, f'{os.getpid()}\n'.encode())
+    return fd
+
+
+def acquire_heavy_slot(options):
+    """
+    取得一个重任务名额（MAX_HEAVY_JOBS 个槽位文件锁之一），没有空闲名额时等待
+    """
+    slots = [open_lock(f'heavy-slot-{number}.lock') for number in range(MAX_HEAVY_JOBS)]
+    waited = False
+    while True:
+        for number, fd in enumerate(slots):
+            if try_lock(fd):
+                for other in slots:
+                    if other != fd:
+                        os.close(other)
+                if waited:
+                    logger.info(f"任务 {options.name} 取得重任务名额 {number}")
+                return fd
+        if not waited:
+            logger.info(f"重任务名额已满 ({MAX_HEAVY_JOBS} 个)，任务 {options.name} 等待")
+            waited = True
+        time.sleep(HEAVY_SLOT_POLL_INTERVAL)
+
+
+def apply_limits(options):
+    if options.memory_limit_mb:
+        limit = options.memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if options.cpu_limit_seconds:
+        # 软限制到达时收到 SIGXCPU，留 10 秒后硬限制 SIGKILL
+        resource.setrlimit(resource.RLIMIT_CPU, (options.cpu_limit_seconds, options.cpu_limit_seconds + 10))
+    if options.nice:
+        os.nice(options.nice)
+
+
+def prepare_job(options):
+    """
+    在任务进程中执行：成为独立进程组、取得任务锁和重任务名额、设置资源限制
+
+    :return: 取得的锁（需要在任务结束前保持打开），需要跳过本次执行时返回 None
+    """
+    if os.getpid() != os.getpgid(0):
+        os.setsid()
+    job_lock = acquire_job_lock(options)
+    if job_lock is None:
+        return None
+    locks = [job_lock]
+    if options.heavy:
+        locks.append(acquire_heavy_slot(options))
+    apply_limits(options)
+    return locks
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+    parser = argparse.ArgumentParser(description='定时任务执行包装：防止重叠执行并限制资源')
+    parser.add_argument('name', help='项目名称')
+    parser.add_argument('--overlap', default='skip', choices=OVERLAP_POLICIES, help='重叠执行策略')
+    parser.add_argument('--heavy', action='store_true', help='占用一个重任务名额')
+    parser.add_argument('--memory-mb', type=int, help='内存（地址空间）上限 MB')
+    parser.add_argument('--cpu-seconds', type=int, help='CPU 时间上限（秒）')
+    parser.add_argument('--nice', type=int, help='nice 值')
+    parser.add_argument('--profile', choices=job_profiler.PROFILE_MODES, help='性能分析模式')
+    parser.add_argument('--source', default='cron', help='触发来源，写入执行记录')
+    argv = sys.argv[1:]
+    if '--' not in argv or argv.index('--') == len(argv) - 1:
+        parser.error('缺少要执行的命令（写在 -- 之后）')
+    split = argv.index('--')
+    args = parser.parse_args(argv[:split])
+    command = argv[split + 1:]
+
+    options = JobOptions(args.name, args.overlap, args.heavy, args.memory_mb, args.cpu_seconds, args.nice,
+                         args.profile)
+    locks = prepare_job(options)
+    if locks is None:
+        sys.exit(SKIPPED_EXIT_CODE)
+    sys.stdout.flush()
+
+    # kill-old 对整个进程组发送的信号由任务进程处理，本进程等任务退出后记录结果（处理函数在 exec 后自动恢复默认）
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, lambda signum, frame: None)
+    command, sample_mode = profiled_command(options, ' '.join(command))
+    started = time.time()
+    with job_profiler.profile_job(options.name, sample_mode, exclude_pid=os.getpid()):
+        # 任务进程同样持有锁，本进程被单独结束时锁仍在任务结束后才释放
+        process = subprocess.Popen(['bash', '-c', command], pass_fds=locks)
+        _, status, usage = os.wait4(process.pid, 0)
+    exit_code = process.returncode = os.waitstatus_to_exitcode(status)
+    run_history.record_run(options.name, 'job', started, time.time(), exit_code, usage.ru_maxrss, os.getpid(),
+                           args.source)
+    sys.exit(exit_code if exit_code >= 0 else 128 - exit_code)
+
+
+if __name__ == "__main__":
+    main()
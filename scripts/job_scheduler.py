@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定时任务调度守护进程
+
+读取各项目 setup.sh 中的 CRON_SCHEDULE/CRON_COMMAND（与 simple_register.sh 相同的约定）按时触发任务。
+形如 "cd /app/<项目> && python3 main.py" 的 Python 任务由 forkserver 派生执行，pyodbc、clickhouse_driver、
+requests 等模块只在 forkserver 中导入一次，每次触发只需 fork，不再重新启动解释器；其他命令用 bash 执行。
+
+crontab 中的任务仍然保留作为备用：simple_register.sh 生成的 crontab 行会先检查本进程的 PID 文件，
+调度器运行时跳过执行，调度器停止后 cron 自动接管。
+
+用法:
+    python3 job_scheduler.py daemon          启动调度守护进程
+    python3 job_scheduler.py list            显示任务和下次执行时间
+    python3 job_scheduler.py run <项目名>     立即执行一次（调度器运行时由调度器派生执行）
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import runpy
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import job_profiler
+import job_runner
+import log_store
+import run_history
+
+PROJECTS_DIR = os.environ.get('PROJECTS_DIR', '/app')
+LOGS_DIR = os.environ.get('LOGS_DIR', '/app/logs')
+SYSTEM_LOG_DIR = os.path.join(LOGS_DIR, 'system')
+PROJECTS_LOG_DIR = os.path.join(LOGS_DIR, 'projects')
+SCHEDULER_PID_FILE = os.environ.get('SCHEDULER_PID_FILE', os.path.join(SYSTEM_LOG_DIR, 'job_scheduler.pid'))
+SCHEDULER_TRIGGER_DIR = os.path.join(SYSTEM_LOG_DIR, 'scheduler_triggers')
+# 任务最近一次执行情况，供 status_server.py 等读取
+SCHEDULER_STATE_FILE = os.path.join(SYSTEM_LOG_DIR, 'job_scheduler.json')
+
+# 与 scan_and_add.sh 一致，跳过的系统目录
+SKIPPED_DIRS = ('logs', 'scripts', 'data', 'backup')
+
+# forkserver 中预先导入的模块，未安装的模块会被忽略
+SCHEDULER_PRELOAD = [name for name in os.environ.get(
+    'SCHEDULER_PRELOAD', 'pyodbc,clickhouse_driver,requests,decimal,json,sqlite3,logging').split(',') if name]
+
+# 重新读取 setup.sh 的间隔（秒），新增或修改的项目不需要重启调度器
+SCHEDULER_RESCAN_INTERVAL = int(os.environ.get('SCHEDULER_RESCAN_INTERVAL', 60))
+
+# read_project_config 读取的 setup.sh 变量及默认值
+PROJECT_CONFIG_KEYS = (
+    ('PROJECT_NAME', ''), ('PROJECT_TYPE', 'cron'), ('CRON_SCHEDULE', ''), ('CRON_COMMAND', ''),
+    ('OVERLAP_POLICY', 'skip'), ('JOB_HEAVY', 'false'), ('JOB_MEMORY_LIMIT_MB', ''), ('JOB_CPU_LIMIT_SECONDS', ''),
+    ('JOB_NICE', ''), ('PROFILE', ''),
+)
+
+CRON_FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+CRON_NAMES = {
+    3: {name: index + 1 for index, name in enumerate(
+        ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'])},
+    4: {name: index for index, name in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])},
+}
+CRON_MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cron_field(field, index):
+    low, high = CRON_FIELD_RANGES[index]
+    names = CRON_NAMES.get(index, {})
+
+    def parse_value(text):
+        text = text.lower()
+        return names[text] if text in names else int(text)
+
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (parse_value(value) for value in part.split('-', 1))
+        else:
+            start = parse_value(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"cron 字段超出范围: {field}")
+        values.update(range(start, end + 1, step))
+
+    # 星期字段中 7 和 0 都表示周日
+    if index == 4 and 7 in values:
+        values.discard(7)
+        values.add(0)
+    return values
+
+
+class CronSchedule:
+    """
+    标准5字段 cron 表达式，日期和星期都有限定时满足其一即可（与 cron 一致）
+    """
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        fields = CRON_MACROS.get(self.expression, self.expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron 表达式需要5个字段: {expression}")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            parse_cron_field(field, index) for index, field in enumerate(fields)
+        )
+        self.day_restricted = not fields[2].startswith('*')
+        self.weekday_restricted = not fields[4].startswith('*')
+
+    def matches_day(self, moment):
+        day_match = moment.day in self.days
+        # Python 周一为0，cron 周日为0
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def matches(self, moment):
+        return (moment.minute in self.minutes and moment.hour in self.hours
+                and moment.month in self.months and self.matches_day(moment))
+
+    def next_run(self, after):
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 4)
+        while moment < limit:
+            if moment.month not in self.months or not self.matches_day(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        return None
+
+
+class ScheduledJob:
+    def __init__(self, name, project_dir, schedule, command, setup_mtime, options=None):
+        self.name = name
+        self.project_dir = project_dir
+        self.schedule = schedule
+        self.command = command
+        self.setup_mtime = setup_mtime
+        self.options = options or job_runner.JobOptions(name)
+
+        # 能识别为 Python 脚本的命令走 forkserver，其余用 bash 执行
+        self.work_dir, self.script, self.args = job_runner.parse_python_command(command) or (None, None, [])
+
+    @property
+    def is_python(self):
+        return self.script is not None
+
+
+def read_project_config(project_dir):
+    """
+    与 simple_register.sh 相同：在子 shell 中 source setup.sh 后读取变量
+    """
+    script = ('cd "$1" && source ./setup.sh >/dev/null 2>&1; printf "%s\\0"'
+              + ''.join(f' "${{{key}:-{default}}}"' for key, default in PROJECT_CONFIG_KEYS))
+    result = subprocess.run(['bash', '-c', script, 'bash', project_dir], capture_output=True, text=True, timeout=30)
+    values = result.stdout.split('\0')
+    if result.returncode != 0 or len(values) < len(PROJECT_CONFIG_KEYS):
+        raise ValueError(f"读取 setup.sh 失败: {result.stderr.strip()}")
+    config = {key: value for (key, _), value in zip(PROJECT_CONFIG_KEYS, values)}
+    config['PROJECT_NAME'] = config['PROJECT_NAME'] or os.path.basename(project_dir)
+    return config
+
+
+def discover_projects(projects_dir=PROJECTS_DIR):
+    """
+    :return: [(项目目录名, 项目目录, setup.sh路径), ...]
+    """
+    projects = []
+    for name in sorted(os.listdir(projects_dir)):
+        project_dir = os.path.join(projects_dir, name)
+        setup_file = os.path.join(project_dir, 'setup.sh')
+        if name in SKIPPED_DIRS or not os.path.isfile(setup_file):
+            continue
+        projects.append((name, project_dir, setup_file))
+    return projects
+
+
+def run_python_job(work_dir, script, args, name, options):
+    """
+    在 forkserver 派生的子进程中执行项目脚本，等同于
+    job_runner.py <name> ... -- cd <work_dir> && python3 <script> 2>&1 | log_store.py write <name>
+    """
+    import atexit
+
+    # 输出经管道交给 fork 出的日志写入进程（log_store 已在 forkserver 中导入），任务退出后写入进程读到 EOF 自行退出
+    read_fd, write_fd = os.pipe()
+    if os.fork() == 0:
+        os.close(write_fd)
+        try:
+            log_store.LogWriter(name).consume(read_fd)
+        finally:
+            os._exit(0)
+    os.close(read_fd)
+    os.dup2(write_fd, 1)
+    os.dup2(write_fd, 2)
+    os.close(write_fd)
+    sys.stdout = open(1, 'w', buffering=1, encoding='utf-8', closefd=False)
+    sys.stderr = open(2, 'w', buffering=1, encoding='utf-8', closefd=False)
+
+    # 任务锁、重任务名额和资源限制只作用于任务进程，日志写入进程已在此之前 fork
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+    locks = job_runner.prepare_job(options)
+    if locks is None:
+        sys.stdout.flush()
+        sys.exit(job_runner.SKIPPED_EXIT_CODE)
+    # 与 python3 <script> 一样从未配置的 root logger 开始，任务自己的 logging.basicConfig 才会生效
+    logging.root.handlers.clear()
+    logging.root.setLevel(logging.WARNING)
+
+    os.chdir(work_dir)
+    script_path = os.path.abspath(script)
+    sys.argv = [script_path] + list(args)
+    sys.path.insert(0, os.path.dirname(script_path))
+    started = time.time()
+    exit_code = 1
+    try:
+        with job_profiler.profile_job(name, options.profile):
+            runpy.run_path(script_path, run_name='__main__')
+        exit_code = 0
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        raise
+    finally:
+        # multiprocessing 子进程以 os._exit 退出，需要手动执行脚本注册的 atexit（如 logging 刷新）
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        run_history.record_run(name, 'job', started, time.time(), exit_code, run_history.peak_rss_kb(), os.getpid(),
+                               'scheduler')
+
+
+class JobScheduler:
+    def __init__(self, projects_dir=PROJECTS_DIR, preload=None):
+        self.projects_dir = projects_dir
+        self.jobs = {}
+        self.running = {}
+        self.history = {}
+        self.stopping = False
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(SCHEDULER_PRELOAD if preload is None else preload)
+
+    def load_jobs(self):
+        """
+        重新扫描项目目录，只重新读取有变化的 setup.sh
+        """
+        jobs = {}
+        for name, project_dir, setup_file in discover_projects(self.projects_dir):
+            mtime = os.path.getmtime(setup_file)
+            existing = self.jobs.get(name)
+            if existing and existing.setup_mtime == mtime:
+                jobs[name] = existing
+                continue
+            try:
+                config = read_project_config(project_dir)
+                if config['PROJECT_TYPE'] != 'cron' or not config['CRON_SCHEDULE'] or not config['CRON_COMMAND']:
+                    continue
+                jobs[name] = ScheduledJob(name, project_dir, CronSchedule(config['CRON_SCHEDULE']),
+                                          config['CRON_COMMAND'], mtime, job_runner.JobOptions.from_config(name, config))
+                logger.info(f"加载任务 {name}: {config['CRON_SCHEDULE']} {config['CRON_COMMAND']} "
+                             f"({'forkserver' if jobs[name].is_python else 'bash'}, "
+                             f"重叠策略 {jobs[name].options.overlap_policy}{', 重任务' if jobs[name].options.heavy else ''})")
+            except Exception as e:
+                logger.error(f"项目 {name} 的配置无效，跳过: {str(e)}")
+                if existing:
+                    jobs[name] = existing
+
+        for name in set(self.jobs) - set(jobs):
+            logger.info(f"任务 {name} 已移除")
+        self.jobs = jobs
+        self.write_state()
+
+    def fire(self, job, reason='定时'):
+        if self.running.get(job.name) and job.options.overlap_policy == 'skip':
+            # 其他策略（以及与 cron 触发的执行之间）由任务进程中 job_runner 的文件锁处理
+            logger.warning(f"任务 {job.name} 上次执行尚未结束，跳过本次{reason}触发")
+            history = self.history.setdefault(job.name, {'runs': 0, 'failures': 0})
+            history['skipped'] = history.get('skipped', 0) + 1
+            self.write_state()
+            return
+        os.makedirs(PROJECTS_LOG_DIR, exist_ok=True)
+
+        process = None
+        if job.is_python:
+            try:
+                process = self.context.Process(target=run_python_job, name=f'job-{job.name}',
+                                               args=(job.work_dir, job.script, job.args, job.name, job.options))
+                process.start()
+            except Exception as e:
+                logger.error(f"forkserver 启动任务 {job.name} 失败，改用 bash 执行: {str(e)}")
+                process = None
+        if process is None:
+            command = job_runner.runner_command(job.options, job.command, 'scheduler')
+            process = subprocess.Popen(['bash', '-c', log_store.pipeline_command(command, job.name)],
+                                       start_new_session=True)
+
+        self.running.setdefault(job.name, []).append((process, time.time()))
+        self.history.setdefault(job.name, {'runs': 0, 'failures': 0})['last_started'] = time.time()
+        logger.info(f"{reason}触发任务 {job.name} (PID: {process.pid})")
+        self.write_state()
+
+    def reap(self):
+        finished = False
+        for name, processes in list(self.running.items()):
+            still_running = []
+            for process, started in processes:
+                exit_code = process.exitcode if hasattr(process, 'exitcode') else process.poll()
+                if exit_code is None:
+                    still_running.append((process, started))
+                    continue
+                pid = process.pid
+                if hasattr(process, 'close'):
+                    process.close()
+                history = self.history.setdefault(name, {'runs': 0, 'failures': 0})
+                finished = True
+                if exit_code == job_runner.SKIPPED_EXIT_CODE:
+                    logger.warning(f"任务 {name} (PID: {pid}) 因上一次执行未结束而跳过")
+                    history['skipped'] = history.get('skipped', 0) + 1
+                    continue
+                log = logger.info if exit_code == 0 else logger.error
+                log(f"任务 {name} 结束 (PID: {pid})，退出码 {exit_code}，耗时 {time.time() - started:.1f} 秒")
+                history.update(last_finished=time.time(), last_exit_code=exit_code,
+                               last_seconds=round(time.time() - started, 3))
+                history['runs'] += 1
+                history['failures'] += exit_code != 0
+                finished = True
+            if still_running:
+                self.running[name] = still_running
+            else:
+                del self.running[name]
+        if finished:
+            self.write_state()
+
+    def write_state(self):
+        now = datetime.now()
+        jobs = {}
+        for name, job in self.jobs.items():
+            next_run = job.schedule.next_run(now)
+            jobs[name] = dict(self.history.get(name, {}), schedule=job.schedule.expression, command=job.command,
+                              mode='forkserver' if job.is_python else 'bash', running=len(self.running.get(name, [])),
+                              next_run=next_run.timestamp() if next_run else None)
+        state = {'pid': os.getpid(), 'updated_at': time.time(), 'jobs': jobs}
+        tmp_file = SCHEDULER_STATE_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, SCHEDULER_STATE_FILE)
+
+    def process_triggers(self):
+        """
+        处理 run 命令写入的手动触发文件
+        """
+        if not os.path.isdir(SCHEDULER_TRIGGER_DIR):
+            return
+        for name in os.listdir(SCHEDULER_TRIGGER_DIR):
+            os.remove(os.path.join(SCHEDULER_TRIGGER_DIR, name))
+            job = self.jobs.get(name)
+            if job:
+                self.fire(job, '手动')
+            else:
+                logger.warning(f"手动触发的任务 {name} 不存在")
+
+    def stop(self, signum=None, frame=None):
+        logger.info("收到停止信号，停止调度（正在执行的任务不受影响）")
+        self.stopping = True
+
+    def run_forever(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        os.makedirs(SCHEDULER_TRIGGER_DIR, exist_ok=True)
+
+        self.load_jobs()
+        # 提前启动 forkserver 并完成预导入，第一次触发不需要等待
+        if any(job.is_python for job in self.jobs.values()):
+            warmup = self.context.Process(target=time.sleep, args=(0,))
+            warmup.start()
+            warmup.join()
+        write_pid_file()
+        logger.info(f"调度器已启动 (PID: {os.getpid()})，共 {len(self.jobs)} 个任务，预导入模块: "
+                     f"{', '.join(SCHEDULER_PRELOAD)}")
+
+        last_minute = datetime.now().replace(second=0, microsecond=0)
+        last_scan = time.time()
+        try:
+            while not self.stopping:
+                time.sleep(1)
+                self.reap()
+                self.process_triggers()
+
+                if time.time() - last_scan >= SCHEDULER_RESCAN_INTERVAL:
+                    self.load_jobs()
+                    last_scan = time.time()
+
+                # 按分钟触发；进程被挂起等原因错过的分钟（最多60分钟）依次补触发
+                current_minute = datetime.now().replace(second=0, microsecond=0)
+                if current_minute - last_minute > timedelta(minutes=60):
+                    logger.warning(f"时间跳变 {last_minute} -> {current_minute}，不补触发期间的任务")
+                    last_minute = current_minute - timedelta(minutes=1)
+                while last_minute < current_minute:
+                    last_minute += timedelta(minutes=1)
+                    for job in self.jobs.values():
+                        if job.schedule.matches(last_minute):
+                            self.fire(job)
+        finally:
+            remove_pid_file()
+            logger.info("调度器已停止，crontab 中的任务将自动接管")
+
+
+def read_scheduler_pid():
+    try:
+        with open(SCHEDULER_PID_FILE, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (FileNotFoundError, ValueError, ProcessLookupError, PermissionError):
+        return None
+
+
+def write_pid_file():
+    os.makedirs(os.path.dirname(SCHEDULER_PID_FILE), exist_ok=True)
+    with open(SCHEDULER_PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def remove_pid_file():
+    try:
+        with open(SCHEDULER_PID_FILE, 'r') as f:
+            if f.read().strip() != str(os.getpid()):
+                return
+        os.remove(SCHEDULER_PID_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def list_jobs():
+    scheduler_pid = read_scheduler_pid()
+    print(f"调度器: {'运行中 (PID: ' + str(scheduler_pid) + ')' if scheduler_pid else '未运行（由 cron 执行）'}")
+    now = datetime.now()
+    print(f"{'项目':<20}{'调度':<18}{'执行方式':<12}{'下次执行':<20}命令")
+    for name, project_dir, _ in discover_projects():
+        try:
+            config = read_project_config(project_dir)
+            if config['PROJECT_TYPE'] != 'cron' or not config['CRON_SCHEDULE'] or not config['CRON_COMMAND']:
+                continue
+            job = ScheduledJob(name, project_dir, CronSchedule(config['CRON_SCHEDULE']), config['CRON_COMMAND'], 0)
+        except Exception as e:
+            print(f"{name:<20}配置无效: {str(e)}")
+            continue
+        next_run = job.schedule.next_run(now)
+        print(f"{name:<20}{job.schedule.expression:<18}{'forkserver' if job.is_python else 'bash':<12}"
+              f"{next_run.strftime('%Y-%m-%d %H:%M') if next_run else '-':<20}{job.command}")
+
+
+def run_now(project_name):
+    """
+    调度器运行时写入触发文件由调度器派生执行，否则直接用 bash 执行
+    """
+    if read_scheduler_pid():
+        os.makedirs(SCHEDULER_TRIGGER_DIR, exist_ok=True)
+        open(os.path.join(SCHEDULER_TRIGGER_DIR, project_name), 'w').close()
+        print(f"已通知调度器执行 {project_name}，输出见 {os.path.join(PROJECTS_LOG_DIR, project_name + '.log')}")
+        return 0
+
+    project_dir = os.path.join(PROJECTS_DIR, project_name)
+    config = read_project_config(project_dir)
+    if not config['CRON_COMMAND']:
+        print(f"项目 {project_name} 没有 CRON_COMMAND")
+        return 1
+    print(f"调度器未运行，直接执行: {config['CRON_COMMAND']}")
+    options = job_runner.JobOptions.from_config(project_name, config)
+    return subprocess.call(['bash', '-c', job_runner.runner_command(options, config['CRON_COMMAND'], 'manual')])
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+    parser = argparse.ArgumentParser(description='定时任务调度守护进程')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('daemon', help='启动调度守护进程')
+    subparsers.add_parser('list', help='显示任务和下次执行时间')
+    run_parser = subparsers.add_parser('run', help='立即执行一次任务')
+    run_parser.add_argument('project', help='项目名称')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        list_jobs()
+    elif args.command == 'run':
+        sys.exit(run_now(args.project))
+    else:
+        if read_scheduler_pid():
+            logger.error(f"调度器已在运行 (PID: {read_scheduler_pid()})")
+            sys.exit(1)
+        JobScheduler().run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+项目日志存储
+
+任务和服务的输出通过管道交给本脚本写入 logs/projects/<项目>.log（当前段，仍是普通文本，tail -f 可用），
+同时在 <项目>.log.idx 中按固定字节数/时间间隔记录稀疏索引（写入时间 偏移量）。
+
+- 当前段超过 LOG_MAX_BYTES 或写入时间跨度超过 LOG_MAX_AGE 秒时轮转到 logs/projects/archive/<项目>/，
+  轮转后的段按索引块分别压缩为独立的 gzip member（整个文件仍可用 zcat 查看），索引记录压缩后的偏移量
+- 按时间查询时先按段的时间范围筛选，再在索引中二分查找起始块直接 seek，不需要解压或扫描整个文件
+- 超过 LOG_RETENTION_DAYS 天的归档段在轮转时删除
+
+用法:
+    <命令> 2>&1 | python3 log_store.py write <项目名>             写入日志
+    python3 log_store.py query <项目名> --since T1 [--until T2]   查询时间范围内的日志
+    python3 log_store.py rotate [项目名]                          轮转超时的当前段并清理过期归档
+    python3 log_store.py stats [项目名]                           显示日志段信息
+
+时间格式: "2025-09-01 08:00[:00]"、"2025-09-01" 或相对时间 "30m"、"2h"、"1d"（表示多久之前）
+"""
+import argparse
+import bisect
+import fcntl
+import gzip
+import os
+import re
+import shlex
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+LOGS_DIR = os.environ.get('LOGS_DIR', '/app/logs')
+PROJECTS_LOG_DIR = os.path.join(LOGS_DIR, 'projects')
+ARCHIVE_DIR = os.path.join(PROJECTS_LOG_DIR, 'archive')
+
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 50 * 1024 * 1024))
+LOG_MAX_AGE = int(os.environ.get('LOG_MAX_AGE', 24 * 3600))
+LOG_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', 30))
+
+# 稀疏索引间隔：每写入这么多字节或经过这么多秒记录一条索引，也是归档段中每个 gzip member 的大小
+LOG_INDEX_BYTES = int(os.environ.get('LOG_INDEX_BYTES', 256 * 1024))
+LOG_INDEX_SECONDS = int(os.environ.get('LOG_INDEX_SECONDS', 60))
+
+LOG_STORE_SCRIPT = os.path.abspath(__file__)
+
+# 行首时间戳（logging 默认格式等），查询时用于在索引块内按行过滤
+LINE_TIME_PATTERN = re.compile(rb'^\[?(\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2})')
+SEGMENT_NAME_PATTERN = re.compile(r'^(\d+)-(\d+)\.log\.gz$')
+
+
+def active_log_path(name):
+    return os.path.join(PROJECTS_LOG_DIR, f'{name}.log')
+
+
+def read_index(index_file):
+    """
+    :return: [(写入时间, 偏移量), ...]
+    """
+    entries = []
+    try:
+        with open(index_file, 'r') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2:
+                    entries.append((float(parts[0]), int(parts[1])))
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def read_index_bounds(index_file):
+    """
+    只读取索引的第一条和最后一条，写入时不需要读取整个索引
+
+    :return: (第一条, 最后一条)，索引不存在时为 (None, None)
+    """
+    try:
+        with open(index_file, 'rb') as f:
+            first = f.readline()
+            f.seek(max(0, f.seek(0, os.SEEK_END) - 128))
+            last = f.read().splitlines()[-1]
+    except (FileNotFoundError, IndexError):
+        return None, None
+    first, last = first.split(), last.split()
+    return (float(first[0]), int(first[1])), (float(last[0]), int(last[1]))
+
+
+def pipeline_command(command, name):
+    """
+    把 shell 命令的输出接入日志存储，保留命令本身的退出码
+    """
+    return (f'set -o pipefail; {{ {command}\n}} 2>&1 | '
+            f'python3 {shlex.quote(LOG_STORE_SCRIPT)} write {shlex.quote(name)}')
+
+
+class LogWriter:
+    """
+    追加写入当前段并维护稀疏索引；同一项目可能有多个写入进程（任务重叠执行），写入和轮转用文件锁串行化
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.log_file = active_log_path(name)
+        self.index_file = self.log_file + '.idx'
+        self.lock_file = self.log_file + '.lock'
+        os.makedirs(PROJECTS_LOG_DIR, exist_ok=True)
+        self.lock_fd = os.open(self.lock_file, os.O_WRONLY | os.O_CREAT, 0o666)
+
+    def write(self, data):
+        if not data:
+            return
+        now = time.time()
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            with open(self.log_file, 'ab') as log:
+                offset = log.seek(0, os.SEEK_END)
+                first, last = read_index_bounds(self.index_file)
+                if last is None and offset > 0:
+                    # 启用日志存储之前追加写入的内容，以最后修改时间作为其索引时间
+                    first = last = (os.path.getmtime(self.log_file), 0)
+                    with open(self.index_file, 'a') as f:
+                        f.write(f'{first[0]:.3f} 0\n')
+                if last is None or offset - last[1] >= LOG_INDEX_BYTES or now - last[0] >= LOG_INDEX_SECONDS:
+                    with open(self.index_file, 'a') as f:
+                        f.write(f'{now:.3f} {offset}\n')
+                    first = first or (now, offset)
+                log.write(data)
+                size = offset + len(data)
+            segment = None
+            if size >= LOG_MAX_BYTES or now - first[0] >= LOG_MAX_AGE:
+                segment = self.detach_segment()
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+        if segment:
+            compress_segment(self.name, *segment)
+
+    def detach_segment(self):
+        """
+        把当前段和索引移入归档目录（需持有锁），压缩在释放锁之后进行
+
+        :return: (未压缩段路径, 索引路径)，当前段为空时返回 None
+        """
+        if not os.path.exists(self.log_file) or os.path.getsize(self.log_file) == 0:
+            return None
+        archive_dir = os.path.join(ARCHIVE_DIR, self.name)
+        os.makedirs(archive_dir, exist_ok=True)
+        stamp = f'{time.time():.6f}.{os.getpid()}'
+        raw_file = os.path.join(archive_dir, f'.{stamp}.log')
+        raw_index = os.path.join(archive_dir, f'.{stamp}.idx')
+        os.rename(self.log_file, raw_file)
+        if os.path.exists(self.index_file):
+            os.rename(self.index_file, raw_index)
+        else:
+            with open(raw_index, 'w') as f:
+                f.write(f'{os.path.getmtime(raw_file):.3f} 0\n')
+        return raw_file, raw_index
+
+    def consume(self, fd):
+        """
+        从文件描述符读取直到 EOF，按完整行写入
+        """
+        pending = b''
+        while True:
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                break
+            pending += chunk
+            cut = pending.rfind(b'\n') + 1
+            if cut == 0 and len(pending) < LOG_INDEX_BYTES:
+                continue
+            if cut == 0:
+                cut = len(pending)
+            self.write(pending[:cut])
+            pending = pending[cut:]
+        self.write(pending)
+
+    def rotate_if_expired(self):
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+        try:
+            first, _ = read_index_bounds(self.index_file)
+            segment = None
+            if first and time.time() - first[0] >= LOG_MAX_AGE:
+                segment = self.detach_segment()
+        finally:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_UN)
+        if segment:
+            compress_segment(self.name, *segment)
+
+
+def compress_segment(name, raw_file, raw_index):
+    """
+    按索引块把轮转出的段压缩为多个 gzip member，索引改为记录压缩后的偏移量
+    """
+    index = read_index(raw_index) or [(os.path.getmtime(raw_file), 0)]
+    size = os.path.getsize(raw_file)
+    start, end = int(index[0][0]), int(max(os.path.getmtime(raw_file), index[-1][0]))
+    archive_dir = os.path.dirname(raw_file)
+    # 多个写入进程可能在同一秒内轮转，以独占创建索引文件的方式占用段名
+    while True:
+        base = os.path.join(archive_dir, f'{start}-{end}')
+        try:
+            index_fd = os.open(base + '.idx', os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            break
+        except FileExistsError:
+            end += 1
+
+    offsets = [offset for _, offset in index] + [size]
+    with open(raw_file, 'rb') as src, open(base + '.log.gz.tmp', 'wb') as dst, open(index_fd, 'w') as idx:
+        for (written_at, offset), next_offset in zip(index, offsets[1:]):
+            if next_offset <= offset:
+                continue
+            src.seek(offset)
+            idx.write(f'{written_at:.3f} {dst.tell()}\n')
+            dst.write(gzip.compress(src.read(next_offset - offset)))
+    os.rename(base + '.log.gz.tmp', base + '.log.gz')
+    os.remove(raw_file)
+    os.remove(raw_index)
+    remove_expired_segments(name)
+
+
+def list_segments(name):
+    """
+    :return: [(开始时间, 结束时间, 段路径), ...]，按开始时间排序
+    """
+    archive_dir = os.path.join(ARCHIVE_DIR, name)
+    segments = []
+    if os.path.isdir(archive_dir):
+        for file_name in os.listdir(archive_dir):
+            match = SEGMENT_NAME_PATTERN.match(file_name)
+            if match:
+                segments.append((int(match.group(1)), int(match.group(2)), os.path.join(archive_dir, file_name)))
+    return sorted(segments)
+
+
+def remove_expired_segments(name):
+    cutoff = time.time() - LOG_RETENTION_DAYS * 86400
+    for _, end, path in list_segments(name):
+        if end < cutoff:
+            os.remove(path)
+            index_file = path[:-len('.log.gz')] + '.idx'
+            if os.path.exists(index_file):
+                os.remove(index_file)
+
+
+def read_segment(path, index, since, until):
+    """
+    从索引中不晚于 since 的最后一块开始读取，直到块的写入时间晚于 until
+
+    :return: 生成 (块写入时间, 数据)
+    """
+    times = [written_at for written_at, _ in index]
+    position = max(0, bisect.bisect_right(times, since) - 1) if since is not None else 0
+    compressed = path.endswith('.gz')
+    with open(path, 'rb') as f:
+        for number in range(position, len(index)):
+            written_at, offset = index[number]
+            if until is not None and written_at > until:
+                break
+            next_offset = index[number + 1][1] if number + 1 < len(index) else None
+            f.seek(offset)
+            data = f.read(next_offset - offset) if next_offset is not None else f.read()
+            if compressed:
+                data = decompress_members(data)
+            yield written_at, data
+
+
+def decompress_members(data):
+    output = []
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        output.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+    return b''.join(output)
+
+
+def filter_lines(data, block_time, since, until):
+    """
+    行首带时间戳的行按时间戳过滤，其余行沿用前一行的时间（块开头的行使用块写入时间）
+    """
+    current = block_time
+    for line in data.splitlines(keepends=True):
+        match = LINE_TIME_PATTERN.match(line)
+        if match:
+            try:
+                current = datetime.fromisoformat(match.group(1).decode().replace('T', ' ')).timestamp()
+            except ValueError:
+                pass
+        if since is not None and current < since:
+            continue
+        if until is not None and current > until:
+            return
+        yield line
+
+
+def query(name, since=None, until=None, out=None):
+    out = out or sys.stdout.buffer
+    sources = [(path, path[:-len('.log.gz')] + '.idx') for start, end, path in list_segments(name)
+               if (since is None or end >= since) and (until is None or start <= until)]
+    log_file = active_log_path(name)
+    if os.path.exists(log_file):
+        sources.append((log_file, log_file + '.idx'))
+
+    for path, index_file in sources:
+        index = read_index(index_file) or [(os.path.getmtime(path), 0)]
+        try:
+            for block_time, data in read_segment(path, index, since, until):
+                for line in filter_lines(data, block_time, since, until):
+                    out.write(line)
+        except FileNotFoundError:
+            # 查询期间当前段被轮转，已读出的部分保留
+            continue
+    out.flush()
+
+
+def parse_time(text):
+    if text is None:
+        return None
+    match = re.fullmatch(r'(\d+)([smhd])', text.strip())
+    if match:
+        unit = {'s': 'seconds', 'm': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        return (datetime.now() - timedelta(**{unit: int(match.group(1))})).timestamp()
+    return datetime.fromisoformat(text.strip()).timestamp()
+
+
+def list_names(name=None):
+    if name:
+        return [name]
+    names = set()
+    if os.path.isdir(PROJECTS_LOG_DIR):
+        names.update(file_name[:-len('.log')] for file_name in os.listdir(PROJECTS_LOG_DIR)
+                     if file_name.endswith('.log'))
+    if os.path.isdir(ARCHIVE_DIR):
+        names.update(os.listdir(ARCHIVE_DIR))
+    return sorted(names)
+
+
+def show_stats(name=None):
+    print(f"{'项目':<16}{'段':<44}{'大小':>12}  时间范围")
+    for project in list_names(name):
+        rows = [(path, start, end) for start, end, path in list_segments(project)]
+        log_file = active_log_path(project)
+        if os.path.exists(log_file):
+            index = read_index(log_file + '.idx')
+            rows.append((log_file, index[0][0] if index else os.path.getmtime(log_file), os.path.getmtime(log_file)))
+        for path, start, end in rows:
+            print(f"{project:<16}{os.path.relpath(path, PROJECTS_LOG_DIR):<44}{os.path.getsize(path):>12}  "
+                  f"{datetime.fromtimestamp(start):%Y-%m-%d %H:%M:%S} ~ {datetime.fromtimestamp(end):%Y-%m-%d %H:%M:%S}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='项目日志存储')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    write_parser = subparsers.add_parser('write', help='从标准输入写入日志')
+    write_parser.add_argument('project', help='项目名称')
+    query_parser = subparsers.add_parser('query', help='查询时间范围内的日志')
+    query_parser.add_argument('project', help='项目名称')
+    query_parser.add_argument('--since', help='开始时间')
+    query_parser.add_argument('--until', help='结束时间')
+    rotate_parser = subparsers.add_parser('rotate', help='轮转超时的当前段并清理过期归档')
+    rotate_parser.add_argument('project', nargs='?', help='项目名称，默认全部')
+    stats_parser = subparsers.add_parser('stats', help='显示日志段信息')
+    stats_parser.add_argument('project', nargs='?', help='项目名称，默认全部')
+    args = parser.parse_args()
+
+    if args.command == 'write':
+        LogWriter(args.project).consume(sys.stdin.fileno())
+    elif args.command == 'query':
+        try:
+            query(args.project, parse_time(args.since), parse_time(args.until))
+        except BrokenPipeError:
+            pass
+    elif args.command == 'rotate':
+        for name in list_names(args.project):
+            LogWriter(name).rotate_if_expired()
+            remove_expired_segments(name)
+    else:
+        show_stats(args.project)
+
+
+if __name__ == "__main__":
+    main()
@@ -41,6 +41,7 @@ SYSTEM_LOG_DIR="$LOGS_DIR/system"
 PROJECTS_LOG_DIR="$LOGS_DIR/projects"
 REGISTRATION_LOG="$SYSTEM_LOG_DIR/registration.log"
 SERVICES_CONF="$SYSTEM_LOG_DIR/services.conf"
+SUPERVISOR_PID_FILE="$SYSTEM_LOG_DIR/service_supervisor.pid"
 
 # 创建必要目录
 create_directories() {
@@ -156,6 +157,19 @@ scan_projects() {
     echo "${discovered_projects[@]}"
 }
 
+# 服务监管进程是否在运行或即将由 entrypoint.sh 启动
+supervisor_enabled() {
+    [[ "${SUPERVISOR_MODE:-}" == "python" ]] || kill -0 "$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)" 2>/dev/null
+}
+
+# 通知服务监管进程重新读取 services.conf
+notify_supervisor() {
+    local supervisor_pid=$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)
+    if [[ -n "$supervisor_pid" ]] && kill -0 "$supervisor_pid" 2>/dev/null; then
+        kill -HUP "$supervisor_pid"
+    fi
+}
+
 # 注册后台服务
 register_background_service() {
     local project_name="$1"
@@ -174,6 +188,19 @@ register_background_service() {
     touch "$log_file"
     chmod 666 "$log_file"
     
+    # 由服务监管进程(service_supervisor.py)管理时，只登记到监控列表，由监管进程启动和重启
+    if supervisor_enabled; then
+        if [[ -f "$SERVICES_CONF" ]]; then
+            grep -v "^$project_name:" "$SERVICES_CONF" > "$SERVICES_CONF.tmp" || true
+            mv "$SERVICES_CONF.tmp" "$SERVICES_CONF"
+        fi
+        echo "$project_name:$restart_policy:$command" >> "$SERVICES_CONF"
+        notify_supervisor
+        echo "$(date): SERVICE注册 $project_name (由监管进程启动)" >> "$REGISTRATION_LOG"
+        log_info "后台服务注册成功: $project_name (由监管进程启动)"
+        return 0
+    fi
+    
     # 检查是否已存在运行中的服务
     if [[ -f "$pid_file" ]]; then
         local old_pid=$(cat "$pid_file" 2>/dev/null)
@@ -211,9 +238,18 @@ remove_project() {
         log_info "已移除项目 $project_name 的所有定时任务"
     fi
     
-    # 停止后台服务
+    # 从监控列表移除
+    if [[ -f "$SERVICES_CONF" ]]; then
+        grep -v "^$project_name:" "$SERVICES_CONF" > "$SERVICES_CONF.tmp" || true
+        mv "$SERVICES_CONF.tmp" "$SERVICES_CONF"
+    fi
+    
+    # 停止后台服务（由监管进程管理时，通知监管进程停止整个进程组）
     local pid_file="$PROJECTS_LOG_DIR/${project_name}.pid"
-    if [[ -f "$pid_file" ]]; then
+    if kill -0 "$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)" 2>/dev/null; then
+        notify_supervisor
+        log_info "已通知监管进程停止项目 $project_name 的后台服务"
+    elif [[ -f "$pid_file" ]]; then
         local pid=$(cat "$pid_file" 2>/dev/null)
         if [[ -n "$pid" ]] && kill -0 "$pid" 2>/dev/null; then
             kill "$pid"
@@ -222,11 +258,6 @@ remove_project() {
         rm -f "$pid_file"
     fi
     
-    # 从监控列表移除
-    if [[ -f "$SERVICES_CONF" ]]; then
-        grep -v "^$project_name:" "$SERVICES_CONF" > "$SERVICES_CONF.tmp" && mv "$SERVICES_CONF.tmp" "$SERVICES_CONF"
-    fi
-    
     # 记录移除操作
     echo "$(date): 移除项目 $project_name" >> "$REGISTRATION_LOG"
     
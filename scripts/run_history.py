@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+任务执行记录
+
+每次定时任务执行（job_runner.py / job_scheduler.py）和每次服务进程退出（service_supervisor.py）都写入
+logs/system/run_history.db（SQLite）：开始/结束时间、退出码、耗时和峰值内存。
+定时任务结束时与该项目最近 RUN_HISTORY_WINDOW 次成功执行的耗时比较，样本数不少于 SLOW_RUN_MIN_RUNS 且
+耗时同时超过 p95 和 p50 的 SLOW_RUN_FACTOR 倍时记为慢执行，写入警告日志并发送到 RUN_HISTORY_WEBHOOK_URL
+（企业微信群机器人格式，未配置时只记录日志）。
+
+用法:
+    python3 run_history.py stats [项目名]              各项目执行次数、失败次数、耗时 p50/p95、峰值内存
+    python3 run_history.py history <项目名> [-n 20]     最近的执行记录
+    python3 run_history.py check                       最近一次执行失败或过慢的项目（有则退出码为1）
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sqlite3
+import sys
+import time
+import urllib.request
+from datetime import datetime
+
+LOGS_DIR = os.environ.get('LOGS_DIR', '/app/logs')
+RUN_HISTORY_DB = os.path.join(LOGS_DIR, 'system', 'run_history.db')
+
+# 计算耗时分位数使用的最近成功执行次数
+RUN_HISTORY_WINDOW = int(os.environ.get('RUN_HISTORY_WINDOW', 50))
+RUN_HISTORY_RETENTION_DAYS = int(os.environ.get('RUN_HISTORY_RETENTION_DAYS', 90))
+# 慢执行判定：至少有 SLOW_RUN_MIN_RUNS 次成功执行的历史，耗时超过 p95 且超过 p50 的 SLOW_RUN_FACTOR 倍
+SLOW_RUN_MIN_RUNS = int(os.environ.get('SLOW_RUN_MIN_RUNS', 5))
+SLOW_RUN_FACTOR = float(os.environ.get('SLOW_RUN_FACTOR', 2))
+RUN_HISTORY_WEBHOOK_URL = os.environ.get('RUN_HISTORY_WEBHOOK_URL', '')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT,
+    pid INTEGER,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    seconds REAL NOT NULL,
+    exit_code INTEGER,
+    peak_rss_kb INTEGER,
+    slow INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS runs_name_finished ON runs (name, finished);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def connect(db_path=RUN_HISTORY_DB):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    # WAL 模式下并发执行的任务写入记录时不会阻塞读取
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def percentile(values, fraction):
+    """
+    :param values: 已排序的数值
+    :return: 最近秩法分位数
+    """
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def duration_stats(conn, name):
+    """
+    :return: 最近 RUN_HISTORY_WINDOW 次成功执行的耗时 {'count', 'p50', 'p95'}
+    """
+    rows = conn.execute('SELECT seconds FROM runs WHERE name = ? AND exit_code = 0 ORDER BY finished DESC LIMIT ?',
+                        (name, RUN_HISTORY_WINDOW)).fetchall()
+    seconds = sorted(row[0] for row in rows)
+    return {'count': len(seconds), 'p50': percentile(seconds, 0.5), 'p95': percentile(seconds, 0.95)}
+
+
+def is_slow(seconds, stats):
+    if stats['count'] < SLOW_RUN_MIN_RUNS:
+        return False
+    return seconds > stats['p95'] and seconds > stats['p50'] * SLOW_RUN_FACTOR
+
+
+def peak_rss_kb():
+    """
+    :return: 当前进程及已回收子进程的峰值常驻内存 (KB)
+    """
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def notify(message):
+    if not RUN_HISTORY_WEBHOOK_URL:
+        return
+    data = json.dumps({'msgtype': 'text', 'text': {'content': message}}).encode('utf-8')
+    request = urllib.request.Request(RUN_HISTORY_WEBHOOK_URL, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        urllib.request.urlopen(request, timeout=10).close()
+    except Exception as e:
+        logger.error(f"发送慢执行通知失败: {str(e)}")
+
+
+def record_run(name, kind, started, finished, exit_code, peak_rss=None, pid=None, source=None):
+    """
+    写入一次执行记录，定时任务同时做慢执行检查。记录失败只写日志，不影响任务本身
+
+    :param kind: 'job' 定时任务 / 'service' 后台服务
+    :param exit_code: 退出码，被信号终止时为负的信号值
+    :param peak_rss: 峰值常驻内存 (KB)
+    """
+    seconds = finished - started
+    try:
+        conn = connect()
+        try:
+            with conn:
+                stats = duration_stats(conn, name) if kind == 'job' else None
+                slow = bool(stats) and is_slow(seconds, stats)
+                conn.execute('INSERT INTO runs (name, kind, source, pid, started, finished, seconds, exit_code, '
+                             'peak_rss_kb, slow) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (name, kind, source, pid, started, finished, seconds, exit_code, peak_rss, int(slow)))
+                conn.execute('DELETE FROM runs WHERE name = ? AND finished < ?',
+                             (name, finished - RUN_HISTORY_RETENTION_DAYS * 86400))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"写入执行记录失败 ({name}): {str(e)}")
+        return
+
+    if slow:
+        message = (f"任务 {name} 执行过慢: 耗时 {seconds:.1f} 秒，最近 {stats['count']} 次成功执行 "
+                   f"p50 {stats['p50']:.1f} 秒 / p95 {stats['p95']:.1f} 秒，退出码 {exit_code}")
+        logger.warning(message)
+        notify(message)
+
+
+def project_stats(conn, name=None):
+    """
+    :return: [{name, kind, runs, failures, slow, p50, p95, last_seconds, last_exit_code, last_finished, peak_rss_kb}]
+    """
+    query = ('SELECT name, kind, COUNT(*), SUM(exit_code != 0), SUM(slow), MAX(peak_rss_kb), MAX(finished) '
+             'FROM runs' + (' WHERE name = ?' if name else '') + ' GROUP BY name ORDER BY name')
+    result = []
+    for row in conn.execute(query, (name,) if name else ()):
+        last = conn.execute('SELECT seconds, exit_code, slow FROM runs WHERE name = ? ORDER BY finished DESC LIMIT 1',
+                            (row[0],)).fetchone()
+        stats = duration_stats(conn, row[0])
+        result.append({
+            'name': row[0], 'kind': row[1], 'runs': row[2], 'failures': row[3] or 0, 'slow': row[4] or 0,
+            'peak_rss_kb': row[5], 'last_finished': row[6], 'p50': stats['p50'], 'p95': stats['p95'],
+            'last_seconds': last[0], 'last_exit_code': last[1], 'last_slow': bool(last[2]),
+        })
+    return result
+
+
+def format_seconds(seconds):
+    return '-' if seconds is None else f'{seconds:.1f}s'
+
+
+def show_stats(name=None):
+    if not os.path.exists(RUN_HISTORY_DB):
+        print("暂无执行记录")
+        return 0
+    conn = connect()
+    print(f"{'项目':<20}{'类型':<9}{'次数':>6}{'失败':>6}{'慢':>5}{'p50':>10}{'p95':>10}{'最近耗时':>10}"
+          f"{'峰值内存':>10}  最近结束")
+    for item in project_stats(conn, name):
+        peak = f"{item['peak_rss_kb'] / 1024:.0f}M" if item['peak_rss_kb'] else '-'
+        print(f"{item['name']:<20}{item['kind']:<9}{item['runs']:>6}{item['failures']:>6}{item['slow']:>5}"
+              f"{format_seconds(item['p50']):>10}{format_seconds(item['p95']):>10}"
+              f"{format_seconds(item['last_seconds']):>10}{peak:>10}  "
+              f"{datetime.fromtimestamp(item['last_finished']).strftime('%Y-%m-%d %H:%M:%S')}")
+    conn.close()
+    return 0
+
+
+def show_history(name, limit):
+    if not os.path.exists(RUN_HISTORY_DB):
+        print("暂无执行记录")
+        return 0
+    conn = connect()
+    rows = conn.execute('SELECT started, seconds, exit_code, peak_rss_kb, slow, source, pid FROM runs '
+                        'WHERE name = ? ORDER BY finished DESC LIMIT ?', (name, limit)).fetchall()
+    print(f"{'开始时间':<22}{'耗时':>10}{'退出码':>8}{'峰值内存':>10}  来源")
+    for started, seconds, exit_code, peak, slow, source, pid in rows:
+        print(f"{datetime.fromtimestamp(started).strftime('%Y-%m-%d %H:%M:%S'):<22}{format_seconds(seconds):>10}"
+              f"{'-' if exit_code is None else exit_code:>8}{(f'{peak / 1024:.0f}M' if peak else '-'):>10}  "
+              f"{source or '-'} (PID: {pid}){'  [慢]' if slow else ''}")
+    conn.close()
+    return 0
+
+
+def check():
+    """
+    :return: 最近一次执行失败或过慢的定时任务数量
+    """
+    if not os.path.exists(RUN_HISTORY_DB):
+        return 0
+    conn = connect()
+    problems = 0
+    for item in project_stats(conn):
+        if item['kind'] != 'job':
+            continue
+        if item['last_exit_code'] != 0:
+            print(f"任务 {item['name']} 最近一次执行失败，退出码 {item['last_exit_code']}")
+            problems += 1
+        elif item['last_slow']:
+            print(f"任务 {item['name']} 最近一次执行过慢: {format_seconds(item['last_seconds'])} "
+                  f"(p50 {format_seconds(item['p50'])}, p95 {format_seconds(item['p95'])})")
+            problems += 1
+    conn.close()
+    return problems
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+    parser = argparse.ArgumentParser(description='任务执行记录')
+    subparsers = parser.add_subparsers(dest='command')
+    stats_parser = subparsers.add_parser('stats', help='各项目执行统计')
+    stats_parser.add_argument('project', nargs='?', help='项目名称')
+    history_parser = subparsers.add_parser('history', help='最近的执行记录')
+    history_parser.add_argument('project', help='项目名称')
+    history_parser.add_argument('-n', '--limit', type=int, default=20, help='显示条数')
+    subparsers.add_parser('check', help='检查最近一次执行失败或过慢的任务')
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        sys.exit(show_stats(args.project))
+    elif args.command == 'history':
+        sys.exit(show_history(args.project, args.limit))
+    elif args.command == 'check':
+        sys.exit(1 if check() else 0)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,13 @@ SYSTEM_LOG_DIR="$LOGS_DIR/system"
 PROJECTS_LOG_DIR="$LOGS_DIR/projects"
 REGISTRATION_LOG="$SYSTEM_LOG_DIR/registration.log"
 SERVICES_CONF="$SYSTEM_LOG_DIR/services.conf"
+REGISTRATION_CACHE_DIR="$SYSTEM_LOG_DIR/registration_cache"
+REGISTRATION_MANIFEST="$REGISTRATION_CACHE_DIR/manifest"
+
+# 注册缓存格式版本，crontab 条目格式变化时递增以使旧缓存失效
+REGISTRATION_CACHE_VERSION="4"
+# 并行注册的项目数
+REGISTER_PARALLELISM="${REGISTER_PARALLELISM:-$(nproc 2>/dev/null || echo 4)}"
 
 # create_directories() {
 #     mkdir -p "$SYSTEM_LOG_DIR" "$PROJECTS_LOG_DIR"
@@ -108,7 +115,9 @@ SERVICES_CONF="$SYSTEM_LOG_DIR/services.conf"
 
 # 项目处理
 execute_project_setup() {
-    # local project_name="$1"
+    local project_name="$1"
+    # crontab 片段输出文件，为空时由 simple_register.sh 直接写入 crontab
+    local fragment_file="${2:-}"
     # local project_dir="$PROJECTS_DIR/$project_name"
     # local setup_file="$project_dir/setup.sh"
     
@@ -170,8 +179,7 @@ execute_project_setup() {
         local register_result=0
                 
         # 使用更安全的调用方式
-        bash "$simple_register_script" "$project_name"
-        register_result=$?
+        CRONTAB_FRAGMENT_FILE="$fragment_file" bash "$simple_register_script" "$project_name" || register_result=$?
                 
         log_debug "simple_register.sh返回码: $register_result"
                 
@@ -189,6 +197,7 @@ execute_project_setup() {
     else
         log_error "简化注册脚本不存在: $simple_register_script"
         return 1
+    fi
 
     # # 根据项目类型选择处理方式
     # case "$PROJECT_TYPE" in
@@ -294,27 +303,162 @@ scan_projects() {
 }
 
 
+# 计算项目注册指纹：setup.sh、requirements 文件和影响注册结果的环境变量
+project_fingerprint() {
+    local project_dir="$PROJECTS_DIR/$1"
+    {
+        echo "version=$REGISTRATION_CACHE_VERSION supervisor=${SUPERVISOR_MODE:-}"
+        cat "$project_dir/setup.sh"
+        cat "$project_dir"/requirements*.txt 2>/dev/null || true
+    } | sha256sum | cut -d' ' -f1
+}
+
+# 清单中记录的项目指纹和类型: <项目名> <指纹> <cron|service>
+manifest_entry() {
+    awk -v name="$1" '$1 == name {print $2, $3}' "$REGISTRATION_MANIFEST" 2>/dev/null || true
+}
+
+# 项目未变化且注册结果仍然有效时可以直接从缓存恢复
+is_cached() {
+    local project_name="$1"
+    local fingerprint="$2"
+    local cached_fingerprint cached_type
+    read -r cached_fingerprint cached_type <<< "$(manifest_entry "$project_name")"
+    [[ "$cached_fingerprint" == "$fingerprint" ]] || return 1
+
+    case "$cached_type" in
+        "cron")
+            [[ -s "$REGISTRATION_CACHE_DIR/$project_name.cron" ]]
+            ;;
+        "service")
+            # 只有由监管进程启动服务时登记即注册；否则需要重新注册以启动服务进程
+            [[ "${SUPERVISOR_MODE:-}" == "python" ]] && grep -q "^$project_name:" "$SERVICES_CONF" 2>/dev/null
+            ;;
+        *)
+            return 1
+            ;;
+    esac
+}
+
+# 并行注册有变化的项目，每个项目的输出在全部完成后按顺序打印
+register_changed_projects() {
+    local work_dir="$1"
+    shift
+
+    for project in "$@"; do
+        while [[ $(jobs -rp | wc -l) -ge $REGISTER_PARALLELISM ]]; do
+            wait -n || true
+        done
+        (
+            if execute_project_setup "$project" "$work_dir/$project.cron" > "$work_dir/$project.out" 2>&1; then
+                echo 0 > "$work_dir/$project.rc"
+            else
+                echo 1 > "$work_dir/$project.rc"
+            fi
+        ) &
+    done
+    wait || true
+
+    for project in "$@"; do
+        echo "========================================="
+        echo "处理项目: $project"
+        cat "$work_dir/$project.out" 2>/dev/null || true
+    done
+}
+
+# 一次性写入 crontab：移除本次涉及项目的旧条目，再追加全部项目的条目
+write_crontab() {
+    local fragments_file="$1"
+    shift
+    local project_names="$*"
+
+    {
+        if ! crontab -l 2>/dev/null | grep -q "^SHELL="; then
+            echo "SHELL=/bin/bash"
+            echo "PATH=/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+            echo "HOME=/root"
+            echo ""
+        fi
+        crontab -l 2>/dev/null | awk -v names="$project_names" '
+            BEGIN { count = split(names, list, " "); for (i = 1; i <= count; i++) managed["# PROJECT: " list[i]] = 1 }
+            skip_next { skip_next = 0; next }
+            ($0 in managed) { skip_next = 1; next }
+            { print }
+        '
+        cat "$fragments_file"
+    } | crontab -
+}
+
 # 主逻辑
+force_register="false"
+if [[ "${1:-}" == "--force" || "${REGISTER_NO_CACHE:-}" == "true" ]]; then
+    force_register="true"
+fi
+
+start_time=$(date +%s)
 projects=($(scan_projects))
 total_count=${#projects[@]}
 
 echo "发现 $total_count 个项目: ${projects[*]}"
 
-echo "开始循环处理..."
+mkdir -p "$REGISTRATION_CACHE_DIR"
+declare -A fingerprints
+cached_projects=()
+changed_projects=()
 for project in "${projects[@]}"; do
-    echo "========================================="
-    echo "处理项目: $project"
-    
-    if execute_project_setup "$project"; then
-        echo "项目 $project 处理成功"
+    fingerprints[$project]=$(project_fingerprint "$project")
+    if [[ "$force_register" != "true" ]] && is_cached "$project" "${fingerprints[$project]}"; then
+        cached_projects+=("$project")
     else
-        echo "项目 $project 配置失败"
+        changed_projects+=("$project")
     fi
-    
-    echo "项目 $project 处理完成，继续下一个..."
-    echo ""
 done
 
+log_info "未变化的项目(从缓存恢复): ${cached_projects[*]:-无}"
+log_info "需要注册的项目(并行 $REGISTER_PARALLELISM): ${changed_projects[*]:-无}"
+
+work_dir=$(mktemp -d)
+if [[ ${#changed_projects[@]} -gt 0 ]]; then
+    register_changed_projects "$work_dir" "${changed_projects[@]}"
+fi
+
+# 汇总注册结果，生成新的清单和 crontab
+fragments_file="$work_dir/crontab"
+manifest_tmp="$work_dir/manifest"
+: > "$fragments_file"
+: > "$manifest_tmp"
+failed_projects=()
+for project in "${projects[@]}"; do
+    cache_file="$REGISTRATION_CACHE_DIR/$project.cron"
+    if [[ " ${cached_projects[*]} " == *" $project "* ]]; then
+        manifest_entry "$project" | awk -v name="$project" 'NF {print name, $1, $2}' >> "$manifest_tmp"
+    elif [[ "$(cat "$work_dir/$project.rc" 2>/dev/null)" == "0" ]]; then
+        if [[ -s "$work_dir/$project.cron" ]]; then
+            mv "$work_dir/$project.cron" "$cache_file"
+            echo "$project ${fingerprints[$project]} cron" >> "$manifest_tmp"
+        else
+            rm -f "$cache_file"
+            echo "$project ${fingerprints[$project]} service" >> "$manifest_tmp"
+        fi
+    else
+        # 注册失败时保留上一次成功注册的条目，清单中的旧指纹保证下次启动重新注册
+        failed_projects+=("$project")
+        manifest_entry "$project" | awk -v name="$project" 'NF {print name, $1, $2}' >> "$manifest_tmp"
+    fi
+    if [[ -s "$cache_file" ]]; then
+        cat "$cache_file" >> "$fragments_file"
+    fi
+done
+
+# 清单中已删除的项目也需要从 crontab 中移除
+previous_projects=$(awk '{print $1}' "$REGISTRATION_MANIFEST" 2>/dev/null | tr '\n' ' ')
+write_crontab "$fragments_file" ${projects[@]} $previous_projects
+mv "$manifest_tmp" "$REGISTRATION_MANIFEST"
+rm -rf "$work_dir"
+
 echo "========================================="
-echo "循环处理完成"
-echo "扫描完成: 项目配置成功"
\ No newline at end of file
+log_info "注册完成: 缓存恢复 ${#cached_projects[@]} 个，重新注册 $((${#changed_projects[@]} - ${#failed_projects[@]})) 个，失败 ${#failed_projects[@]} 个，耗时 $(( $(date +%s) - start_time )) 秒"
+if [[ ${#failed_projects[@]} -gt 0 ]]; then
+    log_error "注册失败的项目: ${failed_projects[*]}"
+fi
+echo "扫描完成: 项目配置成功"
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台服务监管进程
+
+替代 task_monitor.sh daemon 的定时轮询：services.conf 中登记的服务（格式 项目名:重启策略:命令，
+与 simple_register.sh 相同）由本进程直接启动为子进程，通过 SIGCHLD 立即得知退出并按策略重启，
+空闲时阻塞在 select 上不占用 CPU。
+
+- 重启策略: always 总是重启 / on-failure 非 0 退出时重启 / never 不重启
+- 连续快速失败时按指数退避重启（0、1、2、4 ... 秒，最多 RESTART_BACKOFF_MAX 秒），
+  运行超过 RESTART_BACKOFF_RESET 秒后退避清零
+- 启动时 PID 文件中仍存活的服务（如监管进程重启前启动的服务）通过 pidfd 接管，不重复启动
+- 服务输出经管道写入 log_store.py 管理的日志（logs/projects/<项目>.log，按大小/时间轮转）
+- SIGHUP 重新读取 services.conf；SIGTERM 停止全部服务后退出
+
+用法:
+    python3 service_supervisor.py daemon            启动监管进程
+    python3 service_supervisor.py status            显示服务状态
+    python3 service_supervisor.py reload            通知监管进程重新读取 services.conf
+    python3 service_supervisor.py restart <项目名>   重启指定服务
+"""
+import argparse
+import json
+import logging
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import log_store
+import run_history
+
+LOGS_DIR = os.environ.get('LOGS_DIR', '/app/logs')
+SYSTEM_LOG_DIR = os.path.join(LOGS_DIR, 'system')
+PROJECTS_LOG_DIR = os.path.join(LOGS_DIR, 'projects')
+SERVICES_CONF = os.environ.get('SERVICES_CONF', os.path.join(SYSTEM_LOG_DIR, 'services.conf'))
+SUPERVISOR_PID_FILE = os.environ.get('SUPERVISOR_PID_FILE', os.path.join(SYSTEM_LOG_DIR, 'service_supervisor.pid'))
+SUPERVISOR_STATE_FILE = os.path.join(SYSTEM_LOG_DIR, 'service_supervisor.json')
+SUPERVISOR_CONTROL_DIR = os.path.join(SYSTEM_LOG_DIR, 'supervisor_control')
+
+RESTART_POLICIES = ('always', 'on-failure', 'never')
+
+# 重启退避（秒）
+RESTART_BACKOFF_BASE = float(os.environ.get('RESTART_BACKOFF_BASE', 1))
+RESTART_BACKOFF_MAX = float(os.environ.get('RESTART_BACKOFF_MAX', 300))
+RESTART_BACKOFF_RESET = float(os.environ.get('RESTART_BACKOFF_RESET', 60))
+
+# 停止服务时等待退出的时间（秒），超时后 SIGKILL
+SERVICE_STOP_TIMEOUT = float(os.environ.get('SERVICE_STOP_TIMEOUT', 10))
+
+logger = logging.getLogger(__name__)
+
+
+def read_services_conf(path=SERVICES_CONF):
+    """
+    读取 services.conf，同一项目登记多次时以最后一行为准
+
+    :return: {项目名: (重启策略, 命令)}
+    """
+    services = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if not line.strip() or line.startswith('#'):
+                    continue
+                parts = line.split(':', 2)
+                if len(parts) != 3 or not parts[0] or not parts[2]:
+                    logger.warning(f"services.conf 格式错误，跳过: {line}")
+                    continue
+                name, policy, command = parts
+                if policy not in RESTART_POLICIES:
+                    logger.warning(f"服务 {name} 重启策略 '{policy}' 未知，按 never 处理")
+                services[name] = (policy, command)
+    except FileNotFoundError:
+        pass
+    return services
+
+
+def read_pid(pid_file):
+    try:
+        with open(pid_file, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (FileNotFoundError, ValueError, ProcessLookupError, PermissionError):
+        return None
+
+
+class Service:
+    def __init__(self, name, policy, command):
+        self.name = name
+        self.policy = policy
+        self.command = command
+        self.pid_file = os.path.join(PROJECTS_LOG_DIR, f'{name}.pid')
+        self.process = None
+        self.pid = None
+        self.pidfd = None
+        self.started_at = None
+        self.failures = 0
+        self.restarts = 0
+        self.restart_at = None
+        self.stop_requested = False
+        self.last_exit_code = None
+        self.last_exit_at = None
+
+    @property
+    def adopted(self):
+        return self.pid is not None and self.process is None
+
+    def should_restart(self, exit_code):
+        if self.policy == 'always':
+            return True
+        if self.policy == 'on-failure':
+            return exit_code != 0
+        return False
+
+    def to_dict(self):
+        return {
+            'policy': self.policy,
+            'command': self.command,
+            'pid': self.pid,
+            'adopted': self.adopted,
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat() if self.started_at else None,
+            'restarts': self.restarts,
+            'failures': self.failures,
+            'next_restart_at': datetime.fromtimestamp(self.restart_at).isoformat() if self.restart_at else None,
+            'last_exit_code': self.last_exit_code,
+            'last_exit_at': datetime.fromtimestamp(self.last_exit_at).isoformat() if self.last_exit_at else None,
+        }
+
+
+class ServiceSupervisor:
+    def __init__(self, conf_path=SERVICES_CONF):
+        self.conf_path = conf_path
+        self.services = {}
+        # 本进程启动的服务 {PID: Service}，包括已从 services.conf 移除、正在停止的服务
+        self.children = {}
+        self.selector = selectors.DefaultSelector()
+        self.stopping = False
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        os.set_blocking(self.wakeup_write, False)
+
+    def start(self, service):
+        os.makedirs(PROJECTS_LOG_DIR, exist_ok=True)
+        service.restart_at = None
+        try:
+            service.process = subprocess.Popen(['bash', '-c', log_store.pipeline_command(service.command, service.name)],
+                                               stdin=subprocess.DEVNULL, start_new_session=True)
+        except OSError as e:
+            logger.error(f"服务 {service.name} 启动失败: {str(e)}")
+            self.schedule_restart(service, time.time())
+            return
+        service.pid = service.process.pid
+        service.started_at = time.time()
+        self.children[service.pid] = service
+        with open(service.pid_file, 'w') as f:
+            f.write(str(service.pid))
+        logger.info(f"服务 {service.name} 已启动 (PID: {service.pid})")
+
+    def adopt(self, service, pid):
+        """
+        接管不是本进程子进程的服务，通过 pidfd 得知其退出（无法取得退出码）
+        """
+        try:
+            pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"服务 {service.name} (PID: {pid}) 无法接管，停止后重新启动: {str(e)}")
+            self.kill(pid, signal.SIGTERM, group=False)
+            return False
+        service.pid = pid
+        service.pidfd = pidfd
+        service.started_at = time.time()
+        self.selector.register(pidfd, selectors.EVENT_READ, service)
+        logger.info(f"接管已运行的服务 {service.name} (PID: {pid})")
+        return True
+
+    def kill(self, pid, signum, group=True):
+        try:
+            if group:
+                os.killpg(pid, signum)
+            else:
+                os.kill(pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def schedule_restart(self, service, exited_at):
+        if service.started_at and exited_at - service.started_at >= RESTART_BACKOFF_RESET:
+            service.failures = 0
+        service.failures += 1
+        delay = 0 if service.failures == 1 else min(RESTART_BACKOFF_MAX,
+                                                      RESTART_BACKOFF_BASE * 2 ** (service.failures - 2))
+        service.restart_at = exited_at + delay
+        service.restarts += 1
+        if delay:
+            logger.warning(f"服务 {service.name} 连续第 {service.failures} 次快速退出，{delay:g} 秒后重启")
+
+    def on_exit(self, service, exit_code, peak_rss=None):
+        """
+        服务进程退出后按重启策略决定是否重启
+
+        :param exit_code: 退出码，被信号终止时为负的信号值，接管的服务为 None
+        :param peak_rss: 峰值常驻内存 (KB)，接管的服务为 None
+        """
+        if service.pidfd is not None:
+            self.selector.unregister(service.pidfd)
+            os.close(service.pidfd)
+            service.pidfd = None
+        exited_at = time.time()
+        if service.process is not None:
+            service.process.returncode = exit_code
+            self.children.pop(service.pid, None)
+            # 接管的服务不知道实际启动时间和退出码，不写入执行记录
+            run_history.record_run(service.name, 'service', service.started_at, exited_at, exit_code, peak_rss,
+                                   service.pid, 'supervisor')
+        logger.log(logging.INFO if exit_code == 0 else logging.ERROR,
+                    f"服务 {service.name} 已退出 (PID: {service.pid})，退出码 {exit_code}，"
+                    f"运行 {exited_at - service.started_at:.1f} 秒")
+        service.process = None
+        service.pid = None
+        service.last_exit_code = exit_code
+        service.last_exit_at = exited_at
+        try:
+            os.remove(service.pid_file)
+        except FileNotFoundError:
+            pass
+
+        if self.stopping or service.stop_requested:
+            service.stop_requested = False
+            return
+        if service.should_restart(1 if exit_code is None else exit_code):
+            self.schedule_restart(service, exited_at)
+        else:
+            logger.info(f"服务 {service.name} 重启策略为 '{service.policy}'，不再重启")
+
+    def reap_children(self):
+        while True:
+            try:
+                pid, status, usage = os.wait4(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            service = self.children.get(pid)
+            if service is not None:
+                self.on_exit(service, os.waitstatus_to_exitcode(status), usage.ru_maxrss)
+
+    def stop_services(self, services):
+        """
+        停止服务：先发送 SIGTERM，超时后 SIGKILL
+        """
+        services = [service for service in services if service.pid is not None]
+        for service in services:
+            logger.info(f"停止服务 {service.name} (PID: {service.pid})")
+            service.stop_requested = True
+            self.kill(service.pid, signal.SIGTERM, group=not service.adopted)
+        deadline = time.time() + SERVICE_STOP_TIMEOUT
+        while services and time.time() < deadline:
+            time.sleep(0.1)
+            self.reap_children()
+            services = [service for service in services if service.pid is not None and self.is_alive(service)]
+        for service in services:
+            logger.warning(f"服务 {service.name} 未在 {SERVICE_STOP_TIMEOUT:.0f} 秒内退出，强制结束")
+            self.kill(service.pid, signal.SIGKILL, group=not service.adopted)
+        if services:
+            time.sleep(0.1)
+            self.reap_children()
+
+    def is_alive(self, service):
+        if service.adopted:
+            try:
+                os.kill(service.pid, 0)
+                return True
+            except ProcessLookupError:
+                self.on_exit(service, None)
+                return False
+        return True
+
+    def reload(self):
+        """
+        按 services.conf 增加、移除或更新服务
+        """
+        configured = read_services_conf(self.conf_path)
+        removed = [service for name, service in self.services.items() if name not in configured]
+        for service in removed:
+            del self.services[service.name]
+        self.stop_services(removed)
+
+        for name, (policy, command) in configured.items():
+            service = self.services.get(name)
+            if service is not None:
+                changed = service.command != command
+                service.policy = policy
+                service.command = command
+                if changed:
+                    logger.info(f"服务 {name} 的命令已变更，重新启动")
+                    self.restart(service)
+                continue
+
+            service = Service(name, policy, command)
+            self.services[name] = service
+            pid = read_pid(service.pid_file)
+            if pid is None or not self.adopt(service, pid):
+                self.start(service)
+        self.write_state()
+
+    def restart(self, service):
+        self.stop_services([service])
+        service.failures = 0
+        self.start(service)
+
+    def process_control(self):
+        """
+        处理 restart 命令写入的控制文件
+        """
+        if not os.path.isdir(SUPERVISOR_CONTROL_DIR):
+            return
+        for name in os.listdir(SUPERVISOR_CONTROL_DIR):
+            os.remove(os.path.join(SUPERVISOR_CONTROL_DIR, name))
+            service = self.services.get(name)
+            if service is None:
+                logger.warning(f"要重启的服务 {name} 未登记")
+                continue
+            logger.info(f"手动重启服务 {name}")
+            self.restart(service)
+
+    def write_state(self):
+        state = {
+            'pid': os.getpid(),
+            'updated_at': datetime.now().isoformat(),
+            'services': {name: service.to_dict() for name, service in self.services.items()},
+        }
+        tmp_file = SUPERVISOR_STATE_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, SUPERVISOR_STATE_FILE)
+
+    def run_forever(self):
+        os.makedirs(SYSTEM_LOG_DIR, exist_ok=True)
+        os.makedirs(SUPERVISOR_CONTROL_DIR, exist_ok=True)
+        # 信号处理函数只负责唤醒 select，实际处理在主循环中根据写入管道的信号编号进行
+        signal.set_wakeup_fd(self.wakeup_write)
+        for signum in (signal.SIGCHLD, signal.SIGHUP, signal.SIGUSR1, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: None)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ)
+
+        write_pid_file()
+        self.reload()
+        logger.info(f"服务监管进程已启动 (PID: {os.getpid()})，共 {len(self.services)} 个服务")
+
+        try:
+            while not self.stopping:
+                pending = [service.restart_at for service in self.services.values() if service.restart_at]
+                timeout = max(0, min(pending) - time.time()) if pending else None
+                received = set()
+                for key, _ in self.selector.select(timeout):
+                    if key.fd == self.wakeup_read:
+                        try:
+                            received.update(os.read(self.wakeup_read, 512))
+                        except BlockingIOError:
+                            pass
+                    else:
+                        self.on_exit(key.data, None)
+
+                if received & {signal.SIGTERM, signal.SIGINT}:
+                    logger.info("收到停止信号，停止全部服务")
+                    self.stopping = True
+                    break
+                self.reap_children()
+                if signal.SIGHUP in received:
+                    logger.info("重新读取 services.conf")
+                    self.reload()
+                if signal.SIGUSR1 in received:
+                    self.process_control()
+
+                now = time.time()
+                for service in list(self.services.values()):
+                    if service.restart_at and service.restart_at <= now:
+                        self.start(service)
+                self.write_state()
+        finally:
+            self.stop_services(list(self.services.values()))
+            self.write_state()
+            remove_pid_file()
+            logger.info("服务监管进程已停止")
+
+
+def write_pid_file():
+    os.makedirs(os.path.dirname(SUPERVISOR_PID_FILE), exist_ok=True)
+    with open(SUPERVISOR_PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def remove_pid_file():
+    try:
+        with open(SUPERVISOR_PID_FILE, 'r') as f:
+            if f.read().strip() != str(os.getpid()):
+                return
+        os.remove(SUPERVISOR_PID_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def show_status():
+    supervisor_pid = read_pid(SUPERVISOR_PID_FILE)
+    print(f"监管进程: {'运行中 (PID: ' + str(supervisor_pid) + ')' if supervisor_pid else '未运行'}")
+    state = {}
+    if supervisor_pid:
+        try:
+            with open(SUPERVISOR_STATE_FILE, 'r') as f:
+                state = json.load(f).get('services', {})
+        except (FileNotFoundError, ValueError):
+            pass
+    print(f"{'服务':<20}{'策略':<12}{'状态':<20}{'重启次数':<10}最近退出码")
+    for name, (policy, command) in read_services_conf().items():
+        info = state.get(name, {})
+        pid = read_pid(os.path.join(PROJECTS_LOG_DIR, f'{name}.pid'))
+        if pid:
+            status = f'运行中 (PID: {pid})'
+        elif info.get('next_restart_at'):
+            status = '等待重启'
+        else:
+            status = '已停止'
+        print(f"{name:<20}{policy:<12}{status:<20}{info.get('restarts', '-')!s:<10}{info.get('last_exit_code', '-')}")
+
+
+def signal_supervisor(signum):
+    supervisor_pid = read_pid(SUPERVISOR_PID_FILE)
+    if not supervisor_pid:
+        print("监管进程未运行")
+        return 1
+    os.kill(supervisor_pid, signum)
+    return 0
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+    parser = argparse.ArgumentParser(description='后台服务监管进程')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('daemon', help='启动监管进程')
+    subparsers.add_parser('status', help='显示服务状态')
+    subparsers.add_parser('reload', help='重新读取 services.conf')
+    restart_parser = subparsers.add_parser('restart', help='重启指定服务')
+    restart_parser.add_argument('project', help='项目名称')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        show_status()
+    elif args.command == 'reload':
+        sys.exit(signal_supervisor(signal.SIGHUP))
+    elif args.command == 'restart':
+        os.makedirs(SUPERVISOR_CONTROL_DIR, exist_ok=True)
+        open(os.path.join(SUPERVISOR_CONTROL_DIR, args.project), 'w').close()
+        sys.exit(signal_supervisor(signal.SIGUSR1))
+    else:
+        if read_pid(SUPERVISOR_PID_FILE):
+            logger.error(f"监管进程已在运行 (PID: {read_pid(SUPERVISOR_PID_FILE)})")
+            sys.exit(1)
+        ServiceSupervisor().run_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,27 @@ CRON_SCHEDULE="0 */2 * * *"
 # 3. 命令会在项目目录下执行
 CRON_COMMAND="cd /app/项目目录 && python3 main.py"
 
+# 上一次执行未结束时的处理方式 (可选，默认 skip)
+#   "skip"     - 跳过本次执行
+#   "queue"    - 等待上一次结束后执行（最多排队一次）
+#   "kill-old" - 结束上一次执行后执行
+OVERLAP_POLICY="skip"
+
+# 重任务 (可选)：全局同时执行的重任务数不超过 MAX_HEAVY_JOBS（默认2），其余排队等待
+JOB_HEAVY="false"
+
+# 资源限制 (可选，留空表示不限制)
+JOB_MEMORY_LIMIT_MB=""      # 内存（地址空间）上限，超出时分配失败 (MemoryError)
+JOB_CPU_LIMIT_SECONDS=""    # CPU 时间上限（秒），超出时任务被终止
+JOB_NICE=""                 # 调低优先级，如 "10"
+
+# 性能分析 (可选，留空表示不分析)，结果保存在 logs/projects/<项目>/profile-*，不需要修改任务代码
+#   "cpu"    - cProfile 函数耗时（.pstats 可用 python3 -m pstats 查看）
+#   "mem"    - tracemalloc 内存分配位置和峰值
+#   "sample" - 每秒采样任务进程的 CPU、内存、IO (.csv)
+# cpu/mem 仅适用于 "cd <目录> && python3 <脚本>" 形式的命令，其他命令自动改用 sample
+PROFILE=""
+
 # ==============================
 # 后台服务配置 (当 PROJECT_TYPE=service 时必需)
 # ==============================
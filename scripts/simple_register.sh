@@ -33,7 +33,11 @@ LOGS_DIR="/app/logs"
 SYSTEM_LOG_DIR="$LOGS_DIR/system"
 PROJECTS_LOG_DIR="$LOGS_DIR/projects"
 REGISTRATION_LOG="$SYSTEM_LOG_DIR/registration.log"
+SCHEDULER_PID_FILE="$SYSTEM_LOG_DIR/job_scheduler.pid"
+LOG_STORE_SCRIPT="/app/scripts/log_store.py"
+JOB_RUNNER_SCRIPT="/app/scripts/job_runner.py"
 SERVICES_CONF="$SYSTEM_LOG_DIR/services.conf"
+SUPERVISOR_PID_FILE="$SYSTEM_LOG_DIR/service_supervisor.pid"
 
 # 验证setup.sh脚本格式
 validate_setup_script() {
@@ -57,6 +61,19 @@ validate_setup_script() {
     return 0
 }
 
+# 服务监管进程是否在运行或即将由 entrypoint.sh 启动
+supervisor_enabled() {
+    [[ "${SUPERVISOR_MODE:-}" == "python" ]] || kill -0 "$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)" 2>/dev/null
+}
+
+# 通知服务监管进程重新读取 services.conf
+notify_supervisor() {
+    local supervisor_pid=$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)
+    if [[ -n "$supervisor_pid" ]] && kill -0 "$supervisor_pid" 2>/dev/null; then
+        kill -HUP "$supervisor_pid"
+    fi
+}
+
 # 注册后台服务
 register_background_service() {
     local project_name="$1"
@@ -75,6 +92,23 @@ register_background_service() {
     touch "$log_file"
     chmod 666 "$log_file"
     
+    # 由服务监管进程(service_supervisor.py)管理时，只登记到监控列表，由监管进程启动和重启
+    if supervisor_enabled; then
+        # 并行注册时多个进程同时改写 services.conf，用文件锁串行化
+        (
+            flock 9
+            if [[ -f "$SERVICES_CONF" ]]; then
+                grep -v "^$project_name:" "$SERVICES_CONF" > "$SERVICES_CONF.$$.tmp" || true
+                mv "$SERVICES_CONF.$$.tmp" "$SERVICES_CONF"
+            fi
+            echo "$project_name:$restart_policy:$command" >> "$SERVICES_CONF"
+        ) 9>"$SERVICES_CONF.lock"
+        notify_supervisor
+        echo "$(date): SERVICE注册 $project_name (由监管进程启动)" >> "$REGISTRATION_LOG"
+        log_info "后台服务注册成功: $project_name (由监管进程启动)"
+        return 0
+    fi
+    
     # 检查是否已存在运行中的服务
     if [[ -f "$pid_file" ]]; then
         local old_pid=$(cat "$pid_file" 2>/dev/null)
@@ -99,6 +133,42 @@ register_background_service() {
     return 0
 }
 
+# 输出项目的 crontab 条目（使用 register_single_project 中读取的 CRON_SCHEDULE/CRON_COMMAND）
+print_cron_entry() {
+    local project_name="$1"
+    local log_file="$2"
+    local command
+    command=$(job_runner_command "$project_name")
+    echo "# PROJECT: $project_name"
+    # 常驻调度器(job_scheduler.py)存活时由其执行任务，cron 仅作兜底
+    if [[ -f "$LOG_STORE_SCRIPT" ]]; then
+        # 输出交给日志存储（按大小/时间轮转、压缩并建立时间索引）
+        echo "$CRON_SCHEDULE kill -0 \"\$(cat $SCHEDULER_PID_FILE 2>/dev/null)\" 2>/dev/null || { $command; } 2>&1 | python3 $LOG_STORE_SCRIPT write $project_name"
+    else
+        echo "$CRON_SCHEDULE kill -0 \"\$(cat $SCHEDULER_PID_FILE 2>/dev/null)\" 2>/dev/null || { $command; } >> $log_file 2>&1"
+    fi
+}
+
+# 输出经 job_runner.py 执行 CRON_COMMAND 的命令：按 OVERLAP_POLICY 防止重叠执行，
+# JOB_HEAVY 的任务占用全局重任务名额，并按 JOB_MEMORY_LIMIT_MB/JOB_CPU_LIMIT_SECONDS/JOB_NICE 限制资源，
+# 设置 PROFILE 时采集性能数据
+job_runner_command() {
+    local project_name="$1"
+    if [[ ! -f "$JOB_RUNNER_SCRIPT" ]]; then
+        echo "$CRON_COMMAND"
+        return
+    fi
+    local args="--overlap ${OVERLAP_POLICY:-skip}"
+    case "${JOB_HEAVY,,}" in
+        true|1|yes) args+=" --heavy" ;;
+    esac
+    [[ -n "$JOB_MEMORY_LIMIT_MB" ]] && args+=" --memory-mb $JOB_MEMORY_LIMIT_MB"
+    [[ -n "$JOB_CPU_LIMIT_SECONDS" ]] && args+=" --cpu-seconds $JOB_CPU_LIMIT_SECONDS"
+    [[ -n "$JOB_NICE" ]] && args+=" --nice $JOB_NICE"
+    [[ -n "$PROFILE" ]] && args+=" --profile $PROFILE"
+    echo "python3 $JOB_RUNNER_SCRIPT $project_name $args -- $(printf '%q' "$CRON_COMMAND")"
+}
+
 # 直接注册单个项目的函数
 register_single_project() {
     local project_name="$1"
@@ -138,10 +208,17 @@ register_single_project() {
         echo "CRON_COMMAND=${CRON_COMMAND:-}"
         echo "SERVICE_COMMAND=${SERVICE_COMMAND:-}"
         echo "SERVICE_RESTART_POLICY=${SERVICE_RESTART_POLICY:-always}"
+        echo "OVERLAP_POLICY=${OVERLAP_POLICY:-skip}"
+        echo "JOB_HEAVY=${JOB_HEAVY:-false}"
+        echo "JOB_MEMORY_LIMIT_MB=${JOB_MEMORY_LIMIT_MB:-}"
+        echo "JOB_CPU_LIMIT_SECONDS=${JOB_CPU_LIMIT_SECONDS:-}"
+        echo "JOB_NICE=${JOB_NICE:-}"
+        echo "PROFILE=${PROFILE:-}"
     )
     
     # 安全解析配置
     local PROJECT_NAME PROJECT_TYPE CRON_SCHEDULE CRON_COMMAND SERVICE_COMMAND SERVICE_RESTART_POLICY
+    local OVERLAP_POLICY JOB_HEAVY JOB_MEMORY_LIMIT_MB JOB_CPU_LIMIT_SECONDS JOB_NICE PROFILE
     while IFS='=' read -r key value; do
         case "$key" in
             "PROJECT_NAME") PROJECT_NAME="$value" ;;
@@ -150,6 +227,12 @@ register_single_project() {
             "CRON_COMMAND") CRON_COMMAND="$value" ;;
             "SERVICE_COMMAND") SERVICE_COMMAND="$value" ;;
             "SERVICE_RESTART_POLICY") SERVICE_RESTART_POLICY="$value" ;;
+            "OVERLAP_POLICY") OVERLAP_POLICY="$value" ;;
+            "JOB_HEAVY") JOB_HEAVY="$value" ;;
+            "JOB_MEMORY_LIMIT_MB") JOB_MEMORY_LIMIT_MB="$value" ;;
+            "JOB_CPU_LIMIT_SECONDS") JOB_CPU_LIMIT_SECONDS="$value" ;;
+            "JOB_NICE") JOB_NICE="$value" ;;
+            "PROFILE") PROFILE="$value" ;;
         esac
     done <<< "$project_config"
     
@@ -167,8 +250,25 @@ register_single_project() {
                 return 1
             fi
             
+            case "$OVERLAP_POLICY" in
+                skip|queue|kill-old) ;;
+                *)
+                    log_error "未知的 OVERLAP_POLICY: '$OVERLAP_POLICY'（可选 skip、queue、kill-old）"
+                    return 1
+                    ;;
+            esac
+            case "$PROFILE" in
+                ""|cpu|mem|sample) ;;
+                *)
+                    log_error "未知的 PROFILE: '$PROFILE'（可选 cpu、mem、sample）"
+                    return 1
+                    ;;
+            esac
+            
             echo "  调度: $CRON_SCHEDULE"
             echo "  命令: $CRON_COMMAND"
+            echo "  重叠策略: $OVERLAP_POLICY"
+            [[ -n "$PROFILE" ]] && echo "  性能分析: $PROFILE"
             
             # 创建日志目录和文件
             mkdir -p /app/logs/projects
@@ -176,6 +276,13 @@ register_single_project() {
             touch "$log_file"
             chmod 666 "$log_file"
             
+            # 批量注册模式(scan_and_add.sh)：只输出本项目的 crontab 片段，由调用方统一写入一次 crontab
+            if [[ -n "${CRONTAB_FRAGMENT_FILE:-}" ]]; then
+                print_cron_entry "$project_name" "$log_file" > "$CRONTAB_FRAGMENT_FILE"
+                log_info "crontab片段已生成: $CRONTAB_FRAGMENT_FILE"
+                return 0
+            fi
+            
             # 检查是否已存在并彻底清理
             if crontab -l 2>/dev/null | grep -q "# PROJECT: $project_name"; then
                 log_warn "项目已在crontab中，先移除所有旧配置"
@@ -198,8 +305,7 @@ register_single_project() {
                     echo ""
                 fi
                 crontab -l 2>/dev/null | grep -v "^SHELL=" | grep -v "^PATH=" | grep -v "^HOME=" || true
-                echo "# PROJECT: $project_name"
-                echo "$CRON_SCHEDULE $CRON_COMMAND >> $log_file 2>&1"
+                print_cron_entry "$project_name" "$log_file"
             } | crontab -
             
             log_info "crontab操作完成"
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+容器状态/健康检查 HTTP 服务
+
+替代 entrypoint.sh 中 nc 循环：后台按 STATUS_REFRESH_INTERVAL 秒刷新一次状态快照（cron/调度器/监管进程是否存活、
+定时任务和后台服务的最近执行时间与退出码、run_history.py 记录的耗时分位数、磁盘空间），并预先生成各接口的响应内容，请求只返回内存中的结果，
+并发探测不会触发任何 pgrep/crontab 调用。
+
+接口:
+    GET /health     健康返回 200，否则 503，内容为 JSON 摘要
+    GET /status     完整状态快照 JSON
+    GET /metrics    Prometheus 文本格式指标（附加 STATUS_TEXTFILE_DIRS 下的 *.prom 文件，如数据同步指标）
+
+用法:
+    python3 status_server.py [--port 8080]
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import run_history
+
+LOGS_DIR = os.environ.get('LOGS_DIR', '/app/logs')
+SYSTEM_LOG_DIR = os.path.join(LOGS_DIR, 'system')
+PROJECTS_LOG_DIR = os.path.join(LOGS_DIR, 'projects')
+SCHEDULER_PID_FILE = os.path.join(SYSTEM_LOG_DIR, 'job_scheduler.pid')
+SCHEDULER_STATE_FILE = os.path.join(SYSTEM_LOG_DIR, 'job_scheduler.json')
+SUPERVISOR_PID_FILE = os.path.join(SYSTEM_LOG_DIR, 'service_supervisor.pid')
+SUPERVISOR_STATE_FILE = os.path.join(SYSTEM_LOG_DIR, 'service_supervisor.json')
+SERVICES_CONF = os.path.join(SYSTEM_LOG_DIR, 'services.conf')
+
+STATUS_PORT = int(os.environ.get('STATUS_PORT', 8080))
+STATUS_REFRESH_INTERVAL = float(os.environ.get('STATUS_REFRESH_INTERVAL', 15))
+# 附加到 /metrics 的 Prometheus 文本文件目录（逗号分隔）
+STATUS_TEXTFILE_DIRS = [path for path in os.environ.get(
+    'STATUS_TEXTFILE_DIRS', os.path.join(os.environ.get('SYNC_DATA_DIR', '/app/data'), 'metrics')).split(',') if path]
+DISK_PATH = os.environ.get('STATUS_DISK_PATH', '/app')
+DISK_UNHEALTHY_PERCENT = float(os.environ.get('DISK_UNHEALTHY_PERCENT', 95))
+
+# 读取请求头的超时（秒），防止慢连接占用
+REQUEST_TIMEOUT = 5
+
+CRON_PROJECT_PATTERN = re.compile(r'^# PROJECT: (\S+)')
+
+logger = logging.getLogger(__name__)
+
+
+def read_pid(pid_file):
+    try:
+        with open(pid_file, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (FileNotFoundError, ValueError, ProcessLookupError, PermissionError):
+        return None
+
+
+def read_json(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def process_running(name):
+    """
+    扫描 /proc 查找进程名，代替 pgrep
+    """
+    for comm_file in glob.glob('/proc/[0-9]*/comm'):
+        try:
+            with open(comm_file, 'r') as f:
+                if f.read().strip() == name:
+                    return True
+        except OSError:
+            continue
+    return False
+
+
+def read_cron_projects():
+    """
+    :return: {项目名: 调度表达式}，读取 crontab 中 simple_register.sh 写入的 "# PROJECT:" 条目
+    """
+    try:
+        output = subprocess.run(['crontab', '-l'], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return {}
+    projects = {}
+    project = None
+    for line in output.splitlines():
+        match = CRON_PROJECT_PATTERN.match(line)
+        if match:
+            project = match.group(1)
+        elif project and line.strip():
+            projects[project] = ' '.join(line.split()[:5])
+            project = None
+    return projects
+
+
+def last_log_time(name):
+    try:
+        return os.path.getmtime(os.path.join(PROJECTS_LOG_DIR, f'{name}.log'))
+    except FileNotFoundError:
+        return None
+
+
+def read_run_history():
+    """
+    :return: run_history.py 执行记录中各项目的统计 {项目名: {...}}
+    """
+    if not os.path.exists(run_history.RUN_HISTORY_DB):
+        return {}
+    try:
+        conn = run_history.connect()
+        try:
+            return {item['name']: item for item in run_history.project_stats(conn)}
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"读取执行记录失败: {str(e)}")
+        return {}
+
+
+def collect_status():
+    """
+    收集一次状态快照（在线程池中执行，不阻塞事件循环）
+    """
+    now = time.time()
+    scheduler_pid = read_pid(SCHEDULER_PID_FILE)
+    supervisor_pid = read_pid(SUPERVISOR_PID_FILE)
+    scheduler_state = read_json(SCHEDULER_STATE_FILE).get('jobs', {}) if scheduler_pid else {}
+    supervisor_state = read_json(SUPERVISOR_STATE_FILE).get('services', {}) if supervisor_pid else {}
+    # 执行记录同时包含 cron 和调度器触发的执行，优先于调度器状态文件
+    run_stats = read_run_history()
+
+    jobs = {}
+    for name, schedule in read_cron_projects().items():
+        state = scheduler_state.get(name, {})
+        history = run_stats.get(name, {})
+        jobs[name] = {
+            'schedule': schedule,
+            'executor': 'scheduler' if scheduler_pid else 'cron',
+            'running': state.get('running', 0),
+            'runs': history.get('runs', state.get('runs')),
+            'failures': history.get('failures', state.get('failures')),
+            'skipped': state.get('skipped'),
+            'slow_runs': history.get('slow'),
+            'last_started': state.get('last_started'),
+            'last_finished': history.get('last_finished', state.get('last_finished')),
+            'last_exit_code': history.get('last_exit_code', state.get('last_exit_code')),
+            'last_seconds': history.get('last_seconds', state.get('last_seconds')),
+            'duration_p50': history.get('p50'),
+            'duration_p95': history.get('p95'),
+            'peak_rss_bytes': history['peak_rss_kb'] * 1024 if history.get('peak_rss_kb') else None,
+            'next_run': state.get('next_run'),
+            'last_log_at': last_log_time(name),
+        }
+
+    services = {}
+    try:
+        with open(SERVICES_CONF, 'r') as f:
+            lines = [line.rstrip('\n').split(':', 2) for line in f if line.strip() and not line.startswith('#')]
+    except FileNotFoundError:
+        lines = []
+    for parts in lines:
+        if len(parts) != 3:
+            continue
+        name, policy = parts[0], parts[1]
+        state = supervisor_state.get(name, {})
+        pid = read_pid(os.path.join(PROJECTS_LOG_DIR, f'{name}.pid'))
+        services[name] = {
+            'policy': policy,
+            'running': pid is not None,
+            'pid': pid,
+            'restarts': state.get('restarts'),
+            'last_exit_code': state.get('last_exit_code'),
+            'last_exit_at': state.get('last_exit_at'),
+            'next_restart_at': state.get('next_restart_at'),
+            'last_log_at': last_log_time(name),
+        }
+
+    disk = shutil.disk_usage(DISK_PATH) if os.path.exists(DISK_PATH) else shutil.disk_usage('/')
+    status = {
+        'updated_at': now,
+        'cron_running': process_running('cron'),
+        'scheduler_pid': scheduler_pid,
+        'supervisor_pid': supervisor_pid,
+        'disk_used_percent': round(disk.used * 100 / disk.total, 1),
+        'jobs': jobs,
+        'services': services,
+    }
+    status['problems'] = find_problems(status)
+    status['healthy'] = not status['problems']
+    return status
+
+
+def find_problems(status):
+    problems = []
+    if not status['cron_running'] and not status['scheduler_pid']:
+        problems.append('cron 服务和任务调度器均未运行')
+    for name, service in status['services'].items():
+        if service['policy'] == 'always' and not service['running'] and not service['next_restart_at']:
+            problems.append(f'后台服务 {name} 未运行')
+    if status['disk_used_percent'] >= DISK_UNHEALTHY_PERCENT:
+        problems.append(f"磁盘空间不足 (使用率: {status['disk_used_percent']}%)")
+    return problems
+
+
+def render_metrics(status):
+    lines = [
+        '# HELP cron_container_up 状态快照是否健康',
+        '# TYPE cron_container_up gauge',
+        f"cron_container_up {int(status['healthy'])}",
+        '# HELP cron_container_status_updated_timestamp_seconds 状态快照刷新时间',
+        '# TYPE cron_container_status_updated_timestamp_seconds gauge',
+        f"cron_container_status_updated_timestamp_seconds {status['updated_at']:.3f}",
+        '# TYPE cron_container_cron_running gauge',
+        f"cron_container_cron_running {int(status['cron_running'])}",
+        '# TYPE cron_container_scheduler_running gauge',
+        f"cron_container_scheduler_running {int(bool(status['scheduler_pid']))}",
+        '# TYPE cron_container_supervisor_running gauge',
+        f"cron_container_supervisor_running {int(bool(status['supervisor_pid']))}",
+        '# TYPE cron_container_disk_used_percent gauge',
+        f"cron_container_disk_used_percent {status['disk_used_percent']}",
+    ]
+
+    job_metrics = (
+        ('cron_job_running', 'gauge', 'running'),
+        ('cron_job_runs_total', 'counter', 'runs'),
+        ('cron_job_failures_total', 'counter', 'failures'),
+        ('cron_job_skipped_total', 'counter', 'skipped'),
+        ('cron_job_slow_runs_total', 'counter', 'slow_runs'),
+        ('cron_job_last_exit_code', 'gauge', 'last_exit_code'),
+        ('cron_job_last_duration_seconds', 'gauge', 'last_seconds'),
+        ('cron_job_duration_p50_seconds', 'gauge', 'duration_p50'),
+        ('cron_job_duration_p95_seconds', 'gauge', 'duration_p95'),
+        ('cron_job_peak_rss_bytes', 'gauge', 'peak_rss_bytes'),
+        ('cron_job_last_finished_timestamp_seconds', 'gauge', 'last_finished'),
+        ('cron_job_next_run_timestamp_seconds', 'gauge', 'next_run'),
+        ('cron_job_last_log_timestamp_seconds', 'gauge', 'last_log_at'),
+    )
+    for metric, metric_type, key in job_metrics:
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for name, job in status['jobs'].items():
+            if job[key] is not None:
+                lines.append(f'{metric}{{job="{name}"}} {job[key]}')
+
+    service_metrics = (
+        ('service_running', 'gauge', 'running'),
+        ('service_restarts_total', 'counter', 'restarts'),
+        ('service_last_exit_code', 'gauge', 'last_exit_code'),
+        ('service_last_log_timestamp_seconds', 'gauge', 'last_log_at'),
+    )
+    for metric, metric_type, key in service_metrics:
+        lines.append(f'# TYPE {metric} {metric_type}')
+        for name, service in status['services'].items():
+            value = service[key]
+            if value is not None:
+                lines.append(f'{metric}{{service="{name}",policy="{service["policy"]}"}} {int(value)}')
+
+    text = '\n'.join(lines) + '\n'
+    for directory in STATUS_TEXTFILE_DIRS:
+        for prom_file in sorted(glob.glob(os.path.join(directory, '*.prom'))):
+            try:
+                with open(prom_file, 'r') as f:
+                    text += f.read()
+            except OSError:
+                continue
+    return text
+
+
+class StatusServer:
+    def __init__(self, refresh_interval=STATUS_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.responses = {}
+
+    def build_responses(self, status):
+        """
+        每次刷新后预先生成全部响应，请求处理只做字典查找
+        """
+        def response(code, content_type, body):
+            body = body.encode('utf-8')
+            reason = {200: 'OK', 503: 'Service Unavailable'}[code]
+            header = (f'HTTP/1.1 {code} {reason}\r\nContent-Type: {content_type}\r\n'
+                      f'Content-Length: {len(body)}\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n')
+            return header.encode('ascii'), body
+
+        health = {
+            'status': 'healthy' if status['healthy'] else 'unhealthy',
+            'problems': status['problems'],
+            'updated_at': datetime.fromtimestamp(status['updated_at']).isoformat(timespec='seconds'),
+        }
+        health_code = 200 if status['healthy'] else 503
+        return {
+            '/health': response(health_code, 'application/json; charset=utf-8', json.dumps(health, ensure_ascii=False)),
+            '/status': response(200, 'application/json; charset=utf-8',
+                                json.dumps(status, ensure_ascii=False, indent=2)),
+            '/metrics': response(200, 'text/plain; version=0.0.4; charset=utf-8', render_metrics(status)),
+        }
+
+    async def refresh_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                status = await loop.run_in_executor(None, collect_status)
+                self.responses = self.build_responses(status)
+                if not status['healthy']:
+                    logger.warning(f"健康检查异常: {'; '.join(status['problems'])}")
+            except Exception as e:
+                logger.error(f"刷新状态失败: {str(e)}")
+            await asyncio.sleep(self.refresh_interval)
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            # 读完请求头，请求体忽略
+            while True:
+                line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) >= 2 else '/'
+            method = parts[0] if parts else 'GET'
+
+            if path == '/':
+                path = '/health'
+            if path not in self.responses:
+                body = b'Not Found' if self.responses else b'Starting'
+                code = b'404 Not Found' if self.responses else b'503 Service Unavailable'
+                writer.write(b'HTTP/1.1 ' + code + b'\r\nContent-Type: text/plain\r\nContent-Length: '
+                             + str(len(body)).encode() + b'\r\nConnection: close\r\n\r\n' + body)
+            else:
+                header, body = self.responses[path]
+                writer.write(header if method == 'HEAD' else header + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, reuse_address=True)
+        logger.info(f"状态服务已启动: http://{host}:{port} (刷新间隔 {self.refresh_interval} 秒)")
+        refresher = asyncio.create_task(self.refresh_forever())
+        async with server:
+            await server.serve_forever()
+        refresher.cancel()
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stdout
+    )
+    parser = argparse.ArgumentParser(description='容器状态/健康检查 HTTP 服务')
+    parser.add_argument('--host', default='0.0.0.0', help='监听地址')
+    parser.add_argument('--port', type=int, default=STATUS_PORT, help='监听端口')
+    args = parser.parse_args()
+    try:
+        asyncio.run(StatusServer().serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,7 @@ SYSTEM_LOG_DIR="$LOGS_DIR/system"
 PROJECTS_LOG_DIR="$LOGS_DIR/projects"
 SERVICES_CONF="$SYSTEM_LOG_DIR/services.conf"
 MONITOR_LOG="$SYSTEM_LOG_DIR/task_monitor.log"
+SUPERVISOR_PID_FILE="$SYSTEM_LOG_DIR/service_supervisor.pid"
 MONITOR_INTERVAL="${MONITOR_INTERVAL:-30}"
 
 # 创建必要目录
@@ -159,6 +160,11 @@ restart_background_service() {
 
 # 监控守护进程
 daemon_monitor() {
+    local supervisor_pid=$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)
+    if [[ -n "$supervisor_pid" ]] && kill -0 "$supervisor_pid" 2>/dev/null; then
+        log_error "服务监管进程正在运行 (PID: $supervisor_pid)，后台服务已由其管理，不再启动轮询监控"
+        return 1
+    fi
     log_info "启动监控守护进程 (间隔: ${MONITOR_INTERVAL}秒)"
     
     while true; do
@@ -229,7 +235,10 @@ show_status() {
     echo
     echo "监控器状态:"
     local monitor_pid_file="$SYSTEM_LOG_DIR/monitor.pid"
-    if [[ -f "$monitor_pid_file" ]]; then
+    local supervisor_pid=$(cat "$SUPERVISOR_PID_FILE" 2>/dev/null)
+    if [[ -n "$supervisor_pid" ]] && kill -0 "$supervisor_pid" 2>/dev/null; then
+        echo "  ✓ 服务监管进程运行中 (PID: $supervisor_pid)，详情: python3 /app/scripts/service_supervisor.py status"
+    elif [[ -f "$monitor_pid_file" ]]; then
         local monitor_pid=$(cat "$monitor_pid_file" 2>/dev/null)
         if [[ -n "$monitor_pid" ]] && kill -0 "$monitor_pid" 2>/dev/null; then
             echo "  ✓ 运行中 (PID: $monitor_pid)"
@@ -264,6 +273,35 @@ show_logs() {
     echo "================================================================"
 }
 
+# 按时间范围查询项目日志（包括已轮转压缩的日志段，通过时间索引直接定位）
+query_logs() {
+    local project_name="$1"
+    local since="$2"
+    local until="${3:-}"
+    
+    if [[ -z "$project_name" || -z "$since" ]]; then
+        log_error "请指定项目名称和开始时间"
+        return 1
+    fi
+    
+    local args=(query "$project_name" --since "$since")
+    if [[ -n "$until" ]]; then
+        args+=(--until "$until")
+    fi
+    python3 /app/scripts/log_store.py "${args[@]}"
+}
+
+# 显示执行记录：不指定项目时显示各项目耗时统计，指定项目时显示最近的执行
+show_history() {
+    local project_name="${1:-}"
+    
+    if [[ -n "$project_name" ]]; then
+        python3 /app/scripts/run_history.py history "$project_name" -n "${2:-20}"
+    else
+        python3 /app/scripts/run_history.py stats
+    fi
+}
+
 # 实时跟踪项目日志
 follow_logs() {
     local project_name="$1"
@@ -382,6 +420,9 @@ show_help() {
   daemon                      启动监控守护进程
   status                      显示所有任务状态
   logs <project_name> [lines] 查看项目日志 (默认50行)
+  query <project_name> <since> [until]
+                              按时间范围查询项目日志 (含已轮转日志)
+  history [project_name] [n]  执行记录 (耗时 p50/p95、失败和慢执行次数)
   follow <project_name>       实时跟踪项目日志
   restart <project_name>      重启指定项目
   health                      系统健康检查
@@ -391,6 +432,10 @@ show_help() {
   $0 daemon
   $0 status
   $0 logs task1 100
+  $0 query task1 "2025-09-01 08:00" "2025-09-01 09:00"
+  $0 query task1 2h
+  $0 history
+  $0 history task1 50
   $0 follow task1
   $0 restart task1
   $0 health
@@ -427,6 +472,12 @@ main() {
             local project_name="$1"
             follow_logs "$project_name"
             ;;
+        "query")
+            query_logs "$1" "${2:-}" "${3:-}"
+            ;;
+        "history")
+            show_history "${1:-}" "${2:-}"
+            ;;
         "restart")
             local project_name="$1"
             restart_project "$project_name"
@@ -63,6 +63,13 @@ if docker ps --filter "name=cron-tasks" --filter "status=running" | grep -q cron
             ;;
     esac
     
+    # 状态服务汇总（定时任务/后台服务的最近执行情况）
+    echo ""
+    log_info "状态服务 /health:"
+    docker exec cron-tasks curl -sS http://localhost:8080/health 2>/dev/null | sed 's/^/  /' || log_warn "状态服务无响应"
+    echo ""
+    echo "  完整状态: docker exec cron-tasks curl -s http://localhost:8080/status"
+    
     # 运行健康检查脚本
     echo ""
     log_info "执行详细健康检查..."
@@ -0,0 +1,522 @@
+"""
+同步流程离线基准测试，不连接生产 SQL Server 和 ClickHouse
+
+源库用 SQLite 模拟（兼容 pyodbc 的 cursor 接口，翻译同步代码用到的 T-SQL），
+ClickHouse 用只记录语句和行数的假客户端代替。每个场景在独立子进程中运行，
+统计 行/秒、各阶段耗时和峰值内存。
+
+用法:
+    python3 benchmark_sync.py --rows 200000 --types int,str,decimal,datetime,uuid,float --width 12
+    python3 benchmark_sync.py --scenarios query_paged,query_streaming --json result.json
+    python3 benchmark_sync.py --compare result.json --max-regression 0.1
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+
+SOURCE_TABLE = 'BenchSource'
+TARGET_TABLE = 'bench_target'
+
+# 类型名: (SQL Server 类型, max_length, precision, scale, SQLite 列类型, pyodbc 返回的 Python 类型)
+COLUMN_TYPES = {
+    'int': ('int', 4, 10, 0, 'INTEGER', int),
+    'bigint': ('bigint', 8, 19, 0, 'INTEGER', int),
+    'float': ('float', 8, 53, 0, 'REAL', float),
+    'decimal': ('decimal', 9, 18, 4, 'TEXT', Decimal),
+    'str': ('nvarchar', 200, 0, 0, 'TEXT', str),
+    'datetime': ('datetime', 8, 23, 3, 'TEXT', datetime),
+    'date': ('date', 3, 10, 0, 'TEXT', date),
+    # pyodbc 默认 native_uuid=False，uniqueidentifier 以字符串返回
+    'uuid': ('uniqueidentifier', 16, 0, 0, 'TEXT', str),
+}
+
+# 从 SQLite 读出后还原为 pyodbc 返回的 Python 类型
+VALUE_DECODERS = {
+    'decimal': Decimal,
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+}
+
+SchemaRow = namedtuple(
+    'SchemaRow', 'column_name data_type max_length precision scale is_nullable is_primary_key'
+)
+
+# 场景名: (同步函数, 参数)，新的同步实现在这里登记即可参与对比
+SCENARIOS = {
+    'query_paged': ('sync_from_query', {}),
+    'query_streaming': ('sync_from_query', {'streaming': True}),
+    'query_version': ('sync_from_query', {'load_strategy': 'version'}),
+    'query_staging': ('sync_from_query', {'load_strategy': 'staging'}),
+    'query_full_refresh': ('sync_from_query', {'full_refresh': True}),
+    'table_full': ('sync_table', {}),
+}
+DEFAULT_SCENARIOS = ['query_paged', 'query_streaming', 'query_full_refresh', 'table_full']
+
+STAGES = ('fetch', 'convert', 'delete', 'insert', 'checkpoint')
+
+
+class StageTimer:
+    """
+    按阶段累计耗时，流式模式下读取和写入在不同线程并行，各阶段之和可能超过总耗时
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.seconds[stage] += seconds
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return timed
+
+
+def build_column_specs(types, width):
+    """
+    第一列为 bigint 主键 Id，其余列按 types 循环填满 width 列
+    :return: [(列名, 类型名), ...]
+    """
+    columns = [('Id', 'bigint')]
+    for i in range(max(width - 1, 1)):
+        type_name = types[i % len(types)]
+        columns.append((f'c{i + 1}_{type_name}', type_name))
+    return columns
+
+
+def generate_value(type_name, rnd, str_len):
+    if type_name in ('int', 'bigint'):
+        return rnd.randint(0, 10 ** 9)
+    if type_name == 'float':
+        return rnd.random() * 10 ** 6
+    if type_name == 'decimal':
+        return str(Decimal(rnd.randint(0, 10 ** 10)).scaleb(-4))
+    if type_name == 'str':
+        return ''.join(rnd.choices(string.ascii_letters, k=str_len))
+    if type_name == 'datetime':
+        return (datetime(2024, 1, 1) + timedelta(seconds=rnd.randint(0, 10 ** 7))).isoformat()
+    if type_name == 'date':
+        return (date(2024, 1, 1) + timedelta(days=rnd.randint(0, 1000))).isoformat()
+    if type_name == 'uuid':
+        return str(uuid.UUID(int=rnd.getrandbits(128))).upper()
+    raise ValueError(f"不支持的列类型: {type_name}")
+
+
+def create_source_db(path, column_specs, rows, null_ratio, str_len, seed=42):
+    """
+    生成 SQLite 源库，非主键列按 null_ratio 写入 NULL
+    """
+    rnd = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.execute(f"DROP TABLE IF EXISTS {SOURCE_TABLE}")
+    db.execute(f"CREATE TABLE {SOURCE_TABLE} ("
+               + ', '.join(f'"{name}" {COLUMN_TYPES[type_name][4]}' for name, type_name in column_specs)
+               + ', PRIMARY KEY ("Id"))')
+    insert_sql = f"INSERT INTO {SOURCE_TABLE} VALUES ({', '.join('?' * len(column_specs))})"
+    chunk = []
+    for row_id in range(1, rows + 1):
+        row = [row_id]
+        for _, type_name in column_specs[1:]:
+            row.append(None if rnd.random() < null_ratio else generate_value(type_name, rnd, str_len))
+        chunk.append(row)
+        if len(chunk) >= 10000:
+            db.executemany(insert_sql, chunk)
+            chunk = []
+    if chunk:
+        db.executemany(insert_sql, chunk)
+    db.commit()
+    db.close()
+
+
+class FakeSqlServerCursor:
+    """
+    兼容 pyodbc cursor 的 SQLite 封装，只实现同步代码用到的语句
+    """
+
+    def __init__(self, db, column_specs, row_count, timer):
+        self.db = db
+        self.column_types = dict(column_specs)
+        self.column_specs = column_specs
+        self.row_count = row_count
+        self.timer = timer
+        self.description = None
+        self.showplan = False
+        self._cursor = None
+        self._rows = []
+        self._decoders = []
+
+    def _set_result(self, names, rows):
+        self._cursor = None
+        self._rows = list(rows)
+        self._decoders = []
+        self.description = [(name, str, None, None, None, None, True) for name in names]
+
+    def _describe(self, names):
+        description = []
+        for name in names:
+            sql_type, max_length, precision, scale, _, python_type = COLUMN_TYPES[self.column_types[name]]
+            description.append((name, python_type, None, max_length, precision, scale, name != 'Id'))
+        return description
+
+    def _translate(self, sql):
+        sql = re.sub(r'\[(\w+)\]', r'"\1"', sql)
+        sql = sql.replace('COUNT_BIG(', 'COUNT(')
+        # 源数据指纹只用于比较是否变化，基准测试中固定为空校验和
+        sql = sql.replace('CHECKSUM_AGG(BINARY_CHECKSUM(*))', 'NULL')
+        match = re.search(r'\bTOP\s*\(?(\d+)\)?', sql)
+        if match:
+            sql = sql[:match.start()] + sql[match.end():]
+            sql = sql.rstrip() + f' LIMIT {match.group(1)}'
+        return sql
+
+    def execute(self, sql, *params):
+        start = time.perf_counter()
+        try:
+            self._execute(sql, *params)
+        finally:
+            self.timer.add('fetch', time.perf_counter() - start)
+        return self
+
+    def _execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = tuple(params[0])
+        params = tuple(p.isoformat() if isinstance(p, (datetime, date)) else p for p in params)
+
+        if sql.startswith('SET SHOWPLAN_XML'):
+            self.showplan = sql.endswith('ON')
+            self._set_result([], [])
+            return
+        if self.showplan:
+            self._set_result(['plan'], [(f'<ShowPlanXML StatementEstRows="{self.row_count}"/>',)])
+            return
+        if 'sp_describe_first_result_set' in sql:
+            names = [d[0] for d in self.db.execute(f"SELECT * FROM ({self._translate(params[0])}) LIMIT 0").description]
+            rows = []
+            for name in names:
+                sql_type, max_length, precision, scale, _, _ = COLUMN_TYPES[self.column_types[name]]
+                rows.append((0, name, name != 'Id', sql_type, max_length, precision, scale))
+            self._set_result(['is_hidden', 'name', 'is_nullable', 'system_type_name', 'max_length', 'precision',
+                              'scale'], rows)
+            return
+        if 'sys.columns' in sql:
+            rows = [SchemaRow(name, COLUMN_TYPES[type_name][0], *COLUMN_TYPES[type_name][1:4], name != 'Id',
+                              name == 'Id')
+                    for name, type_name in self.column_specs]
+            self._set_result(SchemaRow._fields, rows)
+            return
+        if 'sys.change_tracking_tables' in sql:
+            self._set_result(['enabled'], [])
+            return
+        if 'dm_db_partition_stats' in sql or 'sys.partitions' in sql:
+            self._set_result(['rows'], [(self.row_count,)])
+            return
+
+        self._cursor = self.db.execute(self._translate(sql), params)
+        self._rows = None
+        names = [d[0] for d in self._cursor.description or []]
+        if all(name in self.column_types for name in names):
+            self.description = self._describe(names)
+            self._decoders = [(i, VALUE_DECODERS[self.column_types[name]]) for i, name in enumerate(names)
+                              if self.column_types[name] in VALUE_DECODERS]
+        else:
+            self.description = [(name, str, None, None, None, None, True) for name in names]
+            self._decoders = []
+
+    def _decode(self, rows):
+        if not self._decoders:
+            return rows
+        decoded = []
+        for row in rows:
+            row = list(row)
+            for i, decode in self._decoders:
+                if row[i] is not None:
+                    row[i] = decode(row[i])
+            decoded.append(tuple(row))
+        return decoded
+
+    def _fetch(self, size):
+        start = time.perf_counter()
+        try:
+            if self._rows is not None:
+                if size is None:
+                    rows, self._rows = self._rows, []
+                else:
+                    rows, self._rows = self._rows[:size], self._rows[size:]
+                return rows
+            rows = self._cursor.fetchall() if size is None else self._cursor.fetchmany(size)
+            return self._decode(rows)
+        finally:
+            self.timer.add('fetch', time.perf_counter() - start)
+
+    def fetchall(self):
+        return self._fetch(None)
+
+    def fetchmany(self, size):
+        return self._fetch(size)
+
+    def fetchone(self):
+        rows = self._fetch(1)
+        return rows[0] if rows else None
+
+    def close(self):
+        pass
+
+
+class FakeSqlServerConnection:
+    def __init__(self, path, column_specs, row_count, timer):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.column_specs = column_specs
+        self.row_count = row_count
+        self.timer = timer
+
+    def cursor(self):
+        return FakeSqlServerCursor(self.db, self.column_specs, self.row_count, self.timer)
+
+    def close(self):
+        self.db.close()
+
+
+class RecordingClickHouseClient:
+    """
+    只记录语句和写入行数的 ClickHouse 客户端，维护表结构以响应 system.columns 和 EXISTS 查询
+    """
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.tables = {}
+        self.statements = {}
+        self.rows_inserted = 0
+        self.lock = threading.Lock()
+
+    def execute(self, query, params=None, columnar=False, **kwargs):
+        start = time.perf_counter()
+        try:
+            with self.lock:
+                return self._execute(query.strip(), params, columnar)
+        finally:
+            if query.lstrip().startswith('INSERT'):
+                self.timer.add('insert', time.perf_counter() - start)
+
+    def _execute(self, query, params, columnar):
+        kind = ' '.join(query.split()[:2]).upper()
+        self.statements[kind] = self.statements.get(kind, 0) + 1
+
+        if query.startswith('EXISTS TABLE'):
+            return [(int(query.split()[-1] in self.tables),)]
+        if 'system.columns' in query:
+            return list(self.tables.get(params['table'], []))
+        if query.startswith('DROP TABLE IF EXISTS'):
+            self.tables.pop(query.split()[-1], None)
+            return []
+        if query.startswith('EXCHANGE TABLES'):
+            parts = query.split()
+            self.tables[parts[2]], self.tables[parts[4]] = self.tables[parts[4]], self.tables[parts[2]]
+            return []
+        if query.startswith('RENAME TABLE'):
+            for pair in query[len('RENAME TABLE'):].split(','):
+                old_name, _, new_name = pair.split()
+                self.tables[new_name] = self.tables.pop(old_name)
+            return []
+        match = re.match(r'CREATE TABLE (?:IF NOT EXISTS )?(\w+) AS (\w+)', query)
+        if match:
+            self.tables[match.group(1)] = list(self.tables.get(match.group(2), []))
+            return []
+        match = re.match(r'CREATE TABLE IF NOT EXISTS (\w+) \((.*)\) ENGINE', query, re.S)
+        if match and match.group(1) not in self.tables:
+            # system.columns 中的类型不带 CODEC 子句
+            self.tables[match.group(1)] = [
+                (name, re.sub(r'\s+CODEC\(.*\)$', '', ch_type))
+                for name, ch_type in re.findall(r'`(\w+)` ([^`]+?)\s*(?:,\s*(?=`)|$)', match.group(2).strip())
+            ]
+            return []
+        if query.startswith('ALTER TABLE') and 'ADD COLUMN' in query:
+            match = re.match(r'ALTER TABLE (\w+) ADD COLUMN IF NOT EXISTS `(\w+)` (\w+)', query)
+            columns = self.tables.setdefault(match.group(1), [])
+            if match.group(2) not in dict(columns):
+                columns.append((match.group(2), match.group(3)))
+            return []
+        if query.startswith('INSERT') and params is not None:
+            if columnar:
+                self.rows_inserted += len(params[0]) if params else 0
+            else:
+                self.rows_inserted += len(params)
+        return []
+
+    def disconnect(self):
+        pass
+
+
+def run_scenario(args):
+    """
+    子进程中执行单个场景，结果以 JSON 输出到 stdout
+    """
+    # 状态库和日志写到临时目录，必须在导入同步模块之前设置
+    os.environ['SYNC_DATA_DIR'] = args.work_dir
+    os.chdir(args.work_dir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    import ckmovedataeveryday as sync
+
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+    column_specs = [tuple(spec) for spec in json.loads(args.column_specs)]
+    timer = StageTimer()
+    sync.convert_batch_columnar = timer.wrap('convert', sync.convert_batch_columnar)
+    sync.delete_primary_keys = timer.wrap('delete', sync.delete_primary_keys)
+    sync.CheckpointStore.save_checkpoint = timer.wrap('checkpoint', sync.CheckpointStore.save_checkpoint)
+
+    sql_conn = FakeSqlServerConnection(args.source_db, column_specs, args.rows, timer)
+    ch_client = RecordingClickHouseClient(timer)
+    func_name, options = SCENARIOS[args.run_scenario]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if func_name == 'sync_table':
+        sync.sync_table(SOURCE_TABLE, batch_size=args.batch_size, sql_conn=sql_conn, ch_client=ch_client, **options)
+    else:
+        sync.sync_from_query(args.run_scenario, f"SELECT * FROM {SOURCE_TABLE}", TARGET_TABLE,
+                             primary_key_columns=['Id'], batch_size=args.batch_size, fetch_size=args.batch_size,
+                             sql_conn=sql_conn, ch_client=ch_client, **options)
+    elapsed = time.perf_counter() - start
+
+    stages = dict(timer.seconds)
+    stages['other'] = max(elapsed - sum(stages.values()), 0.0)
+    print(json.dumps({
+        'scenario': args.run_scenario,
+        'rows': ch_client.rows_inserted,
+        'seconds': elapsed,
+        'rows_per_sec': ch_client.rows_inserted / elapsed if elapsed else 0,
+        'stages': stages,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'baseline_rss_mb': rss_before / 1024,
+        'statements': ch_client.statements,
+    }))
+
+
+def print_results(results):
+    header = f"{'场景':<22}{'行数':>10}{'耗时(秒)':>10}{'行/秒':>12}{'峰值内存(MB)':>14}"
+    print(header + ''.join(f"{stage:>12}" for stage in STAGES + ('other',)))
+    for result in results:
+        line = (f"{result['scenario']:<22}{result['rows']:>10}{result['seconds']:>10.2f}"
+                f"{result['rows_per_sec']:>12.0f}{result['peak_rss_mb']:>14.1f}")
+        print(line + ''.join(f"{result['stages'][stage]:>12.2f}" for stage in STAGES + ('other',)))
+    print("注: 各阶段为累计耗时（秒），流式场景读取与写入并行，阶段之和可能大于总耗时")
+
+
+def compare_results(results, baseline_path, max_regression):
+    """
+    与基线结果比较 行/秒，下降超过 max_regression 的场景视为回归
+    :return: 是否存在回归
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {item['scenario']: item for item in json.load(f)['results']}
+    regressed = False
+    for result in results:
+        base = baseline.get(result['scenario'])
+        if not base or not base['rows_per_sec']:
+            continue
+        change = result['rows_per_sec'] / base['rows_per_sec'] - 1
+        flag = ''
+        if change < -max_regression:
+            flag = '  <-- 回归'
+            regressed = True
+        print(f"{result['scenario']:<22}基线 {base['rows_per_sec']:>10.0f} 行/秒, 本次 {result['rows_per_sec']:>10.0f} "
+              f"行/秒 ({change:+.1%}){flag}")
+    return regressed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='同步流程离线基准测试')
+    parser.add_argument('--rows', type=int, default=100000, help='源表行数')
+    parser.add_argument('--width', type=int, default=8, help='列数（含主键列）')
+    parser.add_argument('--types', default='int,str,decimal,datetime,uuid,float',
+                        help=f"非主键列的类型，循环使用，可选 {','.join(COLUMN_TYPES)}")
+    parser.add_argument('--str-len', type=int, default=24, help='字符串列的长度')
+    parser.add_argument('--null-ratio', type=float, default=0.05, help='非主键列中 NULL 的比例')
+    parser.add_argument('--batch-size', type=int, default=50000, help='每批行数（流式场景为 fetch_size）')
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f"要运行的场景，可选 {','.join(SCENARIOS)}")
+    parser.add_argument('--repeat', type=int, default=3, help='每个场景重复次数，取 行/秒 最高的一次')
+    parser.add_argument('--log-level', default='WARNING', help='同步模块的日志级别')
+    parser.add_argument('--json', help='结果写入 JSON 文件，可作为之后 --compare 的基线')
+    parser.add_argument('--compare', help='与基线 JSON 文件比较')
+    parser.add_argument('--max-regression', type=float, default=0.1, help='允许的 行/秒 下降比例')
+    # 以下参数仅供子进程使用
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    parser.add_argument('--work-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--source-db', help=argparse.SUPPRESS)
+    parser.add_argument('--column-specs', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.run_scenario:
+        run_scenario(args)
+        return
+
+    types = args.types.split(',')
+    unknown = [name for name in types if name not in COLUMN_TYPES]
+    scenarios = args.scenarios.split(',')
+    unknown += [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"未知的列类型或场景: {', '.join(unknown)}")
+
+    column_specs = build_column_specs(types, args.width)
+    with tempfile.TemporaryDirectory(prefix='sync_bench_') as temp_dir:
+        source_db = os.path.join(temp_dir, 'source.db')
+        start = time.perf_counter()
+        create_source_db(source_db, column_specs, args.rows, args.null_ratio, args.str_len)
+        print(f"生成源表 {args.rows} 行 x {len(column_specs)} 列，耗时 {time.perf_counter() - start:.1f} 秒")
+
+        results = []
+        for scenario in scenarios:
+            best = None
+            for _ in range(args.repeat):
+                # 每次运行使用独立的状态目录，避免断点和水位影响结果
+                work_dir = tempfile.mkdtemp(dir=temp_dir)
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--run-scenario', scenario, '--work-dir', work_dir,
+                     '--source-db', source_db, '--column-specs', json.dumps(column_specs), '--rows', str(args.rows),
+                     '--batch-size', str(args.batch_size), '--log-level', args.log_level],
+                    capture_output=True, text=True
+                )
+                if output.returncode != 0:
+                    sys.exit(f"场景 {scenario} 运行失败:\n{output.stderr}")
+                result = json.loads(output.stdout.strip().splitlines()[-1])
+                if best is None or result['rows_per_sec'] > best['rows_per_sec']:
+                    best = result
+            results.append(best)
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': {key: value for key, value in vars(args).items() if value is not None},
+                       'results': results}, f, ensure_ascii=False, indent=2)
+
+    if args.compare and compare_results(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,20 @@
 import pyodbc
+import argparse
+import gzip
+import hashlib
+import json
+import pickle
+import queue
+import re
+import sqlite3
+import uuid
+import threading
 import time
 from clickhouse_driver import Client
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack, contextmanager
+from decimal import Decimal
+from datetime import datetime, date, time as dt_time, timedelta
 import logging
 import requests
 import sys
@@ -13,7 +26,7 @@ os.environ['OPENSSL_CONF'] = '/etc/ssl/tls1.cnf'
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s',
     filename='sync_log.log'
 )
 
@@ -81,10 +94,11 @@ SQLSERVER_TO_CLICKHOUSE_TYPE_MAP = {
     'nchar': 'String',
     'nvarchar': 'String',
     'ntext': 'String',
-    'date': 'Date',
-    'datetime': 'DateTime',
+    # Date/DateTime 从 1970 年开始，SQL Server 中常见 1900-01-01 等更早的值，使用范围更大的 Date32/DateTime64
+    'date': 'Date32',
+    'datetime': 'DateTime64(3)',
     'datetime2': 'DateTime64',
-    'smalldatetime': 'DateTime',
+    'smalldatetime': 'DateTime64(0)',
     'time': 'String',
     'binary': 'String',
     'varbinary': 'String',
@@ -93,6 +107,75 @@ SQLSERVER_TO_CLICKHOUSE_TYPE_MAP = {
     'xml': 'String'
 }
 
+# 同步状态（断点、水位、指纹）保存目录
+SYNC_DATA_DIR = os.environ.get('SYNC_DATA_DIR', '/app/data')
+CHECKPOINT_DB = os.path.join(SYNC_DATA_DIR, 'sync_checkpoints.db')
+
+# 单个同步任务失败后的重试次数，重试时从断点继续
+SYNC_JOB_RETRIES = int(os.environ.get('SYNC_JOB_RETRIES', 2))
+
+# 每个数据源同时执行的同步任务数，同时也是该数据源连接池的大小
+MAX_WORKERS_PER_SOURCE = int(os.environ.get('SYNC_WORKERS_PER_SOURCE', 2))
+
+# sync_configs 中可直接传给 sync_from_query 的可选参数
+SYNC_OPTION_KEYS = ('batch_size', 'streaming', 'fetch_size', 'queue_size', 'load_strategy', 'version_column',
+                    'typed_columns', 'full_refresh', 'job_id', 'spool', 'optimize_storage', 'partition_column',
+                    'partition_date', 'shards')
+
+# 大视图按主键范围拆分的分片数：每个分片单独的 SQL Server 和 ClickHouse 连接，并发读取和写入，断点按分片记录
+# 同一数据源的会话数最多为 SYNC_WORKERS_PER_SOURCE × SYNC_SHARDS
+SYNC_SHARDS = int(os.environ.get('SYNC_SHARDS', 4))
+
+# 加载策略：
+#   delete  - 每批先 ALTER TABLE DELETE 旧主键再插入（原有方式，会产生 mutation）
+#   version - 追加写入并带版本列，由 ReplacingMergeTree 按版本去重，不产生 mutation
+#   staging - 先写入临时表，全部完成后一次 INSERT SELECT 合并到目标表
+#   partition - 按天同步的任务：目标表按分区列按天分区（toYYYYMMDD），当天数据写入结构相同的临时表后
+#               REPLACE PARTITION 只替换这一天的分区，重跑不会产生重复数据；已有的表分区键不符时自动重建
+LOAD_STRATEGIES = ('delete', 'version', 'staging', 'partition')
+SYNC_VERSION_COLUMN = '_sync_version'
+STAGING_TABLE_SUFFIX = '__staging'
+
+# 同步指标输出目录：Prometheus textfile（供 node_exporter textfile collector 采集）和每次运行的 JSON 汇总
+SYNC_METRICS_DIR = os.environ.get('SYNC_METRICS_DIR', os.path.join(SYNC_DATA_DIR, 'metrics'))
+SYNC_METRICS_PROM_FILE = 'ckmovedata.prom'
+SYNC_STAGES = ('fetch', 'convert', 'delete', 'insert')
+
+# ClickHouse 定长类型在 Native 格式中的字节数，用于估算写入量
+CLICKHOUSE_TYPE_WIDTHS = {
+    'UInt8': 1, 'Int8': 1, 'UInt16': 2, 'Int16': 2, 'UInt32': 4, 'Int32': 4, 'UInt64': 8, 'Int64': 8,
+    'Float32': 4, 'Float64': 8, 'Date': 2, 'Date32': 4, 'DateTime': 4, 'DateTime64': 8, 'UUID': 16,
+}
+
+# ClickHouse 日期类型的取值范围，超出范围的值写入前截断到边界
+CLICKHOUSE_DATE_RANGES = {
+    'Date': (date(1970, 1, 1), date(2149, 6, 6)),
+    'Date32': (date(1900, 1, 1), date(2299, 12, 31)),
+    'DateTime': (datetime(1970, 1, 1), datetime(2106, 2, 7)),
+    'DateTime64': (datetime(1900, 1, 1), datetime(2299, 12, 31, 23, 59, 59)),
+}
+
+# 建表时按源数据选择存储方式：采样 COLUMN_STATS_SAMPLE_ROWS 行，不同值不超过 LOW_CARDINALITY_MAX_DISTINCT
+# 且不超过采样行数一半的字符串列使用 LowCardinality，日期和整数列使用 Delta + ZSTD，其余使用 ZSTD
+SYNC_OPTIMIZE_STORAGE = os.environ.get('SYNC_OPTIMIZE_STORAGE', 'true').lower() in ('true', '1', 'yes')
+COLUMN_STATS_SAMPLE_ROWS = int(os.environ.get('COLUMN_STATS_SAMPLE_ROWS', 100000))
+LOW_CARDINALITY_MAX_DISTINCT = int(os.environ.get('LOW_CARDINALITY_MAX_DISTINCT', 10000))
+STRING_SQL_TYPES = ('char', 'varchar', 'nchar', 'nvarchar')
+DELTA_CODEC_TYPES = ('Int16', 'UInt16', 'Int32', 'UInt32', 'Int64', 'UInt64', 'Date', 'Date32', 'DateTime',
+                     'DateTime64')
+# 按月分区的日期列（存在且为日期类型时使用），sync_configs 可用 partition_column 指定其他列或置为空字符串关闭
+PARTITION_DATE_COLUMNS = ('TransferDate',)
+MIGRATE_TABLE_SUFFIX = '__migrate'
+
+# 全量刷新的维表：写入影子表后整表交换，源数据未变化时跳过
+FULL_REFRESH_TABLES = ['CustomerService', 'CustomerCompany', 'AirWayPreCode', 'AIRWAYCLASS']
+SHADOW_TABLE_SUFFIX = '__shadow'
+
+# 落盘暂存：抽取的批次先写入本地压缩文件，再由加载阶段重试写入 ClickHouse
+SYNC_SPOOL_DIR = os.environ.get('SYNC_SPOOL_DIR', os.path.join(SYNC_DATA_DIR, 'spool'))
+SPOOL_LOAD_RETRIES = int(os.environ.get('SPOOL_LOAD_RETRIES', 5))
+SPOOL_MANIFEST_FILE = 'manifest.json'
+
 
 def get_sqlserver_connection(source_name=None):
     """
@@ -131,17 +214,538 @@ def get_clickhouse_connection():
     )
 
 
-def get_last_sync_time(table_name):
+def close_connection(conn):
+    try:
+        if hasattr(conn, 'disconnect'):
+            conn.disconnect()
+        else:
+            conn.close()
+    except Exception as e:
+        logging.warning(f"关闭连接失败: {str(e)}")
+
+
+class ConnectionPool:
+    """
+    线程安全的连接池，连接使用完归还后被后续任务复用
+    使用中出错的连接直接丢弃，避免把失效连接交给下一个任务
+    """
+
+    def __init__(self, name, factory, max_size):
+        self.name = name
+        self.factory = factory
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    @contextmanager
+    def connection(self, blocking=True):
+        """
+        :param blocking: 为 False 时没有空闲名额不等待，返回 None
+        """
+        if not self._slots.acquire(blocking):
+            yield None
+            return
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                logging.info(f"连接池 {self.name} 新建连接")
+                conn = self.factory()
+        except Exception:
+            self._slots.release()
+            raise
+
+        healthy = True
+        try:
+            yield conn
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            if healthy:
+                self._idle.put(conn)
+            else:
+                close_connection(conn)
+            self._slots.release()
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            close_connection(conn)
+
+
+def encode_state_value(value):
+    """
+    将断点键值等状态序列化为 JSON，datetime/Decimal/bytes 等类型带类型标记以便原样还原
+    """
+    def encode_special(obj):
+        if isinstance(obj, datetime):
+            return {'$datetime': obj.isoformat()}
+        if isinstance(obj, date):
+            return {'$date': obj.isoformat()}
+        if isinstance(obj, Decimal):
+            return {'$decimal': str(obj)}
+        if isinstance(obj, (bytes, bytearray)):
+            return {'$bytes': bytes(obj).hex()}
+        if isinstance(obj, uuid.UUID):
+            return {'$uuid': str(obj)}
+        raise TypeError(f"无法序列化的类型: {type(obj)}")
+
+    return json.dumps(value, default=encode_special, sort_keys=True)
+
+
+def decode_state_value(text):
+    decoders = {
+        '$datetime': datetime.fromisoformat,
+        '$date': date.fromisoformat,
+        '$decimal': Decimal,
+        '$bytes': bytes.fromhex,
+        '$uuid': uuid.UUID,
+    }
+
+    def decode_special(obj):
+        if len(obj) == 1:
+            key, value = next(iter(obj.items()))
+            if key in decoders:
+                return decoders[key](value)
+        return obj
+
+    return json.loads(text, object_hook=decode_special)
+
+
+class CheckpointStore:
+    """
+    基于 SQLite 的同步状态存储
+    checkpoints: 每个任务最后一个已写入批次的键值，每批提交一次，任务完成后清除
+    watermarks:  增量同步水位、全量刷新指纹等跨次运行的状态
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    job_id TEXT PRIMARY KEY,
+                    last_key TEXT NOT NULL,
+                    rows_done INTEGER NOT NULL,
+                    context TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    name TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_stats (
+                    job_key TEXT NOT NULL,
+                    rows_synced INTEGER NOT NULL,
+                    seconds REAL NOT NULL,
+                    finished_at TEXT NOT NULL
+                )
+            """)
+
+    def get_checkpoint(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_key, rows_done, context FROM checkpoints WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            'last_key': tuple(decode_state_value(row[0])),
+            'rows': row[1],
+            'context': decode_state_value(row[2]),
+        }
+
+    def save_checkpoint(self, job_id, last_key, rows_done, context):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints (job_id, last_key, rows_done, context, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, encode_state_value(list(last_key)), rows_done, encode_state_value(context),
+                 datetime.now().isoformat())
+            )
+
+    def clear_checkpoint(self, job_id):
+        # 分片同步时各分片的断点为 <job_id>#<序号>，一并清除
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM checkpoints WHERE job_id = ? OR substr(job_id, 1, ?) = ?",
+                               (job_id, len(job_id) + 1, f"{job_id}#"))
+
+    def get_watermark(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM watermarks WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def save_watermark(self, name, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watermarks (name, value, updated_at) VALUES (?, ?, ?)",
+                (name, value, datetime.now().isoformat())
+            )
+
+    def record_job_stats(self, job_key, rows_synced, seconds):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO job_stats (job_key, rows_synced, seconds, finished_at) VALUES (?, ?, ?, ?)",
+                (job_key, rows_synced, seconds, datetime.now().isoformat())
+            )
+
+    def get_throughput(self, job_key, recent_runs=10):
+        """
+        :return: 最近几次运行的平均吞吐（行/秒），没有历史记录时返回None
+        """
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT SUM(rows_synced), SUM(seconds) FROM (
+                    SELECT rows_synced, seconds FROM job_stats
+                    WHERE job_key = ? AND rows_synced > 0
+                    ORDER BY finished_at DESC LIMIT ?
+                )
+            """, (job_key, recent_runs)).fetchone()
+        if not row or not row[0] or not row[1]:
+            return None
+        return row[0] / row[1]
+
+
+_checkpoint_store = None
+_checkpoint_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    global _checkpoint_store
+    with _checkpoint_store_lock:
+        if _checkpoint_store is None:
+            _checkpoint_store = CheckpointStore(CHECKPOINT_DB)
+        return _checkpoint_store
+
+
+def read_legacy_state_file(filename):
+    """
+    读取旧版本写在当前目录下的 last_sync_*.txt 等状态文件，迁移到 CheckpointStore 之前的数据仍然有效
+    """
     try:
-        with open(f'last_sync_{table_name}.txt', 'r') as f:
-            return datetime.fromisoformat(f.read().strip())
+        with open(filename, 'r') as f:
+            return f.read().strip()
     except FileNotFoundError:
-        return datetime(2023, 1, 1)  # 如果文件不存在，默认从 2023-10-01 开始
+        return None
+
+
+def get_last_sync_time(table_name):
+    value = get_checkpoint_store().get_watermark(f'time:{table_name}')
+    if value is None:
+        value = read_legacy_state_file(f'last_sync_{table_name}.txt')
+    if value is None:
+        return datetime(2023, 1, 1)  # 如果没有记录，默认从 2023-01-01 开始
+    return datetime.fromisoformat(value)
 
 
 def save_last_sync_time(table_name, sync_time):
-    with open(f'last_sync_{table_name}.txt', 'w') as f:
-        f.write(sync_time.isoformat())
+    get_checkpoint_store().save_watermark(f'time:{table_name}', sync_time.isoformat())
+
+
+def get_last_sync_version(table_name):
+    """
+    读取增量同步的版本水位：Change Tracking 版本号为整数，rowversion 以 0x 开头的十六进制保存
+    """
+    value = get_checkpoint_store().get_watermark(f'version:{table_name}')
+    if value is None:
+        value = read_legacy_state_file(f'last_sync_version_{table_name}.txt')
+    if value is None:
+        return None
+    if value.startswith('0x'):
+        return bytes.fromhex(value[2:])
+    return int(value)
+
+
+def save_last_sync_version(table_name, version):
+    if isinstance(version, (bytes, bytearray)):
+        value = '0x' + bytes(version).hex()
+    else:
+        value = str(version)
+    get_checkpoint_store().save_watermark(f'version:{table_name}', value)
+
+
+def get_last_fingerprint(table_name):
+    value = get_checkpoint_store().get_watermark(f'fingerprint:{table_name}')
+    if value is None:
+        value = read_legacy_state_file(f'last_fingerprint_{table_name}.txt')
+    return value
+
+
+def save_last_fingerprint(table_name, fingerprint):
+    get_checkpoint_store().save_watermark(f'fingerprint:{table_name}', fingerprint)
+
+
+def get_source_fingerprint(sql_cursor, sql_query):
+    """
+    计算源数据指纹（校验和 + 行数），只需一次聚合查询
+    注意 BINARY_CHECKSUM(*) 会忽略 text/ntext/image/xml 列
+    :return: 指纹字符串，计算失败时返回None
+    """
+    try:
+        sql_cursor.execute(f"SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)), COUNT_BIG(*) FROM ({sql_query}) AS t")
+        checksum, row_count = sql_cursor.fetchone()
+        return f"{checksum}:{row_count}"
+    except Exception as e:
+        logging.warning(f"计算源数据指纹失败，将直接全量刷新: {str(e)}")
+        return None
+
+
+def clickhouse_table_exists(ch_client, table_name):
+    return bool(ch_client.execute(f"EXISTS TABLE {table_name}")[0][0])
+
+
+def swap_shadow_table(ch_client, target_table, shadow_table=None):
+    """
+    用影子表原子替换目标表，替换前目标表数据一直可查
+    """
+    shadow_table = shadow_table or f"{target_table}{SHADOW_TABLE_SUFFIX}"
+    if not clickhouse_table_exists(ch_client, target_table):
+        ch_client.execute(f"RENAME TABLE {shadow_table} TO {target_table}")
+        logging.info(f"影子表 {shadow_table} 已重命名为 {target_table}")
+        return
+
+    try:
+        ch_client.execute(f"EXCHANGE TABLES {target_table} AND {shadow_table}")
+    except Exception as e:
+        # Ordinary 数据库引擎不支持 EXCHANGE，退回为一条 RENAME 语句完成交换
+        logging.warning(f"EXCHANGE TABLES 失败，改用 RENAME: {str(e)}")
+        old_table = f"{target_table}__old"
+        ch_client.execute(f"DROP TABLE IF EXISTS {old_table}")
+        ch_client.execute(f"RENAME TABLE {target_table} TO {old_table}, {shadow_table} TO {target_table}")
+        shadow_table = old_table
+
+    ch_client.execute(f"DROP TABLE IF EXISTS {shadow_table}")
+    logging.info(f"表 {target_table} 已切换为新数据")
+
+
+@contextmanager
+def measure_stage(timings, stage):
+    """
+    累计代码块耗时到 timings[stage]
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def format_prometheus_labels(**values):
+    parts = []
+    for key, value in values.items():
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{escaped}"')
+    return '{' + ','.join(parts) + '}'
+
+
+class JobMetrics:
+    """
+    单个同步任务的逐批次指标：读取、转换、删除、写入耗时以及行数和估算字节数
+    读取在 iter_batches 中计时，耗时随批次一起传给加载端，流式读写和分片并发时不会错位
+    """
+
+    def __init__(self, name, source_name=None, target_table=None):
+        self.name = name
+        self.source_name = source_name
+        self.target_table = target_table
+        self.status = 'running'
+        self.error = None
+        self.attempts = 0
+        self.started_at = None
+        self.finished_at = None
+        self.rows = 0
+        self.bytes = 0
+        self.stages = dict.fromkeys(SYNC_STAGES, 0.0)
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def iter_batches(self, batches):
+        """
+        :return: (批次, 读取耗时秒数) 的迭代器，读取耗时放入该批次 record_batch 的 timings['fetch']
+        """
+        iterator = iter(batches)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch_data = next(iterator)
+            except StopIteration:
+                return
+            yield batch_data, time.perf_counter() - start
+
+    def record_batch(self, rows, size, timings):
+        """
+        记录一个批次，每个由 iter_batches 产生的批次调用一次
+        """
+        with self._lock:
+            self.rows += rows
+            self.bytes += size
+            for stage, seconds in timings.items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            self.batches.append({'rows': rows, 'bytes': size,
+                                 **{stage: round(seconds, 6) for stage, seconds in timings.items()}})
+
+    def add_timings(self, timings):
+        """
+        累计不对应抽取批次的耗时，如落盘暂存后加载阶段的删除和写入
+        """
+        with self._lock:
+            for stage, seconds in timings.items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def start(self):
+        self.attempts += 1
+        if self.started_at is None:
+            self.started_at = time.time()
+
+    def finish(self, status, error=None):
+        # 同步函数内部标记为 skipped 的任务保持跳过状态
+        if not (status == 'success' and self.status == 'skipped'):
+            self.status = status
+        self.error = error
+        self.finished_at = time.time()
+
+    @property
+    def seconds(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def to_dict(self):
+        seconds = self.seconds
+        return {
+            'name': self.name,
+            'source_name': self.source_name,
+            'target_table': self.target_table,
+            'status': self.status,
+            'error': self.error,
+            'attempts': self.attempts,
+            'seconds': round(seconds, 3),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_sec': round(self.rows / seconds, 1) if seconds else 0,
+            'stages': {stage: round(value, 3) for stage, value in self.stages.items()},
+            'batches': self.batches,
+        }
+
+
+class SyncRunMetrics:
+    """
+    一次运行中所有同步任务的指标，结束后导出 Prometheus textfile 和 JSON 汇总
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def job(self, name, source_name=None, target_table=None):
+        with self._lock:
+            if name not in self.jobs:
+                self.jobs[name] = JobMetrics(name, source_name, target_table)
+            return self.jobs[name]
+
+    def summary(self):
+        jobs = [job.to_dict() for job in self.jobs.values()]
+        sources = {}
+        for job in jobs:
+            source = sources.setdefault(job['source_name'], {
+                'rows': 0, 'bytes': 0, 'jobs': 0, 'failed_jobs': 0, 'stages': dict.fromkeys(SYNC_STAGES, 0.0)
+            })
+            source['rows'] += job['rows']
+            source['bytes'] += job['bytes']
+            source['jobs'] += 1
+            source['failed_jobs'] += job['status'] == 'failed'
+            for stage, seconds in job['stages'].items():
+                source['stages'][stage] = round(source['stages'].get(stage, 0.0) + seconds, 3)
+        finished_at = self.finished_at or time.time()
+        return {
+            'started_at': datetime.fromtimestamp(self.started_at).isoformat(),
+            'finished_at': datetime.fromtimestamp(finished_at).isoformat(),
+            'seconds': round(finished_at - self.started_at, 3),
+            'rows': sum(job['rows'] for job in jobs),
+            'failed_jobs': [job['name'] for job in jobs if job['status'] == 'failed'],
+            'sources': sources,
+            'jobs': jobs,
+        }
+
+    def to_prometheus(self, summary):
+        labels = format_prometheus_labels
+        metrics = [
+            ('sync_job_rows', 'gauge', '本次运行各任务写入的行数',
+             [(labels(job=job['name'], source=job['source_name']), job['rows']) for job in summary['jobs']]),
+            ('sync_job_bytes', 'gauge', '本次运行各任务写入的估算字节数',
+             [(labels(job=job['name'], source=job['source_name']), job['bytes']) for job in summary['jobs']]),
+            ('sync_job_batches', 'gauge', '本次运行各任务的批次数',
+             [(labels(job=job['name'], source=job['source_name']), len(job['batches'])) for job in summary['jobs']]),
+            ('sync_job_duration_seconds', 'gauge', '各任务耗时',
+             [(labels(job=job['name'], source=job['source_name']), job['seconds']) for job in summary['jobs']]),
+            ('sync_job_rows_per_second', 'gauge', '各任务吞吐',
+             [(labels(job=job['name'], source=job['source_name']), job['rows_per_sec']) for job in summary['jobs']]),
+            ('sync_job_stage_seconds', 'gauge', '各任务各阶段累计耗时',
+             [(labels(job=job['name'], source=job['source_name'], stage=stage), seconds)
+              for job in summary['jobs'] for stage, seconds in job['stages'].items()]),
+            ('sync_job_success', 'gauge', '任务是否成功（跳过视为成功）',
+             [(labels(job=job['name'], source=job['source_name']), int(job['status'] in ('success', 'skipped')))
+              for job in summary['jobs']]),
+            ('sync_job_attempts', 'gauge', '任务执行次数（含重试）',
+             [(labels(job=job['name'], source=job['source_name']), job['attempts']) for job in summary['jobs']]),
+            ('sync_source_rows', 'gauge', '本次运行各数据源写入的行数',
+             [(labels(source=source), values['rows']) for source, values in summary['sources'].items()]),
+            ('sync_source_stage_seconds', 'gauge', '各数据源各阶段累计耗时',
+             [(labels(source=source, stage=stage), seconds)
+              for source, values in summary['sources'].items() for stage, seconds in values['stages'].items()]),
+            ('sync_run_duration_seconds', 'gauge', '本次运行总耗时', [('', summary['seconds'])]),
+            ('sync_run_failed_jobs', 'gauge', '本次运行失败的任务数', [('', len(summary['failed_jobs']))]),
+            ('sync_run_finished_timestamp_seconds', 'gauge', '本次运行结束时间',
+             [('', round(self.finished_at or time.time()))]),
+        ]
+        lines = []
+        for name, metric_type, help_text, samples in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{name}{label} {value}" for label, value in samples)
+        return '\n'.join(lines) + '\n'
+
+    def export(self, metrics_dir=None):
+        """
+        写入 JSON 汇总和 Prometheus textfile，先写临时文件再改名，采集方不会读到半个文件
+        """
+        self.finished_at = self.finished_at or time.time()
+        metrics_dir = metrics_dir or SYNC_METRICS_DIR
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            summary = self.summary()
+            run_name = datetime.fromtimestamp(self.started_at).strftime('%Y%m%d_%H%M%S')
+            files = [
+                (f'sync_run_{run_name}.json', json.dumps(summary, ensure_ascii=False, indent=2)),
+                ('sync_run_latest.json', json.dumps(summary, ensure_ascii=False, indent=2)),
+                (SYNC_METRICS_PROM_FILE, self.to_prometheus(summary)),
+            ]
+            for filename, content in files:
+                path = os.path.join(metrics_dir, filename)
+                with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+                    f.write(content)
+                os.replace(f'{path}.tmp', path)
+            logging.info(f"同步指标已写入 {metrics_dir}")
+            return summary
+        except Exception as e:
+            logging.warning(f"写入同步指标失败: {str(e)}")
+            return None
 
 
 def get_table_schema(sql_cursor, table_name):
@@ -186,60 +790,905 @@ def get_clickhouse_type(sql_type, max_length, precision, scale):
     return SQLSERVER_TO_CLICKHOUSE_TYPE_MAP.get(base_type, 'String')
 
 
-def create_clickhouse_table(ch_client, table_name, schema, primary_key_columns=None):
-    columns = []
-    schema_primary_keys = []
+def get_sqlserver_type_from_description(type_code, precision, scale):
+    """
+    根据 pyodbc cursor.description 中的 Python 类型还原 SQL Server 类型名
+    """
+    if type_code is bool:
+        return 'bit'
+    if type_code is int:
+        if precision and precision <= 3:
+            return 'tinyint'
+        if precision and precision <= 5:
+            return 'smallint'
+        if precision and precision <= 10:
+            return 'int'
+        return 'bigint'
+    if type_code is float:
+        return 'real' if precision and precision <= 24 else 'float'
+    if type_code is Decimal:
+        return 'decimal'
+    if type_code is datetime:
+        if not scale:
+            return 'smalldatetime'
+        return 'datetime' if scale <= 3 else 'datetime2'
+    if type_code is date:
+        return 'date'
+    if type_code is dt_time:
+        return 'time'
+    if type_code in (bytes, bytearray):
+        return 'varbinary'
+    if type_code is uuid.UUID:
+        return 'uniqueidentifier'
+    return 'nvarchar'
+
+
+def describe_query_columns(sql_cursor, sql_query):
+    """
+    获取查询结果的列信息，不读取任何数据
+    优先使用 sp_describe_first_result_set（SQL Server 2012+），不可用时退回 SELECT TOP 0 的 cursor.description
+    :return: [(列名, SQL Server类型, max_length, precision, scale, 是否可空), ...]
+    """
+    try:
+        sql_cursor.execute("EXEC sp_describe_first_result_set @tsql = ?", (sql_query,))
+        field_names = [column[0] for column in sql_cursor.description]
+        column_infos = []
+        for row in sql_cursor.fetchall():
+            info = dict(zip(field_names, row))
+            if info.get('is_hidden'):
+                continue
+            column_infos.append((
+                info['name'],
+                info['system_type_name'].split('(')[0],
+                info['max_length'],
+                info['precision'],
+                info['scale'],
+                bool(info['is_nullable']),
+            ))
+        if column_infos:
+            return column_infos
+    except Exception as e:
+        logging.info(f"sp_describe_first_result_set 不可用，改用 SELECT TOP 0 获取列信息: {str(e)}")
 
-    for col in schema:
-        column_name = col.column_name
-        ch_type = get_clickhouse_type(col.data_type, col.max_length, col.precision, col.scale)
-        nullable = 'Nullable(' + ch_type + ')' if col.is_nullable else ch_type
-        columns.append(f"`{column_name}` {nullable}")
+    sql_cursor.execute(f"SELECT TOP 0 * FROM ({sql_query}) AS t")
+    return [
+        (name, get_sqlserver_type_from_description(type_code, precision, scale), internal_size, precision, scale,
+         bool(null_ok))
+        for name, type_code, _, internal_size, precision, scale, null_ok in sql_cursor.description
+    ]
 
-        if col.is_primary_key:
-            schema_primary_keys.append(column_name)
 
-    # 使用指定的主键或从 schema 中获取的主键
-    primary_keys = primary_key_columns or schema_primary_keys or [schema[0].column_name]
+def sample_distinct_counts(sql_cursor, sql_query, columns, sample_rows=COLUMN_STATS_SAMPLE_ROWS):
+    """
+    统计查询结果前 sample_rows 行中各列的不同值个数，一次查询完成
+    :return: (采样行数, {列名: 不同值个数})，统计失败时返回 (0, {})
+    """
+    if not columns:
+        return 0, {}
+    distinct_columns = ', '.join(f"COUNT(DISTINCT [{col}])" for col in columns)
+    try:
+        sql_cursor.execute(f"SELECT COUNT_BIG(*), {distinct_columns} "
+                           f"FROM (SELECT TOP ({int(sample_rows)}) * FROM ({sql_query}) AS q) AS s")
+        row = sql_cursor.fetchone()
+    except Exception as e:
+        logging.warning(f"采样统计列的不同值个数失败，不使用 LowCardinality: {str(e)}")
+        return 0, {}
+    return int(row[0]), dict(zip(columns, row[1:]))
+
+
+def optimize_column_types(sql_cursor, sql_query, column_infos, column_types, primary_key_columns):
+    """
+    根据源数据采样统计，把低基数的字符串列改为 LowCardinality
+    :return: [(列名, ClickHouse类型), ...]
+    """
+    # max_length 为 -1 的 (n)varchar(max) 一般是长文本，不参与统计
+    candidates = [name for name, sql_type, max_length, _, _, _ in column_infos
+                  if sql_type.lower() in STRING_SQL_TYPES and max_length != -1 and name not in primary_key_columns]
+    sample_size, distinct_counts = sample_distinct_counts(sql_cursor, sql_query, candidates)
+
+    optimized = []
+    for name, ch_type in column_types:
+        distinct = distinct_counts.get(name)
+        if distinct is not None and distinct <= LOW_CARDINALITY_MAX_DISTINCT and distinct * 2 <= sample_size:
+            ch_type = f'LowCardinality({ch_type})'
+        optimized.append((name, ch_type))
+    low_cardinality = [name for name, ch_type in optimized if ch_type.startswith('LowCardinality(')]
+    logging.info(f"采样 {sample_size} 行，LowCardinality 列: {', '.join(low_cardinality) or '无'}")
+    return optimized
+
+
+def get_column_codec(ch_type):
+    if ch_type.startswith('LowCardinality('):
+        return ''
+    base_type = unwrap_clickhouse_type(ch_type)
+    if base_type.split('(')[0] in DELTA_CODEC_TYPES:
+        return ' CODEC(Delta, ZSTD(1))'
+    if base_type == 'String' or base_type.startswith(('Decimal', 'Float')):
+        return ' CODEC(ZSTD(1))'
+    return ''
+
+
+def find_partition_column(column_types, partition_column=None):
+    """
+    :param partition_column: 指定的分区列，为 None 时从 PARTITION_DATE_COLUMNS 中查找，为空字符串时不分区
+    :return: 按月分区的日期列名，没有合适的列时返回 None
+    """
+    types = dict(column_types)
+    for name in (PARTITION_DATE_COLUMNS if partition_column is None else [partition_column] if partition_column else []):
+        if name not in types:
+            continue
+        if unwrap_clickhouse_type(types[name]).startswith('Date'):
+            return name
+        logging.info(f"列 {name} 的类型为 {types[name]}，不是日期类型，不分区")
+    return None
+
+
+def get_partition_key(column_types, load_strategy, partition_column=None, optimize_storage=True):
+    """
+    :return: 分区表达式，partition 策略按天分区，其他策略按月分区，没有合适的分区列时返回 None；
+             partition 策略不受 optimize_storage 影响
+    """
+    if not optimize_storage and load_strategy != 'partition':
+        return None
+    partition_column = find_partition_column(column_types, partition_column)
+    if not partition_column:
+        return None
+    partition_expression = (f"assumeNotNull(`{partition_column}`)"
+                            if dict(column_types)[partition_column].startswith('Nullable(')
+                            else f"`{partition_column}`")
+    partition_function = 'toYYYYMMDD' if load_strategy == 'partition' else 'toYYYYMM'
+    return f"{partition_function}({partition_expression})"
+
+
+def build_create_table_query(table_name, column_types, primary_key_columns, load_strategy, partition_column=None,
+                             optimize_storage=True, version_column=None):
+    """
+    :param column_types: [(列名, ClickHouse类型), ...]
+    :param optimize_storage: 是否使用列压缩编码和按月分区
+    :param version_column: 是否带版本列，为 None 时按加载策略判断
+    """
+    column_definitions = [f"`{col}` {ch_type}{get_column_codec(ch_type) if optimize_storage else ''}"
+                          for col, ch_type in column_types]
+    if version_column if version_column is not None else load_strategy != 'delete':
+        column_definitions.append(f"`{SYNC_VERSION_COLUMN}` UInt64")
+
+    partition_key = get_partition_key(column_types, load_strategy, partition_column, optimize_storage)
+    partition_clause = f"PARTITION BY {partition_key}" if partition_key else ''
 
-    create_query = f"""
+    return f"""
     CREATE TABLE IF NOT EXISTS {table_name} (
-        {','.join(columns)}
-    ) ENGINE = ReplacingMergeTree()
-    ORDER BY ({', '.join(f'`{pk}`' for pk in primary_keys)})
+        {','.join(column_definitions)}
+    ) ENGINE = {get_table_engine(load_strategy)}
+    {partition_clause}
+    ORDER BY ({', '.join(f'`{pk}`' for pk in primary_key_columns)})
     """
 
+
+def get_clickhouse_columns(column_infos, primary_key_columns):
+    """
+    根据查询结果的列信息生成 ClickHouse 列类型，主键列不能为 Nullable
+    :return: [(列名, ClickHouse类型), ...]
+    """
+    column_types = []
+    for name, sql_type, max_length, precision, scale, nullable in column_infos:
+        ch_type = get_clickhouse_type(sql_type, max_length, precision, scale)
+        if nullable and name not in primary_key_columns:
+            ch_type = f'Nullable({ch_type})'
+        column_types.append((name, ch_type))
+    return column_types
+
+
+def get_table_row_count(sql_cursor, object_name):
+    """
+    从分区统计信息读取表行数，视图没有分区统计时返回None
+    """
+    try:
+        sql_cursor.execute(
+            "SELECT SUM(row_count) FROM sys.dm_db_partition_stats WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1)",
+            (object_name,)
+        )
+    except Exception:
+        # 没有 VIEW DATABASE STATE 权限时改用 sys.partitions
+        try:
+            sql_cursor.execute(
+                "SELECT SUM(rows) FROM sys.partitions WHERE object_id = OBJECT_ID(?) AND index_id IN (0, 1)",
+                (object_name,)
+            )
+        except Exception as e:
+            logging.warning(f"读取 {object_name} 的行数统计失败: {str(e)}")
+            return None
+    row = sql_cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def get_plan_estimated_rows(sql_cursor, sql_query):
+    """
+    读取优化器对查询的估算行数（SHOWPLAN_XML 只编译不执行）
+    """
+    try:
+        sql_cursor.execute("SET SHOWPLAN_XML ON")
+    except Exception as e:
+        logging.warning(f"获取查询估算行数失败: {str(e)}")
+        return None
+    plan_xml = None
+    try:
+        sql_cursor.execute(sql_query)
+        plan_xml = sql_cursor.fetchone()[0]
+    except Exception as e:
+        logging.warning(f"获取查询估算行数失败: {str(e)}")
+    finally:
+        # 关闭失败时会话仍处于 SHOWPLAN 模式，之后的查询都只返回计划，直接抛出由调用方丢弃连接
+        sql_cursor.execute("SET SHOWPLAN_XML OFF")
+
+    match = re.search(r'StatementEstRows="([0-9.Ee+-]+)"', plan_xml or '')
+    return int(float(match.group(1))) if match else None
+
+
+def estimate_query_rows(sql_cursor, sql_query, use_plan=True):
+    """
+    估算查询行数，不扫描数据
+    单表无条件查询直接读分区统计，视图或带条件的查询读取优化器估算
+    :param use_plan: 是否编译查询读取优化器估算，同步时只用于显示进度，不值得多一次编译
+    :return: 估算行数，无法估算时返回None
+    """
+    match = re.fullmatch(r'\s*SELECT\s+\*\s+FROM\s+([\w.\[\]]+)\s*', sql_query, re.IGNORECASE)
+    if match:
+        row_count = get_table_row_count(sql_cursor, match.group(1))
+        if row_count is not None:
+            return row_count
+    return get_plan_estimated_rows(sql_cursor, sql_query) if use_plan else None
+
+
+def get_clickhouse_column_types(ch_client, table_name):
+    rows = ch_client.execute(
+        "SELECT name, type FROM system.columns WHERE database = currentDatabase() AND table = %(table)s",
+        {'table': table_name}
+    )
+    return dict(rows)
+
+
+def unwrap_clickhouse_type(ch_type):
+    for wrapper in ('Nullable(', 'LowCardinality('):
+        if ch_type.startswith(wrapper):
+            return unwrap_clickhouse_type(ch_type[len(wrapper):-1])
+    return ch_type
+
+
+def build_column_converter(ch_type, column=None):
+    """
+    按目标列类型生成整列转换函数，非 Nullable 列的 None 转为该类型的默认值
+    整列值的类型都已符合目标类型时直接返回，不再逐值调用转换函数
+    日期类型超出 ClickHouse 取值范围的值截断到边界，每列第一次出现时记录警告
+    """
+    nullable = ch_type.startswith('Nullable(') or ch_type.startswith('LowCardinality(Nullable(')
+    base_type = unwrap_clickhouse_type(ch_type)
+
+    if base_type in ('String', 'FixedString') or base_type.startswith('FixedString('):
+        # clickhouse_driver 的 String 列可以直接写入 bytes（binary/rowversion 列）
+        accepted_types = {str, bytes}
+        convert = str
+        default = ''
+    elif base_type.startswith(('Int', 'UInt')):
+        accepted_types = {int}
+        convert = int
+        default = 0
+    elif base_type.startswith('Float'):
+        accepted_types = {float}
+        convert = float
+        default = 0.0
+    elif base_type.startswith('Decimal'):
+        accepted_types = {Decimal}
+
+        def convert(value):
+            return Decimal(str(value))
+        default = Decimal(0)
+    elif base_type.startswith('DateTime'):
+        accepted_types = {datetime}
+
+        def convert(value):
+            return datetime.fromisoformat(str(value))
+        default = datetime(1970, 1, 1)
+    elif base_type.startswith('Date'):
+        accepted_types = {date}
+
+        def convert(value):
+            return value.date() if isinstance(value, datetime) else date.fromisoformat(str(value))
+        default = date(1970, 1, 1)
+    elif base_type == 'UUID':
+        accepted_types = {uuid.UUID}
+
+        def convert(value):
+            return uuid.UUID(str(value))
+        default = uuid.UUID(int=0)
+    else:
+        accepted_types = None
+        convert = None
+        default = None
+
+    if nullable:
+        default = None
+        if accepted_types is not None:
+            accepted_types.add(type(None))
+
+    value_range = CLICKHOUSE_DATE_RANGES.get(base_type.split('(')[0])
+    warned = []
+
+    def clamp_column(values):
+        # 日期和时间值都为真，filter(None, ...) 只去掉 None
+        present = list(filter(None, values))
+        low, high = value_range
+        if not present or (low <= min(present) and max(present) <= high):
+            return values
+        if not warned:
+            warned.append(True)
+            logging.warning(f"列 {column or '?'} 有超出 {base_type} 范围的值（{min(present)} ~ {max(present)}），"
+                            f"已截断为 {low} ~ {high}")
+        return [value if value is None else low if value < low else high if value > high else value
+                for value in values]
+
+    def convert_column(values):
+        # map(type) 和 set 都在 C 层完成，绝大多数批次走这个分支
+        if accepted_types is None or set(map(type, values)) <= accepted_types:
+            values = list(values)
+        else:
+            values = [default if value is None else value if type(value) in accepted_types else convert(value)
+                      for value in values]
+        return clamp_column(values) if value_range else values
+
+    return convert_column
+
+
+def convert_batch_columnar(batch_data, converters):
+    """
+    将一批行数据转置为列，并逐列应用转换函数，用于 clickhouse_driver 的 columnar 插入
+    """
+    return [convert(column_values) for convert, column_values in zip(converters, zip(*batch_data))]
+
+
+def build_column_sizer(ch_type):
+    """
+    按 ClickHouse Native 格式估算一列数据的字节数，字符串按字符数计，只用于统计写入量
+    """
+    nullable = ch_type.startswith('Nullable(') or ch_type.startswith('LowCardinality(Nullable(')
+    base_type = unwrap_clickhouse_type(ch_type)
+    null_map_width = 1 if nullable else 0
+
+    width = CLICKHOUSE_TYPE_WIDTHS.get(base_type.split('(')[0])
+    if base_type.startswith('Decimal('):
+        precision = int(base_type[len('Decimal('):].split(',')[0])
+        width = 4 if precision <= 9 else 8 if precision <= 18 else 16 if precision <= 38 else 32
+
+    if width is None:
+        def size(values):
+            # 每个字符串前有一个变长长度前缀，短字符串按1字节计
+            return sum(map(len, filter(None, values))) + len(values) * (1 + null_map_width)
+    else:
+        def size(values):
+            return len(values) * (width + null_map_width)
+    return size
+
+
+def estimate_batch_bytes(columns_data, sizers):
+    return sum(size(values) for size, values in zip(sizers, columns_data))
+
+
+def create_clickhouse_table(ch_client, table_name, schema, primary_key_columns=None, load_strategy='delete',
+                            sql_cursor=None, optimize_storage=SYNC_OPTIMIZE_STORAGE):
+    """
+    :param sql_cursor: 源库游标，传入且表不存在时采样源表数据选择 LowCardinality 列
+    """
+    if clickhouse_table_exists(ch_client, table_name):
+        return
+
+    # 使用指定的主键或从 schema 中获取的主键
+    schema_primary_keys = [col.column_name for col in schema if col.is_primary_key]
+    primary_keys = primary_key_columns or schema_primary_keys or [schema[0].column_name]
+
+    column_infos = [(col.column_name, col.data_type, col.max_length, col.precision, col.scale, bool(col.is_nullable))
+                    for col in schema]
+    column_types = get_clickhouse_columns(column_infos, primary_keys)
+    if optimize_storage and sql_cursor is not None:
+        column_types = optimize_column_types(sql_cursor, f"SELECT * FROM {table_name}", column_infos, column_types,
+                                             primary_keys)
+
     try:
-        ch_client.execute(create_query)
+        ch_client.execute(build_create_table_query(table_name, column_types, primary_keys, load_strategy,
+                                                   optimize_storage=optimize_storage))
         logging.info(f"表 {table_name} 创建成功")
     except Exception as e:
         logging.error(f"创建表 {table_name} 失败: {str(e)}")
         raise
 
 
-def convert_row_values(row):
-    return [
-        ('' if value is None and isinstance(value, str) else
-         0 if value is None and isinstance(value, (int, float)) else
-         datetime(1970, 1, 1) if value is None and isinstance(value, datetime) else
-         value)
-        for value in row
-    ]
+def iter_stream_batches(sql_cursor, source_sql, columns, key_columns, fetch_size, params=None, start_key=None):
+    """
+    单次查询流式读取，通过 fetchmany 分块拉取结果集，不再按批次重复发起查询
+    """
+    predicate, key_params = build_keyset_predicate(key_columns, start_key)
+    stream_query = f"""
+        SELECT {','.join([f'[{col}]' for col in columns])}
+        FROM ({source_sql}) AS t
+        {f'WHERE {predicate}' if predicate else ''}
+        ORDER BY {', '.join(f'[{col}]' for col in key_columns)}
+    """
+    query_params = list(params or []) + key_params
+    if query_params:
+        sql_cursor.execute(stream_query, query_params)
+    else:
+        sql_cursor.execute(stream_query)
+
+    # 每块最后一个键值的行留到下一块，断点总是落在完整的键值之后，主键不唯一时续传也不会漏行
+    key_indexes = [columns.index(col) for col in key_columns]
+    pending = []
+    while True:
+        rows = sql_cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        batch_data = pending + rows
+        split = find_last_key_group(batch_data, key_indexes)
+        pending = batch_data[split:]
+        if split:
+            yield batch_data[:split]
+    if pending:
+        yield pending
+
+
+def run_pipeline(batches, load_batch, queue_size=4):
+    """
+    抽取和加载流水线：当前线程读取源数据放入有界队列，后台线程从队列取出写入ClickHouse
+    队列满时读取端阻塞，内存占用上限为 queue_size 个数据块
+    :param batches: 数据块迭代器
+    :param load_batch: 加载单个数据块的函数
+    """
+    batch_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    def loader():
+        while True:
+            batch_data = batch_queue.get()
+            if batch_data is None:
+                break
+            # 加载失败后继续取出剩余数据块，避免读取端阻塞在 put 上
+            if errors:
+                continue
+            try:
+                load_batch(batch_data)
+            except Exception as e:
+                errors.append(e)
+
+    loader_thread = threading.Thread(target=loader, name='clickhouse-loader', daemon=True)
+    loader_thread.start()
+    try:
+        for batch_data in batches:
+            if errors:
+                break
+            batch_queue.put(batch_data)
+    finally:
+        batch_queue.put(None)
+        loader_thread.join()
+
+    if errors:
+        raise errors[0]
 
 
 def format_value_for_sql(value):
-    if isinstance(value, (int, float)):
+    if isinstance(value, (int, float, Decimal)):
         return str(value)
     elif isinstance(value, datetime):
         return f"'{value.isoformat()}'"
     else:
-        return f"'{str(value)}'"
+        escaped = str(value).replace('\\', '\\\\').replace("'", "\\'")
+        return f"'{escaped}'"
+
+
+def get_table_engine(load_strategy):
+    if load_strategy == 'delete':
+        return 'ReplacingMergeTree()'
+    return f'ReplacingMergeTree({SYNC_VERSION_COLUMN})'
+
+
+def to_sync_version(value, default_version):
+    """
+    将版本来源列的值转换为 UInt64 版本号（毫秒时间戳），无法转换时使用同步时间
+    """
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, date):
+        return int(datetime(value.year, value.month, value.day).timestamp() * 1000)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(datetime.fromisoformat(value.strip()).timestamp() * 1000)
+        except ValueError:
+            return default_version
+    return default_version
+
+
+def get_row_versions(batch_data, version_index, default_version):
+    if version_index is None:
+        return [default_version] * len(batch_data)
+    return [to_sync_version(row[version_index], default_version) for row in batch_data]
+
+
+def get_partition_id(partition_date):
+    """
+    :param partition_date: YYYY-MM-DD
+    :return: 按天分区 (toYYYYMMDD) 的分区 ID
+    """
+    return datetime.strptime(partition_date, '%Y-%m-%d').strftime('%Y%m%d')
+
+
+def get_staging_table(target_table, load_strategy, partition_date=None):
+    # 同一目标表不同日期的任务可能并发执行（回补），partition 策略的临时表按日期区分
+    if load_strategy == 'partition':
+        return f"{target_table}{STAGING_TABLE_SUFFIX}_{partition_date.replace('-', '')}"
+    return f"{target_table}{STAGING_TABLE_SUFFIX}"
+
+
+def normalize_partition_key(partition_key):
+    return re.sub(r'[`\s]', '', partition_key or '')
+
+
+def get_table_partition_key(ch_client, table_name):
+    rows = ch_client.execute(
+        "SELECT partition_key FROM system.tables WHERE database = currentDatabase() AND name = %(table)s",
+        {'table': table_name}
+    )
+    return rows[0][0] if rows else ''
+
+
+def check_partition_target(ch_client, target_table, column_types, partition_column=None):
+    """
+    partition 策略要求有日期类型的分区列，查询结果没有时抛出
+    :param column_types: 按查询结果建表时的 [(列名, ClickHouse类型), ...]
+    :return: 目标表不存在或已按该列按天分区时返回 True，已有的表需要重建时返回 False
+    """
+    if get_partition_key(column_types, 'partition', partition_column) is None:
+        raise ValueError(f"表 {target_table} 没有日期类型的分区列 {partition_column or ''}，不能使用 partition 加载策略")
+    if not clickhouse_table_exists(ch_client, target_table):
+        return True
+    # 旧表（如全 String 列、不分区）的分区列不是日期类型时没有可用的分区键
+    target_types = list(get_clickhouse_column_types(ch_client, target_table).items())
+    partition_key = get_partition_key(target_types, 'partition', partition_column)
+    table_partition_key = get_table_partition_key(ch_client, target_table)
+    return (partition_key is not None
+            and normalize_partition_key(table_partition_key) == normalize_partition_key(partition_key))
+
+
+_rebuild_locks = {}
+_rebuild_locks_lock = threading.Lock()
+
+
+def get_rebuild_lock(target_table):
+    """
+    同一进程内同一张表只由一个任务重建，回补时同一张表不同日期的任务并发检查
+    """
+    with _rebuild_locks_lock:
+        return _rebuild_locks.setdefault(target_table, threading.Lock())
+
+
+def prepare_load_table(ch_client, target_table, load_strategy, resume=False, partition_date=None):
+    """
+    准备本次同步实际写入的表
+    :param resume: 从断点继续时保留已有的临时表
+    :param partition_date: partition 策略本次替换的日期
+    :return: 写入表名，staging / partition 策略下为临时表
+    """
+    if load_strategy not in LOAD_STRATEGIES:
+        raise ValueError(f"不支持的加载策略: {load_strategy}")
+
+    if load_strategy == 'delete':
+        return target_table
+
+    # 已存在的旧表补充版本列，只修改元数据；旧表引擎未指定版本列时保留最后插入的行，结果同样正确
+    ch_client.execute(
+        f"ALTER TABLE {target_table} ADD COLUMN IF NOT EXISTS `{SYNC_VERSION_COLUMN}` UInt64 DEFAULT 0"
+    )
+
+    if load_strategy == 'version':
+        return target_table
+
+    # REPLACE PARTITION 要求两表结构和分区键完全相同，临时表始终按目标表当前结构创建
+    staging_table = get_staging_table(target_table, load_strategy, partition_date)
+    if resume and clickhouse_table_exists(ch_client, staging_table):
+        return staging_table
+    ch_client.execute(f"DROP TABLE IF EXISTS {staging_table}")
+    ch_client.execute(f"CREATE TABLE {staging_table} AS {target_table}")
+    return staging_table
+
+
+def get_staging_partition_ids(ch_client, staging_table):
+    return {row[0] for row in ch_client.execute(
+        "SELECT DISTINCT partition_id FROM system.parts WHERE active AND database = currentDatabase() "
+        "AND table = %(table)s",
+        {'table': staging_table}
+    )}
+
+
+def replace_partition(ch_client, target_table, staging_table, partition_date):
+    """
+    用临时表中当天的分区替换目标表的同一分区，替换是一次元数据操作，查询看不到中间状态
+    当天没有数据时删除目标表中的该分区
+    """
+    partition_id = get_partition_id(partition_date)
+    # 断点续传时同一批可能写入两次，替换前先在临时表内去重
+    ch_client.execute(f"OPTIMIZE TABLE {staging_table} PARTITION ID '{partition_id}' FINAL")
+    partition_ids = get_staging_partition_ids(ch_client, staging_table)
+    unexpected = partition_ids - {partition_id}
+    if unexpected:
+        raise ValueError(f"临时表 {staging_table} 中有 {partition_date} 以外的分区: {', '.join(sorted(unexpected))}")
+
+    if partition_id in partition_ids:
+        ch_client.execute(f"ALTER TABLE {target_table} REPLACE PARTITION ID '{partition_id}' FROM {staging_table}")
+        logging.info(f"表 {target_table} 的分区 {partition_id} 已替换为临时表 {staging_table} 中的数据")
+    else:
+        ch_client.execute(f"ALTER TABLE {target_table} DROP PARTITION ID '{partition_id}'")
+        logging.info(f"{partition_date} 没有数据，已删除表 {target_table} 的分区 {partition_id}")
+
+
+def finish_load_table(ch_client, target_table, load_strategy, partition_date=None):
+    if load_strategy not in ('staging', 'partition'):
+        return
+
+    staging_table = get_staging_table(target_table, load_strategy, partition_date)
+    if load_strategy == 'partition':
+        replace_partition(ch_client, target_table, staging_table, partition_date)
+    else:
+        # 临时表 FINAL 先去掉本次同步内的重复行，再一次性写入目标表
+        ch_client.execute(f"INSERT INTO {target_table} SELECT * FROM {staging_table} FINAL")
+        logging.info(f"临时表 {staging_table} 已合并到 {target_table}")
+    ch_client.execute(f"DROP TABLE IF EXISTS {staging_table}")
+
+
+def build_insert_query(table_name, columns, load_strategy):
+    insert_columns = list(columns)
+    if load_strategy != 'delete':
+        insert_columns.append(SYNC_VERSION_COLUMN)
+    return f"INSERT INTO {table_name} ({','.join(insert_columns)}) VALUES"
+
+
+def delete_primary_keys(ch_client, table_name, primary_key_columns, primary_keys):
+    if not primary_keys:
+        return
+
+    if len(primary_key_columns) == 1:
+        delete_query = f"ALTER TABLE {table_name} DELETE WHERE {primary_key_columns[0]} IN ({', '.join(format_value_for_sql(pk[0]) for pk in primary_keys)})"
+    else:
+        conditions = []
+        for pk in primary_keys:
+            condition = f"({', '.join(format_value_for_sql(v) for v in pk)})"
+            conditions.append(condition)
+        delete_query = f"ALTER TABLE {table_name} DELETE WHERE ({', '.join(primary_key_columns)}) IN ({', '.join(conditions)})"
+
+    ch_client.execute(delete_query)
+
+
+def find_last_key_group(batch_data, key_indexes):
+    """
+    :return: 批次中最后一个键值的第一行下标
+    """
+    last_key = tuple(batch_data[-1][idx] for idx in key_indexes)
+    index = len(batch_data) - 1
+    while index > 0 and tuple(batch_data[index - 1][idx] for idx in key_indexes) == last_key:
+        index -= 1
+    return index
+
+
+def build_keyset_predicate(key_columns, last_key):
+    """
+    生成 keyset 分页条件
+    SQL Server 不支持 (a, b) > (x, y) 这样的行值比较，展开为 a > x OR (a = x AND b > y)
+    :param key_columns: 排序键列，复合主键按顺序传入
+    :param last_key: 上一批最后一行的键值元组，为None表示从头开始
+    :return: (条件SQL, 参数列表)
+    """
+    if last_key is None:
+        return '', []
+
+    conditions = []
+    params = []
+    for i, col in enumerate(key_columns):
+        parts = [f"[{prev}] = ?" for prev in key_columns[:i]] + [f"[{col}] > ?"]
+        conditions.append(f"({' AND '.join(parts)})")
+        params.extend(last_key[:i + 1])
+    return f"({' OR '.join(conditions)})", params
+
+
+def iter_keyset_batches(sql_cursor, source_sql, columns, key_columns, batch_size, params=None, start_key=None):
+    """
+    按键值 seek 分页读取数据，每批只需一次索引查找，不再用 ROW_NUMBER 反复全表排序
+    :param source_sql: 数据来源查询，作为子查询使用
+    :param columns: 需要读取的列
+    :param key_columns: 排序键列，必须能唯一确定一行
+    :param params: source_sql 中占位符对应的参数
+    :param start_key: 起始键值，从该键之后开始读取
+    """
+    key_indexes = [columns.index(col) for col in key_columns]
+    select_columns = ','.join([f'[{col}]' for col in columns])
+    order_by = ', '.join(f'[{col}]' for col in key_columns)
+    last_key = start_key
+    warned = False
+
+    while True:
+        predicate, key_params = build_keyset_predicate(key_columns, last_key)
+        batch_query = f"""
+            SELECT TOP ({batch_size}) {select_columns}
+            FROM ({source_sql}) AS t
+            {f'WHERE {predicate}' if predicate else ''}
+            ORDER BY {order_by}
+        """
+        query_params = list(params or []) + key_params
+        if query_params:
+            sql_cursor.execute(batch_query, query_params)
+        else:
+            sql_cursor.execute(batch_query)
+        batch_data = sql_cursor.fetchall()
+
+        if not batch_data:
+            break
+        if len(batch_data) < batch_size:
+            yield batch_data
+            break
+
+        # 键值在查询结果中不唯一时，最后一个键值的行可能没有读全，留到下一批从前一个键值之后重新读取
+        split = find_last_key_group(batch_data, key_indexes)
+        if split < len(batch_data) - 1 and not warned:
+            warned = True
+            logging.warning(f"排序键 {', '.join(key_columns)} 在查询结果中不唯一，按完整键值分批读取")
+        if split == 0:
+            # 整批都是同一个键值，单独读取该键值的全部行
+            key_params = list(batch_data[-1][idx] for idx in key_indexes)
+            sql_cursor.execute(f"""
+                SELECT {select_columns}
+                FROM ({source_sql}) AS t
+                WHERE {' AND '.join(f'[{col}] = ?' for col in key_columns)}
+            """, list(params or []) + key_params)
+            batch_data = sql_cursor.fetchall()
+            split = len(batch_data)
 
+        yield batch_data[:split]
+        last_key = tuple(batch_data[split - 1][idx] for idx in key_indexes)
 
-def sync_table(table_name, source_name=None, batch_size=50000):
+
+def get_histogram_boundaries(sql_cursor, sql_query, key_column, shards):
+    """
+    SELECT * FROM 表 形式的查询从以 key_column 为首列的统计信息直方图中按行数均分
+    :return: 分片边界列表，没有可用的直方图时返回 None
+    """
+    match = re.fullmatch(r'\s*SELECT\s+\*\s+FROM\s+([\w.\[\]]+)\s*', sql_query, re.IGNORECASE)
+    if not match:
+        return None
+    table_name = match.group(1)
     try:
-        sql_conn = get_sqlserver_connection(source_name)
-        ch_client = get_clickhouse_connection()
+        sql_cursor.execute("""
+            SELECT TOP 1 s.name FROM sys.stats s
+            JOIN sys.stats_columns sc ON sc.object_id = s.object_id AND sc.stats_id = s.stats_id
+                AND sc.stats_column_id = 1
+            JOIN sys.columns c ON c.object_id = sc.object_id AND c.column_id = sc.column_id
+            WHERE s.object_id = OBJECT_ID(?) AND c.name = ?
+            ORDER BY s.stats_id
+        """, (table_name, key_column))
+        row = sql_cursor.fetchone()
+        if not row:
+            return None
+        sql_cursor.execute(f"DBCC SHOW_STATISTICS ('{table_name}', [{row[0]}]) WITH HISTOGRAM")
+        # RANGE_HI_KEY, RANGE_ROWS, EQ_ROWS, ...：每一步包含 (上一步, RANGE_HI_KEY] 内的行
+        steps = [(step[0], (step[1] or 0) + (step[2] or 0)) for step in sql_cursor.fetchall() if step[0] is not None]
+    except Exception as e:
+        logging.warning(f"读取 {table_name} 的统计信息直方图失败，改用最小/最大值分片: {str(e)}")
+        return None
+    total = sum(rows for _, rows in steps)
+    if not total:
+        return None
+
+    boundaries = []
+    cumulative = 0
+    for hi_key, rows in steps:
+        cumulative += rows
+        if len(boundaries) < shards - 1 and cumulative >= total * (len(boundaries) + 1) / shards:
+            boundaries.append(hi_key)
+    return boundaries
+
+
+def get_min_max_boundaries(sql_cursor, sql_query, key_column, shards):
+    """
+    按主键首列的最小值和最大值等距分片，适用于整数、小数和日期类型的键
+    :return: 分片边界列表，键类型不能等距拆分时返回空列表
+    """
+    sql_cursor.execute(f"SELECT MIN([{key_column}]), MAX([{key_column}]) FROM ({sql_query}) AS t")
+    low, high = sql_cursor.fetchone()
+    if low is None or isinstance(low, (bool, str, bytes, uuid.UUID)):
+        return []
+    try:
+        return [low + (high - low) * i // shards for i in range(1, shards)]
+    except TypeError:
+        return []
+
+
+def plan_key_ranges(sql_cursor, sql_query, key_column, shards):
+    """
+    把主键首列的取值范围拆分为最多 shards 段
+    :return: 升序的分片边界 [b1, ..., bn]，第 i 段为 (b(i-1), bi]，首尾两段不设下限/上限
+    """
+    boundaries = get_histogram_boundaries(sql_cursor, sql_query, key_column, shards)
+    source = '统计信息直方图'
+    if boundaries is None:
+        boundaries = get_min_max_boundaries(sql_cursor, sql_query, key_column, shards)
+        source = '最小/最大值'
+    # 取值很少时边界可能重复
+    boundaries = list(dict.fromkeys(boundaries))
+    logging.info(f"按 {key_column} 的{source}拆分为 {len(boundaries) + 1} 个分片")
+    return boundaries
+
+
+def build_range_predicate(key_column, lower, upper):
+    """
+    :return: (lower, upper] 范围条件和参数，边界为 None 时不限制
+    """
+    conditions = []
+    params = []
+    if lower is not None:
+        conditions.append(f"[{key_column}] > ?")
+        params.append(lower)
+    if upper is not None:
+        conditions.append(f"[{key_column}] <= ?")
+        params.append(upper)
+    return ' AND '.join(conditions), params
+
+
+def get_change_tracking_versions(sql_cursor, table_name):
+    """
+    检查表是否启用了 Change Tracking
+    :return: (当前版本, 最小有效版本)，未启用时返回None
+    """
+    try:
+        sql_cursor.execute("SELECT 1 FROM sys.change_tracking_tables WHERE object_id = OBJECT_ID(?)", (table_name,))
+        enabled = sql_cursor.fetchone()
+    except pyodbc.Error as e:
+        # SQL Server 2008 之前的版本（如 SSDB 的 SQL2005）没有 Change Tracking
+        logging.info(f"数据源不支持 Change Tracking，表 {table_name} 使用其他增量方式: {str(e)}")
+        return None
+    if not enabled:
+        return None
+    sql_cursor.execute(
+        "SELECT CHANGE_TRACKING_CURRENT_VERSION(), CHANGE_TRACKING_MIN_VALID_VERSION(OBJECT_ID(?))",
+        (table_name,)
+    )
+    current_version, min_valid_version = sql_cursor.fetchone()
+    return current_version, min_valid_version
+
+
+def iter_change_tracking_batches(sql_cursor, table_name, columns, primary_key_columns, last_version,
+                                 current_version, batch_size, start_key=None):
+    """
+    读取 last_version 之后的净变化，每行为 (操作类型, 变化主键..., 当前行数据...)
+    已删除的行在源表中关联不到，行数据部分为 NULL
+    """
+    key_aliases = [f'__ct_{pk}' for pk in primary_key_columns]
+    source_sql = f"""
+        SELECT ct.SYS_CHANGE_OPERATION AS [__ct_operation],
+               {', '.join(f'ct.[{pk}] AS [{alias}]' for pk, alias in zip(primary_key_columns, key_aliases))},
+               t.*
+        FROM CHANGETABLE(CHANGES {table_name}, ?) AS ct
+        LEFT JOIN {table_name} AS t ON {' AND '.join(f't.[{pk}] = ct.[{pk}]' for pk in primary_key_columns)}
+        WHERE ct.SYS_CHANGE_VERSION <= ?
+    """
+    return iter_keyset_batches(sql_cursor, source_sql, ['__ct_operation'] + key_aliases + columns, key_aliases,
+                               batch_size, params=[last_version, current_version], start_key=start_key)
+
+
+def sync_table(table_name, source_name=None, batch_size=50000, load_strategy='delete', version_column=None,
+               sql_conn=None, ch_client=None, metrics=None):
+    # 由调用方传入的连接（连接池）由调用方负责关闭
+    owns_sql_conn = sql_conn is None
+    if metrics is None:
+        metrics = JobMetrics(table_name, source_name, table_name)
+    try:
+        if owns_sql_conn:
+            sql_conn = get_sqlserver_connection(source_name)
+        if ch_client is None:
+            ch_client = get_clickhouse_connection()
 
         sql_cursor = sql_conn.cursor()
         schema = get_table_schema(sql_cursor, table_name)
@@ -250,235 +1699,921 @@ def sync_table(table_name, source_name=None, batch_size=50000):
             logging.warning(f"表 {table_name} 没有主键，将使用第一列作为主键")
             primary_key_columns = [schema[0].column_name]
 
-        create_clickhouse_table(ch_client, table_name, schema, primary_key_columns)
+        store = get_checkpoint_store()
+        job_id = f"table:{table_name}"
+        checkpoint = store.get_checkpoint(job_id)
+
+        create_clickhouse_table(ch_client, table_name, schema, primary_key_columns, load_strategy, sql_cursor)
+        load_table = prepare_load_table(ch_client, table_name, load_strategy, resume=checkpoint is not None)
 
         last_sync_time = get_last_sync_time(table_name)
         current_sync_time = datetime.now()
+        sync_version = int(current_sync_time.timestamp() * 1000)
+
+        # 列顺序与 SELECT * 一致（按 column_id）
+        columns = [col.column_name for col in schema]
+        version_index = columns.index(version_column) if version_column else None
+        insert_query = build_insert_query(load_table, columns, load_strategy)
+
+        primary_key_indexes = [columns.index(pk) for pk in primary_key_columns]
+        progress = {'rows': 0, 'total': None}
+
+        # 按目标表实际列类型生成每列的转换函数
+        target_types = get_clickhouse_column_types(ch_client, load_table)
+        converters = [build_column_converter(target_types.get(col, 'String'), col) for col in columns]
+        column_sizers = [build_column_sizer(target_types.get(col, 'String')) for col in columns]
+        if load_strategy != 'delete':
+            column_sizers.append(build_column_sizer('UInt64'))
+
+        def load_batch(batch_data, timings=None):
+            timings = timings if timings is not None else {}
+            with measure_stage(timings, 'convert'):
+                columns_data = convert_batch_columnar(batch_data, converters)
+                if load_strategy != 'delete':
+                    columns_data.append(get_row_versions(batch_data, version_index, sync_version))
+
+            if load_strategy == 'delete':
+                # 获取主键值并删除重复数据
+                with measure_stage(timings, 'delete'):
+                    primary_keys = list(zip(*(columns_data[idx] for idx in primary_key_indexes)))
+                    delete_primary_keys(ch_client, table_name, primary_key_columns, primary_keys)
 
-        sql_cursor.execute(f"SELECT TOP 1 * FROM {table_name}")
-        columns = [column[0] for column in sql_cursor.description]
+            with measure_stage(timings, 'insert'):
+                ch_client.execute(insert_query, columns_data, columnar=True)
+            metrics.record_batch(len(batch_data), estimate_batch_bytes(columns_data, column_sizers), timings)
+
+            progress['rows'] += len(batch_data)
+            logging.info(f"已同步 {progress['rows']}/约{progress['total'] or '?'} 条记录")
+
+        def resume_checkpoint(mode, **bounds):
+            """
+            断点的同步方式和起点与本次一致时返回断点，否则视为过期丢弃
+            """
+            if not checkpoint:
+                return None
+            context = checkpoint['context']
+            if context.get('mode') != mode or any(context.get(key) != value for key, value in bounds.items()):
+                logging.warning(f"表 {table_name} 的断点与本次同步范围不一致，丢弃断点: {context}")
+                return None
+            progress['rows'] = checkpoint['rows']
+            logging.info(f"表 {table_name} 从断点继续同步，已完成 {checkpoint['rows']} 条记录")
+            return checkpoint
+
+        def commit_checkpoint(batch_data, key_indexes, context):
+            last_key = tuple(batch_data[-1][idx] for idx in key_indexes)
+            store.save_checkpoint(job_id, last_key, progress['rows'], context)
+
+        def load_full(context, start_key=None):
+            batches = iter_keyset_batches(sql_cursor, f"SELECT * FROM {table_name}", columns, primary_key_columns,
+                                          batch_size, start_key=start_key)
+            for batch_data, fetch_seconds in metrics.iter_batches(batches):
+                load_batch(batch_data, {'fetch': fetch_seconds})
+                commit_checkpoint(batch_data, primary_key_indexes, context)
+
+        # 优先使用 Change Tracking，可以同时识别新增、修改和删除
+        change_tracking_versions = get_change_tracking_versions(sql_cursor, table_name)
+        if change_tracking_versions:
+            current_version, min_valid_version = change_tracking_versions
+            last_version = get_last_sync_version(table_name)
+
+            if last_version is None or min_valid_version is None or last_version < min_valid_version:
+                logging.warning(f"表 {table_name} 没有有效的 Change Tracking 版本 (上次: {last_version}, "
+                                f"最小有效: {min_valid_version})，将进行全量同步")
+                resumed = resume_checkpoint('change_tracking_full')
+                if resumed:
+                    current_version = resumed['context']['to']
+                load_full({'mode': 'change_tracking_full', 'to': current_version},
+                          resumed['last_key'] if resumed else None)
+            else:
+                resumed = resume_checkpoint('change_tracking', **{'from': last_version})
+                if resumed:
+                    current_version = resumed['context']['to']
+                context = {'mode': 'change_tracking', 'from': last_version, 'to': current_version}
+
+                logging.info(f"开始 Change Tracking 增量同步表 {table_name}, 版本 {last_version} -> {current_version}")
+                key_offset = 1 + len(primary_key_columns)
+                deleted_rows = 0
+                batches = iter_change_tracking_batches(sql_cursor, table_name, columns, primary_key_columns,
+                                                       last_version, current_version, batch_size,
+                                                       start_key=resumed['last_key'] if resumed else None)
+                for batch_data, fetch_seconds in metrics.iter_batches(batches):
+                    # 标记为新增/修改但源表已查不到的行，说明在本次版本之后又被删除
+                    deleted_keys = [tuple(row[1:key_offset]) for row in batch_data
+                                    if row[0] == 'D' or row[key_offset + primary_key_indexes[0]] is None]
+                    changed_rows = [row[key_offset:] for row in batch_data
+                                    if row[0] != 'D' and row[key_offset + primary_key_indexes[0]] is not None]
+
+                    timings = {'fetch': fetch_seconds}
+                    with measure_stage(timings, 'delete'):
+                        delete_primary_keys(ch_client, table_name, primary_key_columns, deleted_keys)
+                    deleted_rows += len(deleted_keys)
+                    if changed_rows:
+                        load_batch(changed_rows, timings)
+                    else:
+                        metrics.record_batch(0, 0, timings)
+                    commit_checkpoint(batch_data, range(1, key_offset), context)
+                logging.info(f"表 {table_name} 删除 {deleted_rows} 条记录")
+
+            finish_load_table(ch_client, table_name, load_strategy)
+            save_last_sync_version(table_name, current_version)
+            store.clear_checkpoint(job_id)
+            logging.info(f"表 {table_name} 同步完成")
+            return
+
+        # 其次使用 rowversion 列，只能识别新增和修改
+        rowversion_column = next(
+            (col.column_name for col in schema if col.data_type.lower() in ('timestamp', 'rowversion')), None
+        )
+        if rowversion_column:
+            last_version = get_last_sync_version(table_name)
+            resumed = resume_checkpoint('rowversion', **{'from': last_version})
+            if resumed:
+                upper_version = resumed['context']['to']
+            else:
+                # 以 MIN_ACTIVE_ROWVERSION 为上界，避免漏掉尚未提交的事务
+                sql_cursor.execute("SELECT MIN_ACTIVE_ROWVERSION()")
+                upper_version = sql_cursor.fetchone()[0]
+            context = {'mode': 'rowversion', 'from': last_version, 'to': upper_version}
+
+            source_sql = f"SELECT * FROM {table_name} WHERE [{rowversion_column}] < ?"
+            params = [upper_version]
+            if last_version is not None:
+                source_sql += f" AND [{rowversion_column}] >= ?"
+                params.append(last_version)
+
+            logging.info(f"开始 rowversion 增量同步表 {table_name}, 列 {rowversion_column}, 删除的记录不会同步")
+            rowversion_index = columns.index(rowversion_column)
+            batches = iter_keyset_batches(sql_cursor, source_sql, columns, [rowversion_column], batch_size,
+                                          params=params, start_key=resumed['last_key'] if resumed else None)
+            for batch_data, fetch_seconds in metrics.iter_batches(batches):
+                load_batch(batch_data, {'fetch': fetch_seconds})
+                commit_checkpoint(batch_data, [rowversion_index], context)
+
+            finish_load_table(ch_client, table_name, load_strategy)
+            save_last_sync_version(table_name, upper_version)
+            store.clear_checkpoint(job_id)
+            logging.info(f"表 {table_name} 同步完成")
+            return
 
         # 检查更新时间字段
         update_field = None
         for col in columns:
-            if col.lower() in ['updated_at', 'update_time', 'modify_time', 'TransferDate']:
+            if col.lower() in ['updated_at', 'update_time', 'modify_time', 'transferdate']:
                 update_field = col
                 break
 
         if not update_field:
             logging.warning(f"表 {table_name} 没有更新时间字段，将进行全量同步")
-            sql_cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
-            total_records = sql_cursor.fetchone()[0]
-
-            current_row = 0
-            while current_row < total_records:
-                query = f"""
-                    WITH numbered_rows AS (
-                        SELECT ROW_NUMBER() OVER (ORDER BY {', '.join(primary_key_columns)}) AS row_num, *
-                        FROM {table_name}
-                    )
-                    SELECT {','.join([f'[{col}]' for col in columns])}
-                    FROM numbered_rows
-                    WHERE row_num > {current_row} AND row_num <= {current_row + batch_size}
-                """
+            progress['total'] = get_table_row_count(sql_cursor, table_name)
 
-                sql_cursor.execute(query)
-                batch_data = sql_cursor.fetchall()
+            resumed = resume_checkpoint('full')
+            load_full({'mode': 'full'}, resumed['last_key'] if resumed else None)
+            finish_load_table(ch_client, table_name, load_strategy)
+            store.clear_checkpoint(job_id)
+            return
 
-                if not batch_data:
-                    break
+        # 增量同步
+        resumed = resume_checkpoint('update_time', **{'from': last_sync_time})
+        if resumed:
+            current_sync_time = resumed['context']['sync_time']
+        context = {'mode': 'update_time', 'from': last_sync_time, 'sync_time': current_sync_time}
+
+        logging.info(f"开始增量同步表 {table_name}, 上次同步时间: {last_sync_time}")
+
+        # 更新时间可能重复，追加主键保证排序键唯一
+        incremental_key_columns = [update_field] + [pk for pk in primary_key_columns if pk != update_field]
+        incremental_key_indexes = [columns.index(col) for col in incremental_key_columns]
+        batches = iter_keyset_batches(sql_cursor, f"SELECT * FROM {table_name} WHERE {update_field} >= ?",
+                                      columns, incremental_key_columns, batch_size, params=[last_sync_time],
+                                      start_key=resumed['last_key'] if resumed else None)
+        for batch_data, fetch_seconds in metrics.iter_batches(batches):
+            load_batch(batch_data, {'fetch': fetch_seconds})
+            commit_checkpoint(batch_data, incremental_key_indexes, context)
+
+        finish_load_table(ch_client, table_name, load_strategy)
+        save_last_sync_time(table_name, current_sync_time)
+        store.clear_checkpoint(job_id)
+        logging.info(f"表 {table_name} 同步完成")
 
-                rows = [convert_row_values(row) for row in batch_data]
+    except Exception as e:
+        logging.error(f"同步表 {table_name} 时发生错误: {str(e)}")
+        raise
+    finally:
+        if owns_sql_conn and sql_conn is not None:
+            sql_conn.close()
 
-                # 获取主键值并删除重复数据
-                primary_key_indexes = [columns.index(pk) for pk in primary_key_columns]
-                primary_keys = []
-                for row in rows:
-                    key_values = tuple(row[idx] for idx in primary_key_indexes)
-                    primary_keys.append(key_values)
-
-                if primary_keys:
-                    if len(primary_key_columns) == 1:
-                        delete_query = f"ALTER TABLE {table_name} DELETE WHERE {primary_key_columns[0]} IN {tuple(pk[0] for pk in primary_keys)}"
-                    else:
-                        conditions = []
-                        for pk in primary_keys:
-                            condition = f"({', '.join(format_value_for_sql(v) for v in pk)})"
-                            conditions.append(condition)
-                        delete_query = f"ALTER TABLE {table_name} DELETE WHERE ({', '.join(primary_key_columns)}) IN ({', '.join(conditions)})"
 
-                    ch_client.execute(delete_query)
+def get_spool_dir(job_id):
+    return os.path.join(SYNC_SPOOL_DIR, re.sub(r'[^\w.-]', '_', job_id))
 
-                insert_query = f"INSERT INTO {table_name} ({','.join(columns)}) VALUES"
-                ch_client.execute(insert_query, rows)
 
-                current_row += batch_size
-                logging.info(f"已同步 {min(current_row, total_records)}/{total_records} 条记录")
+def list_spool_files(job_id):
+    spool_dir = get_spool_dir(job_id)
+    if not os.path.isdir(spool_dir):
+        return []
+    return [os.path.join(spool_dir, name) for name in sorted(os.listdir(spool_dir)) if name.endswith('.pkl.gz')]
 
-            return
 
-        # 增量同步
-        count_query = f"SELECT COUNT(*) FROM {table_name} WHERE {update_field} >= ?"
-        sql_cursor.execute(count_query, (last_sync_time,))
-        total_records = sql_cursor.fetchone()[0]
-
-        logging.info(f"开始增量同步表 {table_name}, 上次同步时间: {last_sync_time}, 需要同步的记录数: {total_records}")
-
-        current_row = 0
-        while current_row < total_records:
-            query = f"""
-                WITH numbered_rows AS (
-                    SELECT ROW_NUMBER() OVER (ORDER BY {update_field}) AS row_num, *
-                    FROM {table_name}
-                    WHERE {update_field} >= ?
-                )
-                SELECT {','.join([f'[{col}]' for col in columns])}
-                FROM numbered_rows
-                WHERE row_num > {current_row} AND row_num <= {current_row + batch_size}
-            """
+def write_spool_file(job_id, columns_data):
+    """
+    将一批已转换的列式数据写入暂存目录，先写临时文件再改名，不会留下半个文件
+    使用 pickle 保存，加载时与直接写入的数据完全一致（Decimal、UUID、日期等类型不需要再次转换）
+    :return: (文件路径, 文件字节数)
+    """
+    spool_dir = get_spool_dir(job_id)
+    os.makedirs(spool_dir, exist_ok=True)
+    existing = list_spool_files(job_id)
+    sequence = int(os.path.basename(existing[-1]).split('_')[1].split('.')[0]) + 1 if existing else 1
+    path = os.path.join(spool_dir, f'batch_{sequence:06d}.pkl.gz')
+    with gzip.open(f'{path}.tmp', 'wb', compresslevel=1) as f:
+        pickle.dump(columns_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+    return path, os.path.getsize(path)
 
-            sql_cursor.execute(query, (last_sync_time,))
-            batch_data = sql_cursor.fetchall()
 
-            if not batch_data:
-                break
+def read_spool_file(path):
+    with gzip.open(path, 'rb') as f:
+        return pickle.load(f)
 
-            rows = [convert_row_values(row) for row in batch_data]
 
-            # 获取主键值并删除重复数据
-            primary_key_indexes = [columns.index(pk) for pk in primary_key_columns]
-            primary_keys = []
-            for row in rows:
-                key_values = tuple(row[idx] for idx in primary_key_indexes)
-                primary_keys.append(key_values)
+def read_spool_manifest(job_id):
+    """
+    读取抽取完成时写入的清单，抽取未完成时返回None
+    """
+    try:
+        with open(os.path.join(get_spool_dir(job_id), SPOOL_MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return decode_state_value(f.read())
+    except FileNotFoundError:
+        return None
 
-            if primary_keys:
-                if len(primary_key_columns) == 1:
-                    delete_query = f"ALTER TABLE {table_name} DELETE WHERE {primary_key_columns[0]} IN {tuple(pk[0] for pk in primary_keys)}"
-                else:
-                    conditions = []
-                    for pk in primary_keys:
-                        condition = f"({', '.join(format_value_for_sql(v) for v in pk)})"
-                        conditions.append(condition)
-                    delete_query = f"ALTER TABLE {table_name} DELETE WHERE ({', '.join(primary_key_columns)}) IN ({', '.join(conditions)})"
 
-                ch_client.execute(delete_query)
+def write_spool_manifest(job_id, manifest):
+    path = os.path.join(get_spool_dir(job_id), SPOOL_MANIFEST_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        f.write(encode_state_value(manifest))
+    os.replace(f'{path}.tmp', path)
 
-            insert_query = f"INSERT INTO {table_name} ({','.join(columns)}) VALUES"
-            ch_client.execute(insert_query, rows)
 
-            current_row += batch_size
-            logging.info(f"已同步 {min(current_row, total_records)}/{total_records} 条记录")
+def clear_spool(job_id):
+    spool_dir = get_spool_dir(job_id)
+    if not os.path.isdir(spool_dir):
+        return
+    for name in os.listdir(spool_dir):
+        os.remove(os.path.join(spool_dir, name))
+    os.rmdir(spool_dir)
 
-        save_last_sync_time(table_name, current_sync_time)
-        logging.info(f"表 {table_name} 同步完成")
 
-    except Exception as e:
-        logging.error(f"同步表 {table_name} 时发生错误: {str(e)}")
-        raise
-    finally:
-        sql_conn.close()
+def finish_query_sync(ch_client, job_id, target_table, load_strategy, full_refresh, fingerprint, sync_time,
+                      rows_synced, seconds, partition_date=None):
+    """
+    数据全部写入后：交换影子表或合并临时表，保存水位和指纹，清除断点并记录吞吐
+    """
+    if full_refresh:
+        swap_shadow_table(ch_client, target_table)
+        if fingerprint is not None:
+            save_last_fingerprint(target_table, fingerprint)
+    else:
+        finish_load_table(ch_client, target_table, load_strategy, partition_date)
+    save_last_sync_time(f"query_{job_id}", sync_time)
+    store = get_checkpoint_store()
+    store.clear_checkpoint(job_id)
+    store.record_job_stats(target_table, rows_synced, seconds)
 
 
-def sync_from_query(query_name, sql_query, target_table, source_name=None, primary_key_columns=None, batch_size=50000):
-    try:
-        sql_conn = get_sqlserver_connection(source_name)
+def load_spool(job_id, ch_client, metrics=None, retries=SPOOL_LOAD_RETRIES):
+    """
+    将暂存目录中的批次按顺序写入 ClickHouse，每个文件写入成功后删除
+    ClickHouse 暂时不可用时按指数退避重试，超过重试次数后抛出，已暂存的文件保留，下次从剩余文件继续
+    """
+    manifest = read_spool_manifest(job_id)
+    if manifest is None:
+        raise ValueError(f"任务 {job_id} 没有完整的暂存数据")
+
+    files = list_spool_files(job_id)
+    logging.info(f"开始加载任务 {job_id} 的暂存数据，共 {len(files)} 个文件")
+    for index, path in enumerate(files, start=1):
+        columns_data = read_spool_file(path)
+        timings = {}
+        for attempt in range(retries + 1):
+            try:
+                if manifest['delete_existing']:
+                    with measure_stage(timings, 'delete'):
+                        primary_keys = list(zip(*(columns_data[idx] for idx in manifest['primary_key_indexes'])))
+                        delete_primary_keys(ch_client, manifest['target_table'], manifest['primary_key_columns'],
+                                            primary_keys)
+                with measure_stage(timings, 'insert'):
+                    ch_client.execute(manifest['insert_query'], columns_data, columnar=True)
+                break
+            except Exception as e:
+                if attempt >= retries:
+                    logging.error(f"加载暂存文件 {path} 失败，剩余文件保留在 {get_spool_dir(job_id)}: {str(e)}")
+                    raise
+                wait_seconds = min(5 * 2 ** attempt, 60)
+                logging.warning(f"加载暂存文件 {path} 第 {attempt + 1} 次失败，{wait_seconds} 秒后重试: {str(e)}")
+                time.sleep(wait_seconds)
+        os.remove(path)
+        if metrics is not None:
+            metrics.add_timings(timings)
+        logging.info(f"已加载暂存文件 {index}/{len(files)}")
+
+    finish_query_sync(ch_client, job_id, manifest['target_table'], manifest['load_strategy'],
+                      manifest['full_refresh'], manifest['fingerprint'], manifest['sync_time'], manifest['rows'],
+                      time.time() - manifest['started_at'], manifest.get('partition_date'))
+    clear_spool(job_id)
+    logging.info(f"任务 {job_id} 的暂存数据加载完成")
+
+
+def load_pending_spools(ch_client=None):
+    """
+    加载所有抽取已完成但尚未写入 ClickHouse 的暂存数据，用于 ClickHouse 故障恢复后补写
+    """
+    if ch_client is None:
         ch_client = get_clickhouse_connection()
+    if not os.path.isdir(SYNC_SPOOL_DIR):
+        return
+    for name in sorted(os.listdir(SYNC_SPOOL_DIR)):
+        manifest_path = os.path.join(SYNC_SPOOL_DIR, name, SPOOL_MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            logging.warning(f"暂存目录 {name} 的抽取未完成，需要重新运行同步任务")
+            continue
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            job_id = decode_state_value(f.read())['job_id']
+        load_spool(job_id, ch_client)
+
+
+def sync_from_query(query_name, sql_query, target_table, source_name=None, primary_key_columns=None, batch_size=50000,
+                    streaming=False, fetch_size=10000, queue_size=4, load_strategy='delete', version_column=None,
+                    typed_columns=True, full_refresh=None, job_id=None, spool=False, load_spooled=True,
+                    optimize_storage=SYNC_OPTIMIZE_STORAGE, partition_column=None, partition_date=None, shards=1,
+                    sql_conn=None, ch_client=None, metrics=None, sql_pool=None, ch_pool=None):
+    """
+    :param typed_columns: 按查询结果的列类型建表，为 False 时所有列均为 String
+    :param optimize_storage: 建表时采样源数据选择 LowCardinality 列，并使用列压缩编码和按月分区
+    :param partition_column: 分区的日期列（partition 策略按天，其他策略按月），
+                             为 None 时从 PARTITION_DATE_COLUMNS 中查找，为空字符串时不分区
+    :param partition_date: partition 加载策略本次替换的日期 (YYYY-MM-DD)，查询结果应只包含这一天的数据
+    :param full_refresh: 是否整表刷新（影子表 + EXCHANGE），为 None 时按 FULL_REFRESH_TABLES 判断
+    :param job_id: 断点和水位的标识，按日期同步的任务应包含日期，默认为目标表名
+    :param load_strategy: 加载策略，见 LOAD_STRATEGIES
+    :param version_column: 版本来源列（如 TransferDate），为空时使用本次同步时间作为版本
+    :param spool: 是否先把抽取的数据落盘到 SYNC_SPOOL_DIR，抽取完成后再加载到 ClickHouse
+    :param shards: 按主键首列的范围拆分的分片数，大于 1 时各分片并发读取和写入
+    :param load_spooled: 落盘模式下抽取完成后是否立即加载，为 False 时由调用方释放源连接后调用 load_spool
+    :param sql_conn: 复用的 SQL Server 连接，为空时新建并在结束后关闭
+    :param ch_client: 复用的 ClickHouse 连接，为空时新建
+    :param metrics: 记录逐批次指标的 JobMetrics，为空时只在本次调用内统计
+    :param sql_pool: sql_conn 所属的连接池，分片的额外连接只取其中空闲的名额，为空时分片新建连接
+    :param ch_pool: ch_client 所属的连接池，与 sql_pool 一起传入
+    """
+    owns_sql_conn = sql_conn is None
+    try:
+        if owns_sql_conn:
+            sql_conn = get_sqlserver_connection(source_name)
+        if ch_client is None:
+            ch_client = get_clickhouse_connection()
         sql_cursor = sql_conn.cursor()
+        job_id = job_id or target_table
+        if metrics is None:
+            metrics = JobMetrics(query_name, source_name, target_table)
 
-        last_sync_time = get_last_sync_time(f"query_{query_name}")
         current_sync_time = datetime.now()
+        sync_version = int(current_sync_time.timestamp() * 1000)
+        start_time = time.time()
 
-        sql_cursor.execute(f"SELECT TOP 1 * FROM ({sql_query}) AS t")
-        columns = [column[0] for column in sql_cursor.description]
+        column_infos = describe_query_columns(sql_cursor, sql_query)
+        columns = [info[0] for info in column_infos]
+        version_index = columns.index(version_column) if version_column else None
 
         # 如果没有指定主键，使用第一列
         if not primary_key_columns:
             primary_key_columns = [columns[0]]
             logging.warning(f"查询 {query_name} 没有指定主键，将使用第一列 {primary_key_columns[0]} 作为主键")
 
-        # 对于 CustomerService 和 CustomerCompany，先删除表
-        if target_table in ['CustomerService', 'CustomerCompany','AirWayPreCode','AIRWAYCLASS']:
+        if full_refresh is None:
+            full_refresh = target_table in FULL_REFRESH_TABLES
+        if load_strategy == 'partition':
+            if not partition_date:
+                raise ValueError(f"查询 {query_name} 使用 partition 加载策略时必须指定 partition_date")
+            partition_types = (get_clickhouse_columns(column_infos, primary_key_columns) if typed_columns
+                               else [(col, 'String') for col in columns])
+            if not check_partition_target(ch_client, target_table, partition_types, partition_column):
+                # 旧表（全 String、不分区或按月分区）不能按天替换分区，先按当前建表规则重建
+                with get_rebuild_lock(target_table):
+                    if not check_partition_target(ch_client, target_table, partition_types, partition_column):
+                        logging.warning(f"表 {target_table} 没有按 {partition_column} 按天分区，自动重建")
+                        if optimize_storage:
+                            partition_types = optimize_column_types(sql_cursor, sql_query, column_infos,
+                                                                    partition_types, primary_key_columns)
+                        rebuild_table(ch_client, target_table, partition_types, primary_key_columns, load_strategy,
+                                      partition_column, optimize_storage)
+
+        # 全量刷新的表先比较源数据指纹，未变化则跳过
+        fingerprint = None
+        if full_refresh:
+            fingerprint = get_source_fingerprint(sql_cursor, sql_query)
+            if (fingerprint is not None and fingerprint == get_last_fingerprint(target_table)
+                    and clickhouse_table_exists(ch_client, target_table)):
+                logging.info(f"查询 {query_name} 源数据未变化 (指纹 {fingerprint})，跳过同步")
+                metrics.status = 'skipped'
+                save_last_sync_time(f"query_{job_id}", current_sync_time)
+                return
+
+        # 查询、加载方式或源数据指纹有变化时，之前的断点不再有效
+        store = get_checkpoint_store()
+        checkpoint_context = {
+            'query': hashlib.sha1(sql_query.encode('utf-8')).hexdigest(),
+            'full_refresh': full_refresh,
+            'load_strategy': load_strategy,
+            'fingerprint': fingerprint,
+        }
+        if load_strategy == 'partition':
+            checkpoint_context['partition_date'] = partition_date
+        if spool:
+            checkpoint_context['spool'] = True
+            if shards > 1:
+                logging.warning(f"查询 {query_name} 使用落盘模式，不拆分分片")
+                shards = 1
+        if shards > 1:
+            checkpoint_context['shards'] = shards
+        checkpoint = store.get_checkpoint(job_id)
+        if checkpoint and checkpoint['context'] != checkpoint_context:
+            logging.warning(f"任务 {job_id} 的断点与本次查询不一致，丢弃断点")
+            store.clear_checkpoint(job_id)
+            checkpoint = None
+        if (checkpoint and full_refresh
+                and not clickhouse_table_exists(ch_client, f"{target_table}{SHADOW_TABLE_SUFFIX}")):
+            logging.warning(f"任务 {job_id} 的影子表已不存在，丢弃断点")
+            store.clear_checkpoint(job_id)
+            checkpoint = None
+        # 分片同步时任务断点记录分片边界，各分片的进度记录在 <job_id>#<序号>
+        shard_checkpoints = []
+        if checkpoint and shards > 1:
+            shard_checkpoints = [store.get_checkpoint(f"{job_id}#{index}")
+                                 for index in range(len(checkpoint['last_key']) + 1)]
+            checkpoint['rows'] = sum(item['rows'] for item in shard_checkpoints if item)
+        if checkpoint:
+            logging.info(f"任务 {job_id} 从断点继续同步，已完成 {checkpoint['rows']} 条记录")
+
+        # 创建ClickHouse表，全量刷新时写入影子表，完成后再与目标表交换
+        create_table = f"{target_table}{SHADOW_TABLE_SUFFIX}" if full_refresh else target_table
+        if full_refresh and not checkpoint:
+            ch_client.execute(f"DROP TABLE IF EXISTS {create_table}")
+        if not clickhouse_table_exists(ch_client, create_table):
+            # 只在建表时采样源数据，已有的表不受影响（旧表可用 --migrate-table 迁移）
+            if typed_columns:
+                column_types = get_clickhouse_columns(column_infos, primary_key_columns)
+                if optimize_storage:
+                    column_types = optimize_column_types(sql_cursor, sql_query, column_infos, column_types,
+                                                         primary_key_columns)
+            else:
+                column_types = [(col, 'String') for col in columns]
+            ch_client.execute(build_create_table_query(create_table, column_types, primary_key_columns, load_strategy,
+                                                       partition_column, optimize_storage))
+        if full_refresh:
+            load_table = create_table
+        else:
+            load_table = prepare_load_table(ch_client, target_table, load_strategy, resume=checkpoint is not None,
+                                            partition_date=partition_date)
+        insert_query = build_insert_query(load_table, columns, load_strategy)
+        # 影子表是空表，无需删除旧主键
+        delete_existing = load_strategy == 'delete' and not full_refresh
+
+        # 按目标表实际列类型转换，兼容之前建好的全 String 表
+        target_types = get_clickhouse_column_types(ch_client, load_table)
+        converters = [build_column_converter(target_types.get(col, 'String'), col) for col in columns]
+        column_sizers = [build_column_sizer(target_types.get(col, 'String')) for col in columns]
+        if load_strategy != 'delete':
+            column_sizers.append(build_column_sizer('UInt64'))
+
+        # 估算行数只用于显示进度，读取以空批次结束；视图和带条件的查询不编译估算，进度只显示已同步行数
+        total_records = estimate_query_rows(sql_cursor, sql_query, use_plan=False)
+
+        logging.info(f"开始同步查询 {query_name} 到表 {target_table}, 估算记录数: {total_records or '未知'}")
+
+        primary_key_indexes = [columns.index(pk) for pk in primary_key_columns]
+        progress = {'rows': checkpoint['rows'] if checkpoint else 0}
+        progress_lock = threading.Lock()
+        start_key = checkpoint['last_key'] if checkpoint and shards == 1 else None
+
+        def load_batch(batch_data, fetch_seconds, ch_client=ch_client, shard=None):
+            timings = {'fetch': fetch_seconds}
+            # 按列转换后以列式数据块写入，避免逐行构造 Python 列表
+            with measure_stage(timings, 'convert'):
+                columns_data = convert_batch_columnar(batch_data, converters)
+                if load_strategy != 'delete':
+                    columns_data.append(get_row_versions(batch_data, version_index, sync_version))
+
+            if delete_existing:
+                with measure_stage(timings, 'delete'):
+                    primary_keys = list(zip(*(columns_data[idx] for idx in primary_key_indexes)))
+                    delete_primary_keys(ch_client, target_table, primary_key_columns, primary_keys)
+            with measure_stage(timings, 'insert'):
+                ch_client.execute(insert_query, columns_data, columnar=True)
+            metrics.record_batch(len(batch_data), estimate_batch_bytes(columns_data, column_sizers), timings)
+
+            # 数据写入后再记录断点，重跑时从该批最后一个主键之后继续
+            last_key = tuple(batch_data[-1][idx] for idx in primary_key_indexes)
+            with progress_lock:
+                progress['rows'] += len(batch_data)
+                if shard is None:
+                    store.save_checkpoint(job_id, last_key, progress['rows'], checkpoint_context)
+                else:
+                    shard['rows'] += len(batch_data)
+                    store.save_checkpoint(shard['id'], last_key, shard['rows'], checkpoint_context)
+                shard_label = '' if shard is None else f"（分片 {shard['index']}）"
+                logging.info(f"已同步 {progress['rows']}/约{total_records or '?'} 条记录{shard_label}")
+
+        def sync_shard(shard, shard_cursor, shard_ch_client, stopped):
+            """
+            使用给定的连接读取并写入一个分片
+            """
             try:
-                ch_client.execute(f"DROP TABLE IF EXISTS {target_table}")
-                logging.info(f"已删除表 {target_table}")
-            except Exception as e:
-                logging.error(f"删除表 {target_table} 失败: {str(e)}")
+                predicate, range_params = build_range_predicate(primary_key_columns[0], shard['lower'], shard['upper'])
+                shard_sql = f"SELECT * FROM ({sql_query}) AS r{f' WHERE {predicate}' if predicate else ''}"
+                if streaming:
+                    batches = iter_stream_batches(shard_cursor, shard_sql, columns, primary_key_columns, fetch_size,
+                                                  range_params, shard['start_key'])
+                else:
+                    batches = iter_keyset_batches(shard_cursor, shard_sql, columns, primary_key_columns, batch_size,
+                                                  range_params, shard['start_key'])
+                for batch_data, fetch_seconds in metrics.iter_batches(batches):
+                    load_batch(batch_data, fetch_seconds, shard_ch_client, shard)
+                    # 其他分片失败时尽快结束，已写入的批次由分片断点保留
+                    if stopped.is_set():
+                        return
+            except Exception:
+                stopped.set()
                 raise
 
-        # 创建ClickHouse表
-        create_query = f"""
-        CREATE TABLE IF NOT EXISTS {target_table} (
-            {','.join([f"`{col}` String" for col in columns])}
-        ) ENGINE = ReplacingMergeTree()
-        ORDER BY ({', '.join(f'`{pk}`' for pk in primary_key_columns)})
-        """
-        ch_client.execute(create_query)
+        def open_shard_connections(stack):
+            """
+            为分片准备一组额外的连接，连接在 stack 退出时归还或关闭
+            传入连接池时只取空闲的名额，不超过每个数据源的并发上限，取不到时返回 None
+            """
+            if sql_pool is None:
+                shard_sql_conn = get_sqlserver_connection(source_name)
+                stack.callback(close_connection, shard_sql_conn)
+                shard_ch_client = get_clickhouse_connection()
+                stack.callback(close_connection, shard_ch_client)
+                return shard_sql_conn.cursor(), shard_ch_client
+            with ExitStack() as acquired:
+                shard_sql_conn = acquired.enter_context(sql_pool.connection(blocking=False))
+                shard_ch_client = acquired.enter_context(ch_pool.connection(blocking=False)) if shard_sql_conn else None
+                if shard_ch_client is None:
+                    return None
+                stack.enter_context(acquired.pop_all())
+            return shard_sql_conn.cursor(), shard_ch_client
+
+        def run_shard_worker(shard_cursor, shard_ch_client, shard_queue, stopped):
+            # 连接数少于分片数时，一组连接依次处理多个分片
+            while not stopped.is_set():
+                try:
+                    shard = shard_queue.get_nowait()
+                except queue.Empty:
+                    return
+                sync_shard(shard, shard_cursor, shard_ch_client, stopped)
+
+        def run_shards(boundaries):
+            ranges = list(zip([None] + boundaries, boundaries + [None]))
+            shard_queue = queue.Queue()
+            shard_list = []
+            for index, (lower, upper) in enumerate(ranges):
+                shard_checkpoint = shard_checkpoints[index] if index < len(shard_checkpoints) else None
+                shard_list.append({
+                    'id': f"{job_id}#{index}", 'index': index, 'lower': lower, 'upper': upper,
+                    'start_key': shard_checkpoint['last_key'] if shard_checkpoint else None,
+                    'rows': shard_checkpoint['rows'] if shard_checkpoint else 0,
+                })
+                shard_queue.put(shard_list[-1])
+            stopped = threading.Event()
+            errors = []
+            with ExitStack() as stack:
+                # 任务自己的连接处理一组分片，其余连接按连接池的空闲名额获取
+                connections = [(sql_cursor, ch_client)]
+                while len(connections) < len(shard_list):
+                    shard_connections = open_shard_connections(stack)
+                    if shard_connections is None:
+                        break
+                    connections.append(shard_connections)
+                if len(connections) < len(shard_list):
+                    logging.info(f"连接池没有更多空闲连接，查询 {query_name} 的 {len(shard_list)} 个分片"
+                                 f"使用 {len(connections)} 个连接执行")
+                with ThreadPoolExecutor(max_workers=len(connections),
+                                        thread_name_prefix=f'shard-{target_table}') as executor:
+                    futures = [executor.submit(run_shard_worker, shard_cursor, shard_ch_client, shard_queue, stopped)
+                               for shard_cursor, shard_ch_client in connections]
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            errors.append(e)
+                # 在连接归还前抛出，出错的连接由连接池丢弃
+                if errors:
+                    raise errors[0]
+            logging.info(f"查询 {query_name} 的 {len(shard_list)} 个分片: "
+                         f"{', '.join(str(shard['rows']) for shard in shard_list)} 条记录")
+
+        def spool_batch(batch_data, fetch_seconds):
+            # 落盘模式只转换和写本地文件，不访问 ClickHouse
+            timings = {'fetch': fetch_seconds}
+            with measure_stage(timings, 'convert'):
+                columns_data = convert_batch_columnar(batch_data, converters)
+                if load_strategy != 'delete':
+                    columns_data.append(get_row_versions(batch_data, version_index, sync_version))
+            with measure_stage(timings, 'spool'):
+                write_spool_file(job_id, columns_data)
+            metrics.record_batch(len(batch_data), estimate_batch_bytes(columns_data, column_sizers), timings)
+
+            progress['rows'] += len(batch_data)
+            last_key = tuple(batch_data[-1][idx] for idx in primary_key_indexes)
+            store.save_checkpoint(job_id, last_key, progress['rows'], checkpoint_context)
+            logging.info(f"已暂存 {progress['rows']}/约{total_records or '?'} 条记录")
+
+        extracted = False
+        if spool:
+            # 断点失效时之前暂存的文件也不再有效
+            if not checkpoint:
+                clear_spool(job_id)
+            elif read_spool_manifest(job_id):
+                logging.info(f"任务 {job_id} 已完成抽取，直接加载暂存数据")
+                extracted = True
+            handle_batch = spool_batch
+        else:
+            handle_batch = load_batch
+
+        if shards > 1:
+            if checkpoint:
+                boundaries = list(checkpoint['last_key'])
+            else:
+                boundaries = plan_key_ranges(sql_cursor, sql_query, primary_key_columns[0], shards)
+                store.save_checkpoint(job_id, boundaries, 0, checkpoint_context)
+            run_shards(boundaries)
+        elif not extracted and streaming:
+            batches = iter_stream_batches(sql_cursor, sql_query, columns, primary_key_columns, fetch_size,
+                                          start_key=start_key)
+            # 读取耗时随批次一起放入队列
+            run_pipeline(metrics.iter_batches(batches), lambda item: handle_batch(*item), queue_size)
+        elif not extracted:
+            batches = iter_keyset_batches(sql_cursor, sql_query, columns, primary_key_columns, batch_size,
+                                          start_key=start_key)
+            for batch_data, fetch_seconds in metrics.iter_batches(batches):
+                handle_batch(batch_data, fetch_seconds)
+
+        if spool and not extracted:
+            write_spool_manifest(job_id, {
+                'job_id': job_id,
+                'context': checkpoint_context,
+                'target_table': target_table,
+                'insert_query': insert_query,
+                'primary_key_columns': primary_key_columns,
+                'primary_key_indexes': primary_key_indexes,
+                'delete_existing': delete_existing,
+                'load_strategy': load_strategy,
+                'partition_date': partition_date,
+                'full_refresh': full_refresh,
+                'fingerprint': fingerprint,
+                'sync_time': current_sync_time,
+                'started_at': start_time,
+                'rows': progress['rows'],
+            })
+            logging.info(f"查询 {query_name} 抽取完成，共暂存 {progress['rows']} 条记录")
+        if spool:
+            # 抽取已完成，先释放源连接，再加载暂存数据
+            if owns_sql_conn:
+                sql_conn.close()
+                sql_conn = None
+            if load_spooled:
+                load_spool(job_id, ch_client, metrics)
+            return
+
+        finish_query_sync(ch_client, job_id, target_table, load_strategy, full_refresh, fingerprint,
+                          current_sync_time, progress['rows'], time.time() - start_time, partition_date)
+        logging.info(f"查询 {query_name} 同步完成")
 
-        count_query = f"SELECT COUNT(*) FROM ({sql_query}) AS t"
-        sql_cursor.execute(count_query)
-        total_records = sql_cursor.fetchone()[0]
+    except Exception as e:
+        logging.error(f"同步查询 {query_name} 时发生错误: {str(e)}")
+        raise
+    finally:
+        if owns_sql_conn and sql_conn is not None:
+            sql_conn.close()
 
-        logging.info(f"开始同步查询 {query_name} 到表 {target_table}, 总记录数: {total_records}")
 
-        current_row = 0
-        while current_row < total_records:
-            batch_query = f"""
-                WITH numbered_rows AS (
-                    SELECT ROW_NUMBER() OVER (ORDER BY {', '.join(primary_key_columns)}) AS row_num, *
-                    FROM ({sql_query}) AS t
+def run_sync_job(config, sql_pool, ch_pool, retries=SYNC_JOB_RETRIES, metrics=None):
+    """
+    执行单个同步任务，失败后重新获取连接重试，已写入的批次由断点跳过
+    :param metrics: 任务的 JobMetrics，重试共用同一个，行数和耗时累计
+    """
+    options = {key: config[key] for key in SYNC_OPTION_KEYS if key in config}
+    if metrics is None:
+        metrics = JobMetrics(config['name'], config['source_name'], config['target_table'])
+    for attempt in range(retries + 1):
+        metrics.start()
+        try:
+            with sql_pool.connection() as sql_conn, ch_pool.connection() as ch_client:
+                sync_from_query(
+                    query_name=config['name'],
+                    sql_query=config['query'],
+                    target_table=config['target_table'],
+                    source_name=config['source_name'],
+                    primary_key_columns=config.get('primary_key_columns'),
+                    sql_conn=sql_conn,
+                    ch_client=ch_client,
+                    metrics=metrics,
+                    sql_pool=sql_pool,
+                    ch_pool=ch_pool,
+                    load_spooled=False,
+                    **options
                 )
-                SELECT {','.join([f'[{col}]' for col in columns])}
-                FROM numbered_rows
-                WHERE row_num > {current_row} AND row_num <= {current_row + batch_size}
-            """
-            print(batch_query)
-            sql_cursor.execute(batch_query)
-            batch_data = sql_cursor.fetchall()
+            # 落盘模式下源连接已归还连接池，再单独加载暂存数据
+            if options.get('spool') and metrics.status != 'skipped':
+                with ch_pool.connection() as ch_client:
+                    load_spool(options.get('job_id') or config['target_table'], ch_client, metrics)
+            break
+        except Exception as e:
+            if attempt >= retries:
+                metrics.finish('failed', str(e))
+                raise
+            wait_seconds = 10 * (attempt + 1)
+            logging.warning(f"同步任务 {config['name']} 第 {attempt + 1} 次失败，{wait_seconds} 秒后从断点重试: {str(e)}")
+            time.sleep(wait_seconds)
+    metrics.finish('success')
+    logging.info(f"完成 {config['name']} 的数据同步，{metrics.rows} 行，耗时 {metrics.seconds:.1f} 秒")
 
-            if not batch_data:
-                break
 
-            # rows = [convert_row_values(row) for row in batch_data]
-            # 转换 None 为 ""
-            rows = [[str(value) if value is not None else "" for value in row] for row in batch_data]
+def run_sync_jobs(sync_configs, max_workers_per_source=MAX_WORKERS_PER_SOURCE, run_metrics=None, on_job_done=None):
+    """
+    按数据源并发执行同步任务
+    每个数据源一个线程池和一个连接池，互不占用；ClickHouse 连接池由所有任务共享
+    单个任务失败不影响其他任务，全部结束后统一抛出
+    :param run_metrics: 收集各任务指标的 SyncRunMetrics，为空时新建；结束后导出指标文件
+    :param on_job_done: 每个任务结束后调用 on_job_done(config, error)，成功时 error 为None
+    """
+    if run_metrics is None:
+        run_metrics = SyncRunMetrics()
+    jobs_by_source = {}
+    for config in sync_configs:
+        jobs_by_source.setdefault(config['source_name'], []).append(config)
 
-            # 获取主键值并删除重复数据
-            primary_key_indexes = [columns.index(pk) for pk in primary_key_columns]
-            primary_keys = []
-            for row in rows:
-                key_values = tuple(row[idx] for idx in primary_key_indexes)
-                primary_keys.append(key_values)
+    sql_pools = {
+        source_name: ConnectionPool(source_name, lambda source_name=source_name: get_sqlserver_connection(source_name),
+                                    max_workers_per_source)
+        for source_name in jobs_by_source
+    }
+    ch_pool = ConnectionPool('ClickHouse', get_clickhouse_connection, max_workers_per_source * len(jobs_by_source))
+    executors = {
+        source_name: ThreadPoolExecutor(max_workers=max_workers_per_source, thread_name_prefix=f'sync-{source_name}')
+        for source_name in jobs_by_source
+    }
 
-            if primary_keys:
-                if len(primary_key_columns) == 1:
-                    delete_query = f"ALTER TABLE {target_table} DELETE WHERE {primary_key_columns[0]} IN {tuple(pk[0] for pk in primary_keys)}"
-                else:
-                    conditions = []
-                    for pk in primary_keys:
-                        condition = f"({', '.join(format_value_for_sql(v) for v in pk)})"
-                        conditions.append(condition)
-                    delete_query = f"ALTER TABLE {target_table} DELETE WHERE ({', '.join(primary_key_columns)}) IN ({', '.join(conditions)})"
+    failed_jobs = []
+    try:
+        futures = {}
+        for source_name, configs in jobs_by_source.items():
+            for config in configs:
+                job_metrics = run_metrics.job(config['name'], source_name, config['target_table'])
+                future = executors[source_name].submit(run_sync_job, config, sql_pools[source_name], ch_pool,
+                                                       metrics=job_metrics)
+                futures[future] = config
+
+        for future in as_completed(futures):
+            config = futures[future]
+            error = None
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"同步任务 {config['name']} 失败: {str(e)}")
+                failed_jobs.append(config['name'])
+                error = e
+            if on_job_done:
+                on_job_done(config, error)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+        for pool in list(sql_pools.values()) + [ch_pool]:
+            pool.close_all()
+        run_metrics.export()
 
-                ch_client.execute(delete_query)
+    if failed_jobs:
+        raise RuntimeError(f"{len(failed_jobs)} 个同步任务失败: {', '.join(failed_jobs)}")
 
-            insert_query = f"INSERT INTO {target_table} ({','.join(columns)}) VALUES"
-            print(insert_query)
-            print(rows)
-            ch_client.execute(insert_query, rows)
+def build_backfill_configs(start_date, end_date):
+    """
+    生成日期区间的回补任务：维表（不带 sync_date 的任务）只保留一份，按天的任务每天一份
+    :return: (日期列表, 维表任务, 按天的任务)
+    """
+    dates = []
+    current_date = start_date
+    while current_date.date() <= end_date.date():
+        dates.append(current_date.strftime('%Y-%m-%d'))
+        current_date += timedelta(days=1)
 
+    daily_configs = []
+    for formatted_date in dates:
+        daily_configs.extend(config for config in build_sync_configs(formatted_date) if config.get('sync_date'))
+    dimension_configs = [config for config in build_sync_configs(dates[-1]) if not config.get('sync_date')]
+    return dates, dimension_configs, daily_configs
 
-            current_row += batch_size
-            logging.info(f"已同步 {min(current_row, total_records)}/{total_records} 条记录")
 
-        save_last_sync_time(f"query_{query_name}", current_sync_time)
-        logging.info(f"查询 {query_name} 同步完成")
+def run_backfill(start_date, end_date, max_workers_per_source=MAX_WORKERS_PER_SOURCE):
+    """
+    按日期区间回补数据：维表只同步一次，按天的任务按日期顺序提交
+    同一数据源最多 max_workers_per_source 个任务并发，每完成一天输出一次进度
+    维表同步失败不影响按天的任务，全部结束后统一抛出
+    """
+    dates, dimension_configs, daily_configs = build_backfill_configs(start_date, end_date)
+    run_metrics = SyncRunMetrics()
+    errors = []
 
+    logging.info(f"开始回补 {dates[0]} 至 {dates[-1]} 共 {len(dates)} 天，先同步 {len(dimension_configs)} 个维表")
+    try:
+        run_sync_jobs(dimension_configs, max_workers_per_source, run_metrics)
     except Exception as e:
-        logging.error(f"同步查询 {query_name} 时发生错误: {str(e)}")
-        raise
-    finally:
-        sql_conn.close()
+        logging.error(f"维表同步失败，继续回补按天的数据: {str(e)}")
+        errors.append(str(e))
+
+    remaining = {}
+    for config in daily_configs:
+        remaining[config['sync_date']] = remaining.get(config['sync_date'], 0) + 1
+    failed_by_date = {}
+    completed_dates = []
+    progress_lock = threading.Lock()
+
+    def on_job_done(config, error):
+        with progress_lock:
+            sync_date = config['sync_date']
+            if error is not None:
+                failed_by_date.setdefault(sync_date, []).append(config['name'])
+            remaining[sync_date] -= 1
+            if remaining[sync_date] == 0:
+                completed_dates.append(sync_date)
+                failed = failed_by_date.get(sync_date)
+                logging.info(f"回补进度: {sync_date} {'失败任务 ' + ', '.join(failed) if failed else '完成'} "
+                             f"({len(completed_dates)}/{len(dates)} 天)")
+
+    try:
+        run_sync_jobs(daily_configs, max_workers_per_source, run_metrics, on_job_done)
+    except Exception as e:
+        errors.append(str(e))
+
+    if errors:
+        raise RuntimeError(f"回补 {dates[0]} 至 {dates[-1]} 有任务失败，失败日期: "
+                           f"{', '.join(sorted(failed_by_date)) or '无'}; {'; '.join(errors)}")
+
+
+def plan_sync_jobs(sync_configs):
+    """
+    生成同步计划：按目录统计和优化器估算行数，结合历史吞吐估算耗时，不读取任何数据
+    """
+    store = get_checkpoint_store()
+    plans = []
+    for source_name in dict.fromkeys(config['source_name'] for config in sync_configs):
+        sql_conn = get_sqlserver_connection(source_name)
+        try:
+            sql_cursor = sql_conn.cursor()
+            for config in sync_configs:
+                if config['source_name'] != source_name:
+                    continue
+                estimated_rows = estimate_query_rows(sql_cursor, config['query'])
+                throughput = store.get_throughput(config['target_table'])
+                estimated_seconds = estimated_rows / throughput if estimated_rows is not None and throughput else None
+                plans.append({
+                    'name': config['name'],
+                    'source_name': source_name,
+                    'target_table': config['target_table'],
+                    'estimated_rows': estimated_rows,
+                    'throughput': throughput,
+                    'estimated_seconds': estimated_seconds,
+                })
+        finally:
+            sql_conn.close()
+    return plans
+
+
+def print_sync_plan(plans, max_workers_per_source=MAX_WORKERS_PER_SOURCE):
+    print(f"{'任务':<40}{'数据源':<16}{'估算行数':>14}{'历史吞吐(行/秒)':>18}{'预计耗时(秒)':>14}")
+    for plan in plans:
+        rows = plan['estimated_rows'] if plan['estimated_rows'] is not None else '未知'
+        throughput = f"{plan['throughput']:.0f}" if plan['throughput'] else '无记录'
+        seconds = f"{plan['estimated_seconds']:.0f}" if plan['estimated_seconds'] is not None else '未知'
+        print(f"{plan['name']:<40}{plan['source_name']:<16}{rows:>14}{throughput:>18}{seconds:>14}")
+
+    # 各数据源并发执行，总耗时取决于最慢的数据源；未分片的任务无法拆分，不会短于其中最长的任务
+    source_seconds = {}
+    for plan in plans:
+        if plan['estimated_seconds'] is not None:
+            total, longest = source_seconds.get(plan['source_name'], (0, 0))
+            source_seconds[plan['source_name']] = (total + plan['estimated_seconds'],
+                                                   max(longest, plan['estimated_seconds']))
+    if source_seconds:
+        source_estimates = {
+            source: max(total / max_workers_per_source, longest)
+            for source, (total, longest) in source_seconds.items()
+        }
+        slowest_source = max(source_estimates, key=source_estimates.get)
+        print(f"预计总耗时约 {source_estimates[slowest_source]:.0f} 秒 "
+              f"(最慢数据源 {slowest_source}，每个数据源并发 {max_workers_per_source})")
+
 
 def  sendwxmessage(messagetxt):
     url = "https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key=8e2c8435-abdd-4341-883f-ddd703f375f3"   #这里就是群机器人的Webhook地址
@@ -494,22 +2629,7 @@ def  sendwxmessage(messagetxt):
 
 
 
-def main():
-    # 检查命令行参数
-    if len(sys.argv) > 1:
-        try:
-            sync_date = datetime.strptime(sys.argv[1], '%Y-%m-%d')
-            formatted_date = sync_date.strftime('%Y-%m-%d')
-        except ValueError:
-            logging.error("日期格式错误，请使用 YYYY-MM-DD 格式，例如: 2025-03-27")
-            return
-    else:
-        sync_date = datetime.now() - timedelta(days=1)
-        formatted_date = sync_date.strftime('%Y-%m-%d')
-
-    start_time = time.time()
-    logging.info(f"开始同步 {formatted_date} 的数据")
-
+def build_sync_configs(formatted_date):
     # 定义同步配置
     sync_configs = [
         {
@@ -519,7 +2639,14 @@ def main():
                 WHERE TransferDate = '{formatted_date}'
             """,
             'target_table': 'CLICKHOUSE_VIEWI',
+            'job_id': f'CLICKHOUSE_VIEWI_{formatted_date}',
+            'sync_date': formatted_date,  # 按天同步的任务，回补时逐天执行
             'primary_key_columns': ['BookPID'],
+            # 当天数据写入临时表后整分区替换，重跑不会产生重复数据
+            'load_strategy': 'partition',
+            'partition_column': 'TransferDate',
+            'partition_date': formatted_date,
+            'shards': SYNC_SHARDS,
             'source_name': 'ENTA'  # 指定数据源
         },
         {
@@ -529,7 +2656,14 @@ def main():
                 WHERE TransferDate = '{formatted_date}'
             """,
             'target_table': 'CLICKHOUSE_VIEWD',
+            'job_id': f'CLICKHOUSE_VIEWD_{formatted_date}',
+            'sync_date': formatted_date,  # 按天同步的任务，回补时逐天执行
             'primary_key_columns': ['BookPID'],
+            # 当天数据写入临时表后整分区替换，重跑不会产生重复数据
+            'load_strategy': 'partition',
+            'partition_column': 'TransferDate',
+            'partition_date': formatted_date,
+            'shards': SYNC_SHARDS,
             'source_name': 'ENTA'  # 指定数据源
         },
         {
@@ -570,6 +2704,7 @@ def main():
            SELECT * FROM CountryCityAirportState  """,
             'target_table': 'CountryCityAirportState',
             'primary_key_columns': ['ID'],
+            'load_strategy': 'staging',  # 写入临时表后一次合并，不产生 ALTER DELETE mutation
             'source_name': 'dlfreightrate'  # 指定数据源
         },
         {
@@ -578,6 +2713,7 @@ def main():
                SELECT * FROM SALEON  """,
             'target_table': 'SALEON',
             'primary_key_columns': ['SALEON'],
+            'load_strategy': 'staging',  # 写入临时表后一次合并，不产生 ALTER DELETE mutation
             'source_name': 'ENTA'  # 指定数据源
         },
         {
@@ -586,23 +2722,204 @@ def main():
                    SELECT * FROM CompanyThirdPart  """,
             'target_table': 'CompanyThirdPart',
             'primary_key_columns': ['ID'],
+            'load_strategy': 'staging',  # 写入临时表后一次合并，不产生 ALTER DELETE mutation
             'source_name': 'ENTA'  # 指定数据源
         }
 
 
 
     ]
+    return sync_configs
 
-    # 执行所有同步任务
-    for config in sync_configs:
-        sync_from_query(
-            query_name=config['name'],
-            sql_query=config['query'],
-            target_table=config['target_table'],
-            source_name=config['source_name'],
-            primary_key_columns=config.get('primary_key_columns')
-        )
-        logging.info(f"完成 {config['name']} 的数据同步")
+
+def get_table_disk_usage(ch_client, table_name):
+    """
+    :return: (压缩后字节数, 未压缩字节数)
+    """
+    rows = ch_client.execute(
+        "SELECT sum(data_compressed_bytes), sum(data_uncompressed_bytes) FROM system.parts "
+        "WHERE active AND database = currentDatabase() AND table = %(table)s",
+        {'table': table_name}
+    )
+    return rows[0] if rows and rows[0][0] is not None else (0, 0)
+
+
+def build_migrate_expression(column, old_type, new_type):
+    """
+    生成把原表的列复制到新表的表达式：旧版同步写入的 String 列中空字符串表示 NULL，bit 列为 'True'/'False'，
+    无法解析的值在可空列中为 NULL，在不可空列中为类型的零值，避免隐式 CAST 失败
+    """
+    quoted = f"`{column}`"
+    new_base = unwrap_clickhouse_type(new_type)
+    if unwrap_clickhouse_type(old_type) != 'String' or new_base == 'String':
+        return quoted
+
+    nullable = new_type.startswith('Nullable(')
+    suffix = 'OrNull' if nullable else 'OrZero'
+    value = f"nullIf({quoted}, '')" if nullable else quoted
+    if new_base.startswith('Decimal('):
+        precision, scale = (int(part) for part in new_base[len('Decimal('):-1].split(','))
+        bits = 32 if precision <= 9 else 64 if precision <= 18 else 128 if precision <= 38 else 256
+        return f"toDecimal{bits}{suffix}({value}, {scale})"
+    if new_base.startswith('DateTime64('):
+        return f"parseDateTime64BestEffort{suffix}({value}, {new_base[len('DateTime64('):-1]})"
+    if new_base == 'DateTime':
+        return f"parseDateTimeBestEffort{suffix}({value})"
+    converted = f"to{new_base}{suffix}({value})"
+    if new_base == 'UInt8':
+        return f"multiIf({quoted} IN ('True', 'true'), 1, {quoted} IN ('False', 'false'), 0, {converted})"
+    return converted
+
+
+def rebuild_table(ch_client, target_table, column_types, primary_key_columns, load_strategy, partition_column=None,
+                  optimize_storage=True):
+    """
+    按给定的列类型和当前的建表规则（LowCardinality、列压缩编码、分区）重建已有的表：
+    新建 <表名>__migrate 并复制全部数据，行数一致后与原表交换并删除原表，失败时原表不受影响。
+    迁移期间写入原表的数据不会复制到新表。
+    :param column_types: 新表的 [(列名, ClickHouse类型), ...]
+    """
+    existing_types = get_clickhouse_column_types(ch_client, target_table)
+    migrate_table_name = f"{target_table}{MIGRATE_TABLE_SUFFIX}"
+    ch_client.execute(f"DROP TABLE IF EXISTS {migrate_table_name}")
+    ch_client.execute(build_create_table_query(
+        migrate_table_name, column_types, primary_key_columns, load_strategy, partition_column, optimize_storage,
+        version_column=True if SYNC_VERSION_COLUMN in existing_types else None))
+
+    # 只复制两边都有的列，旧版的 String 列按新类型逐列转换
+    new_types = get_clickhouse_column_types(ch_client, migrate_table_name)
+    common = [col for col in new_types if col in existing_types]
+    common_columns = ', '.join(f'`{col}`' for col in common)
+    select_columns = ', '.join(build_migrate_expression(col, existing_types[col], new_types[col]) for col in common)
+    logging.info(f"开始迁移表 {target_table}，新表结构: {', '.join(f'{col} {ch_type}' for col, ch_type in column_types)}")
+    try:
+        ch_client.execute(f"INSERT INTO {migrate_table_name} ({common_columns}) "
+                          f"SELECT {select_columns} FROM {target_table}")
+        old_rows = ch_client.execute(f"SELECT count() FROM {target_table}")[0][0]
+        new_rows = ch_client.execute(f"SELECT count() FROM {migrate_table_name}")[0][0]
+        if old_rows != new_rows:
+            raise ValueError(f"迁移后行数不一致: 原表 {old_rows} 行，新表 {new_rows} 行")
+    except Exception:
+        ch_client.execute(f"DROP TABLE IF EXISTS {migrate_table_name}")
+        raise
+
+    old_compressed, old_uncompressed = get_table_disk_usage(ch_client, target_table)
+    new_compressed, _ = get_table_disk_usage(ch_client, migrate_table_name)
+    swap_shadow_table(ch_client, target_table, migrate_table_name)
+    logging.info(f"表 {target_table} 迁移完成，共 {new_rows} 行，压缩后大小 {old_compressed / 1048576:.1f} MB -> "
+                 f"{new_compressed / 1048576:.1f} MB（未压缩 {old_uncompressed / 1048576:.1f} MB）")
+
+
+def migrate_table(target_table, formatted_date):
+    """
+    按同步配置的源查询和当前的建表规则重建已有的表，见 rebuild_table，应在没有同步任务执行时运行
+    """
+    config = next((c for c in build_sync_configs(formatted_date) if c['target_table'] == target_table), None)
+    if config is None:
+        # 不在同步配置中的表（sync_table 按表名同步）
+        config = {'query': f"SELECT * FROM {target_table}", 'target_table': target_table}
+
+    ch_client = get_clickhouse_connection()
+    if not clickhouse_table_exists(ch_client, target_table):
+        raise ValueError(f"表 {target_table} 不存在")
+
+    sql_conn = get_sqlserver_connection(config.get('source_name'))
+    try:
+        sql_cursor = sql_conn.cursor()
+        column_infos = describe_query_columns(sql_cursor, config['query'])
+        primary_key_columns = (config.get('primary_key_columns')
+                               or [col.column_name for col in get_table_schema(sql_cursor, target_table)
+                                   if col.is_primary_key]
+                               or [column_infos[0][0]])
+        if config.get('typed_columns', True):
+            column_types = get_clickhouse_columns(column_infos, primary_key_columns)
+            column_types = optimize_column_types(sql_cursor, config['query'], column_infos, column_types,
+                                                 primary_key_columns)
+        else:
+            column_types = [(info[0], 'String') for info in column_infos]
+    finally:
+        sql_conn.close()
+
+    rebuild_table(ch_client, target_table, column_types, primary_key_columns, config.get('load_strategy', 'delete'),
+                  config.get('partition_column'))
+
+
+def main():
+    # 检查命令行参数
+    parser = argparse.ArgumentParser(description='SQL Server 数据同步到 ClickHouse')
+    parser.add_argument('date', nargs='?', help='同步日期，格式 YYYY-MM-DD，默认为昨天')
+    parser.add_argument('--from', dest='from_date', help='回补起始日期，格式 YYYY-MM-DD')
+    parser.add_argument('--to', dest='to_date', help='回补结束日期（含），默认为昨天')
+    parser.add_argument('--parallel', type=int, default=MAX_WORKERS_PER_SOURCE,
+                        help='每个数据源同时执行的任务数')
+    parser.add_argument('--plan', action='store_true', help='只输出同步计划（估算行数和耗时），不执行同步')
+    parser.add_argument('--load-spool', action='store_true', help='只加载已抽取到本地暂存目录的数据，不访问源库')
+    parser.add_argument('--migrate-table', action='append', metavar='TABLE',
+                        help='按当前建表规则重建已有的表（可重复指定），应在没有同步任务执行时运行')
+    args = parser.parse_args()
+
+    if args.load_spool:
+        load_pending_spools()
+        return
+
+    if args.migrate_table:
+        formatted_date = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        for table_name in args.migrate_table:
+            try:
+                migrate_table(table_name, formatted_date)
+            except Exception as e:
+                logging.error(f"迁移表 {table_name} 失败: {str(e)}")
+                sys.exit(1)
+        return
+
+    if args.from_date or args.to_date:
+        if args.date:
+            logging.error("指定同步日期时不能同时使用 --from/--to")
+            return
+        try:
+            start_date = datetime.strptime(args.from_date, '%Y-%m-%d') if args.from_date else None
+            end_date = (datetime.strptime(args.to_date, '%Y-%m-%d') if args.to_date
+                        else datetime.now() - timedelta(days=1))
+        except ValueError:
+            logging.error("日期格式错误，请使用 YYYY-MM-DD 格式，例如: 2025-03-27")
+            return
+        if start_date is None or start_date.date() > end_date.date():
+            logging.error("回补需要指定 --from，且不能晚于 --to")
+            return
+
+        if args.plan:
+            _, dimension_configs, daily_configs = build_backfill_configs(start_date, end_date)
+            print_sync_plan(plan_sync_jobs(dimension_configs + daily_configs), args.parallel)
+            return
+
+        start_time = time.time()
+        run_backfill(start_date, end_date, args.parallel)
+        logging.info(f"回补完成，总耗时: {time.time() - start_time:.2f} 秒")
+        sendwxmessage(f"CLICKHOUSE已回补 {start_date.strftime('%Y-%m-%d')} 至 {end_date.strftime('%Y-%m-%d')}")
+        return
+
+    if args.date:
+        try:
+            sync_date = datetime.strptime(args.date, '%Y-%m-%d')
+            formatted_date = sync_date.strftime('%Y-%m-%d')
+        except ValueError:
+            logging.error("日期格式错误，请使用 YYYY-MM-DD 格式，例如: 2025-03-27")
+            return
+    else:
+        sync_date = datetime.now() - timedelta(days=1)
+        formatted_date = sync_date.strftime('%Y-%m-%d')
+
+    sync_configs = build_sync_configs(formatted_date)
+
+    if args.plan:
+        print_sync_plan(plan_sync_jobs(sync_configs), args.parallel)
+        return
+
+    start_time = time.time()
+    logging.info(f"开始同步 {formatted_date} 的数据")
+
+    # 按数据源并发执行所有同步任务
+    run_sync_jobs(sync_configs, args.parallel)
 
     end_time = time.time()
     logging.info(f"所有同步任务完成，总耗时: {end_time - start_time:.2f} 秒")
@@ -7,3 +7,7 @@ PROJECT_TYPE="cron"
 # 定时任务配置
 CRON_SCHEDULE="0 */2 * * *"  # 每2小时执行一次
 CRON_COMMAND="cd /app/$PROJECT_NAME && python3 main.py"
+
+# 同步耗时可能超过调度间隔：上一次未结束时跳过，并计入重任务名额
+OVERLAP_POLICY="skip"
+JOB_HEAVY="true"